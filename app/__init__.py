@@ -7,14 +7,18 @@ flask run
 """
 
 import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask, g, request
-from flask_docs import ApiDoc
 from flask_log_request_id import RequestID
-import seqlog
 
 import app.database as db
-from config import Config, JsonEncoder
-from app import logging_into_seq, urls as main
+from config import Config
+from app import (admission, deadlines, http_cache, logging_into_seq, metrics, payloads,
+                 serialization, startup, urls as main)
+
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 
 def create_app(config_class=Config):
@@ -29,37 +33,51 @@ def create_app(config_class=Config):
 
     RequestID(app) - сохранение и получение RequestID каждого запроса
 
-    ApiDoc(app) - автодокументирование проекта
+    ApiDoc(app) - автодокументирование проекта. Разбор docstring всех view при запуске
+    дорогой, поэтому flask_docs импортируется и подключается только при API_DOC_ENABLED
 
     database.init_app(app) - подключает базу данных к созданному приложению
 
-    app.json_encoder - устанавливаем свой инкодер json с поддержкой Decimal
+    serialization.init_app(app) - устанавливаем свой инкодер json (orjson с поддержкой Decimal,
+    дат и UUID, см. app.serialization)
+
+    metrics.init_app(app) - замеры времени запроса, заголовок Server-Timing и /metrics
+
+    http_cache.init_app(app) - ETag, ответы 304, сжатие ответов и Cache-Control endpoint
 
-    seqlog.log_to_seq - настройки логирования в 'seq'
+    logging_into_seq.init_app(app) - настройки логирования в 'seq' через фоновую очередь
+
+    deadlines.init_app(app) - срок запроса (заголовок или значение endpoint): statement_timeout
+    sql запросов и отмена запросов, не уложившихся в срок, ответ 504
+
+    payloads.init_app(app) - фоновое обновление заранее подготовленных ответов endpoint
+
+    admission.init_app(app) - адаптивное ограничение одновременных запросов к базам данных,
+    при перегрузке - ответ 503 с Retry-After. Регистрируется после before_request фабрики
 
     app.register_blueprint() - импортирует и зарегистрирует новый блок для
     созданного приложения. В нашем случае создаст ссылку по имени подраздела:
         /basket/.../.../
 
     app.add_url_rule() -  установит '/' как index для всех разделов.
+
+    startup.init_app(app) - замеры импорта, create_app и первого запроса в /metrics
     """
 
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config_class)
     RequestID(app)
-    ApiDoc(app)
+    if app.config['API_DOC_ENABLED']:
+        from flask_docs import ApiDoc
+        ApiDoc(app)
+    serialization.init_app(app)
+    metrics.init_app(app)
+    http_cache.init_app(app)
+    logging_into_seq.init_app(app)
     db.init_app(app)
-    app.json_encoder = JsonEncoder
-
-    seq_log_config = app.config['SEQ_LOG_CONF']
-    seqlog.log_to_seq(
-        server_url=seq_log_config['server_url'],
-        api_key=seq_log_config['api_key'],
-        level=seq_log_config['level'],
-        batch_size=seq_log_config['batch_size'],
-        auto_flush_timeout=seq_log_config['auto_flush_timeout'],  # seconds
-        override_root_logger=seq_log_config['override_root_logger'],
-        json_encoder_class=app.json_encoder, )
+    deadlines.init_app(app)
+    payloads.init_app(app)
 
     app.register_blueprint(main.bp)
 
@@ -72,18 +90,19 @@ def create_app(config_class=Config):
     @app.before_request
     def before_request():
         """Перед началом обработки запроса"""
-        data_bases_names = app.config["PROJECT_DATA_BASES"].keys()
-        g.db_connections = dict.fromkeys(data_bases_names)
-        g.start = time.time()
+        g.start = time.perf_counter()
         logging_into_seq.send_log_to_seq(
             f"Get request, path: {request.path}")
 
     @app.after_request
     def after_request(response):
         """По окончании выполнения запроса"""
-        diff = time.time() - g.start
+        diff = time.perf_counter() - g.start
         logging_into_seq.send_log_to_seq(f"Запрос обработан.",
                                          {"elapsed_time": diff})
         return response
 
+    admission.init_app(app)
+    startup.init_app(app, started, _IMPORT_SECONDS)
+
     return app
@@ -0,0 +1,246 @@
+"""Адаптивное ограничение одновременных запросов к базам данных
+
+Запрос к /<имя базы данных>/... перед обработкой получает разрешение у ограничителя
+своей базы. Ограничитель пропускает не больше limit запросов одновременно,
+остальные ждут в очереди не дольше DB_ADMISSION_QUEUE_TIMEOUT секунд и не дольше
+остатка срока запроса (app.deadlines). Если очередь
+(DB_ADMISSION_QUEUE_SIZE мест) заполнена или время ожидания вышло, запрос сразу
+получает 503 с заголовком Retry-After - при перегрузке задержка остается
+ограниченной, а не растет вместе с очередью к пулу соединений.
+
+limit подбирается по задержке базы данных (AIMD): пока среднее время sql запроса
+в завершенном запросе не превышает базовое больше чем в DB_ADMISSION_TOLERANCE раз
+(плюс 10 мс),
+limit медленно растет (на 1/limit за запрос), при превышении или нехватке соединений
+в пуле - уменьшается в 0.9 раза. Базовое время - минимальное наблюдаемое время
+запроса, медленно подтягивающееся к текущему.
+"""
+
+import threading
+import time
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import ServiceUnavailable
+from app import db_pools, deadlines, logging_into_seq, metrics
+
+_STATS_NAMES = ('admitted', 'queued', 'rejected', 'timeouts', 'decreases', 'overloads')
+
+_DECREASE_FACTOR = 0.9
+# Скорость, с которой базовое время подтягивается к текущему
+_BASELINE_DRIFT = 0.01
+# Допустимое превышение базового времени в секундах сверх DB_ADMISSION_TOLERANCE:
+# колебания запросов в доли миллисекунды - не перегрузка
+_LATENCY_SLACK = 0.01
+
+# db_name -> Limiter
+LIMITERS = {}
+
+_LOCK = threading.Lock()
+
+
+class Overloaded(ServiceUnavailable):
+    """База данных перегружена: ответ 503 с Retry-After"""
+
+    def __init__(self, db_name, retry_after=1, reason=''):
+        super().__init__(f"База данных '{db_name}' перегружена{reason}, повторите запрос позже.",
+                         retry_after=retry_after)
+        self.db_name = db_name
+
+
+class Limiter:
+    """Ограничитель одновременных запросов одной базы данных с очередью ожидания"""
+
+    def __init__(self, db_name, limit, max_limit, queue_size, tolerance):
+        self.db_name = db_name
+        self.limit = float(limit)
+        self.min_limit = 1
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.tolerance = tolerance
+        self.inflight = 0
+        self.waiting = 0
+        self.baseline = None
+        self.decrease_after = 0.0
+        self.condition = threading.Condition()
+        self.stats = metrics.Counters(_STATS_NAMES)
+
+    def _has_slot(self):
+        return self.inflight < max(int(self.limit), self.min_limit)
+
+    def acquire(self, timeout):
+        """Занимает место. Возвращает None или причину отказа: 'queue_full', 'timeout'"""
+
+        with self.condition:
+            if self._has_slot():
+                self.inflight += 1
+                self.stats.add('admitted')
+                return None
+
+            if self.waiting >= self.queue_size:
+                self.stats.add('rejected')
+                return 'queue_full'
+
+            self.waiting += 1
+            self.stats.add('queued')
+            deadline = time.monotonic() + timeout
+            try:
+                while not self._has_slot():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.add('timeouts')
+                        return 'timeout'
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.inflight += 1
+            self.stats.add('admitted')
+            return None
+
+    def release(self, latency=None, overloaded=False):
+        """Освобождает место и корректирует limit.
+
+        latency - среднее время sql запроса в завершенном запросе (None - запросов
+        не было), overloaded - в запросе не хватило соединений пула."""
+
+        with self.condition:
+            self.inflight -= 1
+            now = time.monotonic()
+
+            if latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += _BASELINE_DRIFT * (latency - self.baseline)
+
+            threshold = (self.baseline * self.tolerance + _LATENCY_SLACK
+                         if self.baseline is not None else None)
+            if overloaded or (latency is not None and latency > threshold):
+                # Не чаще одного уменьшения за время запроса, иначе одна пачка
+                # медленных запросов обрушит limit до минимума.
+                if now >= self.decrease_after:
+                    self.limit = max(self.limit * _DECREASE_FACTOR, self.min_limit)
+                    self.decrease_after = now + (threshold or _LATENCY_SLACK)
+                    self.stats.add('decreases')
+            elif latency is not None and self.inflight + 1 >= self.limit / 2:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+            self.condition.notify(max(int(self.limit) - self.inflight, 1))
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats['limit'] = self.limit
+        stats['inflight'] = self.inflight
+        stats['waiting'] = self.waiting
+        stats['baseline_latency'] = self.baseline or 0.0
+        return stats
+
+
+def _pool_size(db_name):
+    """Сколько соединений всего у базы данных: основной сервер и реплики"""
+
+    size = 0
+    for key in (db_name, *db_pools.get_replicas(db_name)):
+        params = db_pools.get_pool_params(key)
+        size += params.get('maxconn') or params.get('minconn') or 1
+
+    return size
+
+
+def get_limiter(db_name):
+    limiter = LIMITERS.get(db_name)
+    if limiter is None:
+        with _LOCK:
+            limiter = LIMITERS.get(db_name)
+            if limiter is None:
+                config = current_app.config
+                pool_size = _pool_size(db_name)
+                limiter = LIMITERS[db_name] = Limiter(
+                    db_name, pool_size, config['DB_ADMISSION_MAX_LIMIT'] or 2 * pool_size,
+                    config['DB_ADMISSION_QUEUE_SIZE'], config['DB_ADMISSION_TOLERANCE'])
+
+    return limiter
+
+
+def report_overload(db_name):
+    """В запросе не хватило соединений пула db_name - сигнал для уменьшения limit"""
+
+    g.setdefault('admission_overloaded', set()).add(db_name)
+    limiter = LIMITERS.get(db_name)
+    if limiter is not None:
+        limiter.stats.add('overloads')
+
+
+def _request_db_name():
+    if request.url_rule is None:
+        return None
+    db_name = request.url_rule.rule.split('/')[1]
+    if db_name not in current_app.config['PROJECT_DATA_BASES']:
+        return None
+    return db_name
+
+
+def admit():
+    """before_request: ждет разрешения ограничителя базы данных запроса или отклоняет запрос"""
+
+    db_name = _request_db_name()
+    if db_name is None:
+        return
+
+    # Ожидание в очереди не дольше остатка срока запроса (см. app.deadlines)
+    timeout = current_app.config['DB_ADMISSION_QUEUE_TIMEOUT']
+    left = deadlines.remaining()
+    if left is not None:
+        timeout = min(timeout, left)
+
+    limiter = get_limiter(db_name)
+    reason = limiter.acquire(timeout)
+    if reason is not None:
+        logging_into_seq.send_log_to_seq(
+            f"Запрос отклонен: база данных '{db_name}' перегружена ({reason}).",
+            {'limit': limiter.limit, 'inflight': limiter.inflight, 'waiting': limiter.waiting})
+        raise Overloaded(db_name, current_app.config['DB_ADMISSION_RETRY_AFTER'])
+
+    g.admission_db_name = db_name
+
+
+def release(e=None):
+    """teardown_request: освобождает место и передает ограничителю задержку базы данных"""
+
+    db_name = g.pop('admission_db_name', None)
+    if db_name is None:
+        return
+
+    perf = g.get('perf') or {}
+    queries = perf.get('queries')
+    latency = (perf.get('db', 0.0) + perf.get('pool', 0.0)) / queries if queries else None
+    LIMITERS[db_name].release(latency, db_name in g.get('admission_overloaded', ()))
+
+
+def handle_overloaded(error):
+    """Ответ 503 в формате JSON с заголовком Retry-After"""
+
+    response = jsonify({'error': error.description})
+    response.status_code = error.code
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def get_stats():
+    return {db_name: limiter.get_stats() for db_name, limiter in list(LIMITERS.items())}
+
+
+def init_app(app):
+    """Регистрирует ограничение запросов, если включен DB_ADMISSION.
+
+    Вызывается последним в create_app: before_request выполняются в порядке
+    регистрации, и отклоненный запрос уже прошел остальные before_request
+    (g.perf, g.start), которые нужны after_request."""
+
+    app.register_error_handler(Overloaded, handle_overloaded)
+    if not app.config['DB_ADMISSION']:
+        return
+
+    app.before_request(admit)
+    app.teardown_request(release)
+    metrics.register_collector('bc_admission', 'database', get_stats)
+
@@ -0,0 +1,182 @@
+"""Пакетная запись в базу данных
+
+Вместо запроса на каждую строку данные отправляются пачками:
+    insert_many - INSERT ... VALUES %s через psycopg2.extras.execute_values;
+    execute_many - один запрос с разными параметрами через psycopg2.extras.execute_batch;
+    copy_rows - COPY ... FROM STDIN, строки кодируются в текстовый формат COPY по мере чтения.
+
+Каждая функция выполняется в транзакции database.transaction (или в уже открытой),
+сбрасывает кеш результатов для изменяемой таблицы и возвращает статистику: количество
+строк, команд с данными (без BEGIN, SET LOCAL и COMMIT транзакции), время и строк
+в секунду.
+"""
+
+import json
+import math
+import time
+import psycopg2.extras
+from psycopg2 import sql
+from flask import current_app
+from app import database, logging_into_seq
+
+
+def _report(operation, rows, statements, started):
+    """Логирует и возвращает статистику пакетной записи"""
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        'rows': rows,
+        'statements': statements,
+        'elapsed_time': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else None,
+    }
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL - - {operation}: {rows} запись(ей) за {statements} команд(ы).",
+        dict(stats))
+
+    return stats
+
+
+def insert_many(query, rows, db_name=None, template=None, page_size=None):
+    """Пакетная вставка строк.
+
+    query содержит один плейсхолдер %s на месте списка значений:
+        INSERT INTO odds (match_id, value) VALUES %s
+    rows - последовательность кортежей (или словарей вместе с template).
+    За одно обращение к серверу вставляется page_size строк
+    (по умолчанию DB_BATCH_PAGE_SIZE из config.py).
+    """
+
+    db_name = database.check_db_name(db_name)
+    rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+    page_size = page_size or current_app.config['DB_BATCH_PAGE_SIZE']
+    started = time.perf_counter()
+
+    with database.transaction(db_name) as cursor:
+        psycopg2.extras.execute_values(cursor, query, rows,
+                                       template=template, page_size=page_size)
+        database.invalidate_cache(db_name, query)
+
+    return _report("Пакетная вставка", len(rows),
+                   math.ceil(len(rows) / page_size), started)
+
+
+def execute_many(query, rows, db_name=None, page_size=None):
+    """Выполняет запрос query для каждого набора параметров из rows.
+
+    Подходит для пакетных UPDATE/DELETE: запросы склеиваются в пачки по page_size
+    (по умолчанию DB_BATCH_PAGE_SIZE из config.py) и отправляются за одно обращение.
+    """
+
+    db_name = database.check_db_name(db_name)
+    rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+    page_size = page_size or current_app.config['DB_BATCH_PAGE_SIZE']
+    started = time.perf_counter()
+
+    with database.transaction(db_name) as cursor:
+        psycopg2.extras.execute_batch(cursor, query, rows, page_size=page_size)
+        database.invalidate_cache(db_name, query)
+
+    return _report("Пакетное выполнение", len(rows),
+                   math.ceil(len(rows) / page_size), started)
+
+
+def _array_element(value):
+    """Элемент литерала массива PostgreSQL"""
+
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (list, tuple)):
+        return _array_literal(value)
+
+    text = _text_value(value)
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _array_literal(values):
+    """Литерал массива PostgreSQL: {1,2}, {"a","b"}, {{1,2},{3,4}}"""
+
+    return '{' + ','.join(map(_array_element, values)) + '}'
+
+
+def _text_value(value):
+    """Текстовое представление значения для PostgreSQL: списки - массивы,
+    словари и psycopg2.extras.Json - json, bytes - bytea в шестнадцатеричном формате.
+    Список для столбца json передается, как и в psycopg2, через Json(список)"""
+
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (list, tuple)):
+        return _array_literal(value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, psycopg2.extras.Json):
+        return value.dumps(value.adapted)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+
+    return str(value)
+
+
+def _copy_value(value):
+    """Значение в текстовом формате COPY"""
+
+    if value is None:
+        return '\\N'
+
+    return (_text_value(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyRowsReader:
+    """Файлоподобный объект для cursor.copy_expert.
+
+    Кодирует строки в текстовый формат COPY по мере того, как psycopg2 читает
+    данные, поэтому весь набор строк в памяти не собирается."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        lines = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = '\t'.join(map(_copy_value, row)) + '\n'
+            lines.append(line)
+            length += len(line)
+            self.count += 1
+
+        data = ''.join(lines)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(table, columns, rows, db_name=None):
+    """Загрузка большого количества строк через COPY table (columns) FROM STDIN.
+
+    rows - итерируемый объект кортежей в порядке columns, может быть генератором.
+    Данные передаются одним COPY, что для тысяч строк быстрее любых INSERT.
+    """
+
+    db_name = database.check_db_name(db_name)
+    started = time.perf_counter()
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(*table.split('.')),
+        sql.SQL(', ').join(map(sql.Identifier, columns)))
+    reader = CopyRowsReader(rows)
+
+    with database.transaction(db_name) as cursor:
+        cursor.copy_expert(query, reader)
+        database.invalidate_cache(db_name, None, tables={table.split('.')[-1].lower()})
+
+    return _report(f"COPY в {table}", reader.count, 1, started)
@@ -7,14 +7,18 @@
 Он создается при обработке запроса и закрывается перед отправкой ответа.
 """
 
+import contextlib
+import time
+import uuid
 import psycopg2
 import psycopg2.extras
 from psycopg2 import Error, pool
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from flask import current_app, g, request
-from app import logging_into_seq
+from app import (admission, db_pools, db_routing, deadlines, logging_into_seq, metrics,
+                 prepared_statements, query_profiler, result_cache, single_flight)
+from app.row_factories import ROW_COLUMNS, ROW_DICT, make_row, make_rows, rows_count
 
-POOLS = {}
+POOLS = db_pools.POOLS
 
 
 def get_db_name_from_request():
@@ -34,30 +38,23 @@ def check_db_name(db_name):
 def open_db_connection(db_name):
     """Открывает соединение с базой данных
 
-    current_app- специальный объект Flask, который указывает на приложение Flask,
-    обрабатывающее запрос.
-
-    База данных вызовется, когда приложение будет открыто. Поэтому использование
-    current_app тут оправдано
-
-    Создадаем пул соединений, который будет работать в многопоточной среде.
-    Это можно сделать с помощью класса ThreadedConnectionPool.
-
-    request.url_rule.rule содержит активный роутер. Из него берем вид спорта и получаем
-    настройки базы данных по данному виду спорта из current_app.config
+    Соединение берется из пула базы данных db_name (см. app.db_pools).
+    Пулы создаются один раз на процесс по настройкам из PROJECT_DATA_BASES
+    в config.py, соединение выдается уже проверенным и в режиме autocommit.
     """
 
     try:
-        if db_name not in POOLS:
-            POOLS[db_name] = psycopg2.pool.ThreadedConnectionPool(
-                **current_app.config[f"DATABASES"][db_name])
-            logging_into_seq.send_log_to_seq(
-                f"PostgreSQL - - Пул соединений для '{db_name}' создан успешно.")
+        connection = db_pools.getconn(db_name)
 
-        # Получаем соединение из пула соединений.
-        connection = POOLS[db_name].getconn()
-        if connection:
-            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    except pool.PoolError as err:
+        # Нет свободных соединений: запрос получит 503, а ограничитель
+        # запросов (app.admission) уменьшит число одновременных запросов.
+        logging_into_seq.send_log_to_seq(
+            f"PostgreSQL - - нет свободных соединений с '{db_name}': {err}")
+        base_db_name = db_name.split(':')[0]
+        admission.report_overload(base_db_name)
+        raise admission.Overloaded(base_db_name, current_app.config['DB_ADMISSION_RETRY_AFTER'],
+                                   ': нет свободных соединений') from None
 
     except (Exception, psycopg2.DatabaseError) as err:
         logging_into_seq.send_log_to_seq(
@@ -78,35 +75,92 @@ def get_db_connection(db_name):
     Поскольку в проекте будет использоваться фабрика приложений,
     при написании остальной части кода объект приложения еще отсутствует. get_db будет вызываться,
     когда приложение будет создано и начнет обрабатывать запрос.
+
+    g.db_connections создается при первом обращении к базе данных в запросе,
+    запросы без обращений к базе данных соединений не касаются.
     """
 
-    if g.db_connections[db_name] is None:
-        g.db_connections[db_name] = open_db_connection(db_name)
+    db_connections = g.setdefault('db_connections', {})
+    connection = db_connections.get(db_name)
 
-    logging_into_seq.send_log_to_seq(
-        f"PostgreSQL - - Соединение с {db_name} установлено.")
+    if connection is None:
+        connection = db_connections[db_name] = open_db_connection(db_name)
+        logging_into_seq.send_log_to_seq(
+            f"PostgreSQL - - Соединение с {db_name} установлено.")
+
+    return connection
+
+
+def get_read_connection(db_name):
+    """Возвращает имя пула и соединение для чтения из базы данных db_name.
+
+    Если у базы есть реплики (см. app.db_routing), реплика выбирается при первом
+    чтении в запросе и дальше используется до конца запроса. После записи
+    (mark_written) и внутри транзакции чтение идет с основного сервера, чтобы
+    запрос видел свои изменения. Если соединение с репликой получить не удалось,
+    читаем с основного сервера."""
+
+    if in_transaction(db_name):
+        return db_name, get_db_connection(db_name)
+
+    key = g.setdefault('db_routes', {}).get(db_name)
 
-    return g.db_connections[db_name]
+    if key is None:
+        key = db_routing.choose(db_name) or db_name
+        set_route(db_name, key)
+        if key != db_name:
+            try:
+                return key, get_db_connection(key)
+            except admission.Overloaded:
+                set_route(db_name, db_name)
+                key = db_name
+            except (Exception, psycopg2.DatabaseError):
+                db_routing.report_failure(key)
+                set_route(db_name, db_name)
+                key = db_name
+
+    return key, get_db_connection(key)
+
+
+def set_route(db_name, key):
+    """Запоминает, из какого пула читать db_name до конца запроса. Реплика,
+    с которой запрос уходит, освобождается (см. db_routing.release)"""
+
+    routes = g.setdefault('db_routes', {})
+    previous = routes.get(db_name)
+    if previous is not None and previous != db_name:
+        db_routing.release(previous)
+    routes[db_name] = key
+
+
+def mark_written(db_name):
+    """Запрос изменил данные в db_name: дальнейшие чтения в этом запросе -
+    с основного сервера, где эти изменения уже есть"""
+
+    set_route(db_name, db_name)
+    g.setdefault('db_written', set()).add(db_name)
 
 
 def close_db(e=None):
     """Проверяет, было ли создано соединение и проверяет, было ли g.db установлено.
 
-    Если соединение существует, оно закрывается.
+    Если соединение существует, оно возвращается в пул без дополнительных обращений
+    к серверу: незавершенная транзакция откатывается в db_pools.putconn.
 
     Далее этот метод будет зарегистрирован в фабрике приложений, и будет вызываться автоматически
     в конце каждого запроса.
     """
 
-    for db_name, connection in g.db_connections.items():
+    db_connections = g.pop('db_connections', None) or {}
 
-        if connection is not None:
-            connection.cursor().close()
-            POOLS[db_name].putconn(connection)
-            logging_into_seq.send_log_to_seq(
-                f"PostgreSQL - - соединение c '{db_name}' вернулось в пул.")
+    for db_name, key in (g.pop('db_routes', None) or {}).items():
+        if key != db_name:
+            db_routing.release(key)
 
-    g.pop('db_connections')
+    for db_name, connection in db_connections.items():
+        db_pools.putconn(db_name, connection)
+        logging_into_seq.send_log_to_seq(
+            f"PostgreSQL - - соединение c '{db_name}' вернулось в пул.")
 
 
 def init_app(app):
@@ -119,12 +173,27 @@ def init_app(app):
     app.teardown_appcontext() сообщает Flask о необходимости вызвать эту функцию
     при очистке после возврата ответа.
 
+    db_pools.init_app(app) запоминает настройки пулов соединений и прогревает их.
+
+    db_routing.init_app(app) настраивает выбор реплик для чтения.
+
+    result_cache.init_app(app) создает хранилище кеша результатов select запросов.
+
+    single_flight.init_app(app) добавляет счетчики объединенных запросов в /metrics.
+
+    query_profiler.init_app(app) настраивает профилировщик запросов и отчет /metrics/queries.
+
     Будет вызываться из фабрики:
         from . import database
         database.init_app(app)
     """
 
     app.teardown_appcontext(close_db)
+    db_pools.init_app(app)
+    db_routing.init_app(app)
+    result_cache.init_app(app)
+    single_flight.init_app(app)
+    query_profiler.init_app(app)
 
 
 def get_row_count(cursor):
@@ -139,53 +208,123 @@ def get_row_count(cursor):
     return count
 
 
-def execute_sql(query, data_for_query=None, db_name=None):
+def get_cursor_factory(row_factory):
+    """Класс курсора для формата строк: словари дает RealDictCursor,
+    остальные форматы строятся из кортежей обычного курсора"""
+
+    if row_factory == ROW_DICT:
+        return psycopg2.extras.RealDictCursor
+
+    return None
+
+
+def sql_logging_enabled():
+    """Нужно ли логировать текст запросов (DB_LOG_SQL в config.py)"""
+
+    return current_app.config['DB_LOG_SQL'] and logging_into_seq.is_enabled()
+
+
+def execute_sql(query, data_for_query=None, db_name=None, row_factory=ROW_DICT, prepare=None,
+                read_only=False):
     """Выполняет sql запрос
 
     Для красивого вывода информационного сообщения предварительно удаляет \n и лишние пробелы
-    из строки запроса.
+    из строки запроса. Нормализованный текст запоминается для каждой строки запроса.
 
     Функция mogrify из psycopg2 возвращает скомпилированный запрос с уже подставленными в него
-    внешними данными.
+    внешними данными. Вызывается только если логирование sql включено.
+
+    row_factory - формат строк результата (см. app.row_factories).
+
+    prepare - выполнить запрос через подготовленный запрос сервера (PREPARE/EXECUTE),
+    см. app.prepared_statements. По умолчанию берется из DB_PREPARED_STATEMENTS.
+
+    read_only - запрос только читает данные и может выполняться на реплике
+    (см. get_read_connection). Если соединение с репликой оборвалось, запрос
+    повторяется на основном сервере.
+
+    Запрос ограничен остатком срока запроса (см. app.deadlines): SET LOCAL
+    statement_timeout отправляется в той же команде, по истечении срока запрос отменяется и бросается
+    deadlines.DeadlineExceeded (ответ 504).
     """
 
     db_name = check_db_name(db_name)
 
-    db_connection = get_db_connection(db_name)
+    if read_only:
+        connection_key, db_connection = get_read_connection(db_name)
+    else:
+        connection_key, db_connection = db_name, get_db_connection(db_name)
     cursor = db_connection.cursor(
-        cursor_factory=psycopg2.extras.RealDictCursor)
-
-    query = ' '.join(query.split())
-    logging_into_seq.send_log_to_seq(f"PostgreSQL - - Выполняется запрос.",
-                                     {"sql": cursor.mogrify(query, data_for_query)})
-
-    cursor.execute(query, data_for_query)
+        cursor_factory=get_cursor_factory(row_factory))
+
+    query = prepared_statements.normalize_query(query)
+    if sql_logging_enabled():
+        logging_into_seq.send_log_to_seq(f"PostgreSQL - - Выполняется запрос.",
+                                         {"sql": cursor.mogrify(query, data_for_query)})
+
+    if prepare is None:
+        prepare = current_app.config['DB_PREPARED_STATEMENTS']
+
+    started = time.perf_counter()
+    with deadlines.statement(db_connection, connection_key) as set_timeout:
+        try:
+            if not (prepare and prepared_statements.execute_prepared(
+                    cursor, query, data_for_query, current_app.config['DB_PREPARED_CACHE_SIZE'],
+                    set_timeout)):
+                cursor.execute(set_timeout + query, data_for_query)
+        except psycopg2.Error as err:
+            elapsed = time.perf_counter() - started
+            metrics.observe_query(connection_key, elapsed)
+            query_profiler.record(connection_key, query, data_for_query, elapsed, error=True)
+            if (not isinstance(err, psycopg2.OperationalError) or connection_key == db_name
+                    or isinstance(err, psycopg2.extensions.QueryCanceledError)):
+                raise
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - ошибка реплики '{connection_key}', "
+                f"чтение с основного сервера: {err}")
+            db_routing.report_failure(connection_key)
+            set_route(db_name, db_name)
+            return execute_sql(query, data_for_query, db_name, row_factory, prepare, read_only)
+
+    elapsed = time.perf_counter() - started
+    metrics.observe_query(connection_key, elapsed)
+    query_profiler.record(connection_key, query, data_for_query, elapsed, cursor.rowcount)
+    if connection_key != db_name:
+        db_routing.observe(connection_key, elapsed)
 
     return cursor
 
 
-def execute_and_fetchall_sql(query, data_for_query=None, db_name=None):
+def execute_and_fetchall_sql(query, data_for_query=None, db_name=None, row_factory=ROW_DICT,
+                             prepare=None, read_only=False):
     """Выполняет sql запрос"""
 
     db_name = check_db_name(db_name)
 
     try:
-        cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query)
+        cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query,
+                             row_factory=row_factory, prepare=prepare, read_only=read_only)
         records = cursor.fetchall()
+        metrics.add_rows(db_name, len(records))
+        records = make_rows(records, cursor.description, row_factory)
     except (Exception, Error) as err:
         logging_into_seq.send_log_to_seq(f"Ошибка при работе с PostgreSQL: {err}")
         raise
 
     return records
 
-def execute_and_fetchone_sql(query, data_for_query=None, db_name=None):
+def execute_and_fetchone_sql(query, data_for_query=None, db_name=None, row_factory=ROW_DICT,
+                             prepare=None, read_only=False):
     """Выполняет sql запрос"""
 
     db_name = check_db_name(db_name)
 
     try:
-        cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query)
-        records = cursor.fetchone()
+        cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query,
+                             row_factory=row_factory, prepare=prepare, read_only=read_only)
+        record = cursor.fetchone()
+        metrics.add_rows(db_name, int(record is not None))
+        records = make_row(record, cursor.description, row_factory)
     except (Exception, Error) as err:
         logging_into_seq.send_log_to_seq(f"Ошибка при работе с PostgreSQL: {err}")
         raise
@@ -193,39 +332,146 @@ def execute_and_fetchone_sql(query, data_for_query=None, db_name=None):
     return records
 
 
-def execute_sql_list_as_transaction(queries, db_name=None):
-    """Выполняет список запросов 'queries' как одну транзакцию при помощи контекстного менеджера.
+@contextlib.contextmanager
+def transaction(db_name=None):
+    """Контекстный менеджер транзакции.
 
-    Каждый запрос передается в виде кортежа (запрос, данные для запроса)
-    """
+    Отключает autocommit у соединения запроса и отдает курсор. При выходе из блока
+    без ошибок транзакция фиксируется, при исключении - откатывается. После этого
+    autocommit включается обратно. Чтения после транзакции в этом запросе идут
+    с основного сервера (см. mark_written).
 
-    db_name = check_db_name(db_name)
+    Вложенный вызов для той же базы данных не открывает новую транзакцию, а работает
+    в уже открытой: фиксирует ее только внешний блок.
 
-    db_connection = None
+        with database.transaction('tennis') as cursor:
+            cursor.execute(...)
+    """
 
-    try:
-        db_connection = get_db_connection(db_name)
-        db_connection.autocommit = False
-        cursor = db_connection.cursor
+    db_name = check_db_name(db_name)
+    db_connection = get_db_connection(db_name)
+    mark_written(db_name)
 
-        logging_into_seq.send_log_to_seq("PostgreSQL - - Начало транзакции.")
+    if not db_connection.autocommit:
+        with db_connection.cursor() as cursor:
+            yield cursor
+        return
 
-        for query in queries:
-            logging_into_seq.send_log_to_seq(
-                f"PostgreSQL - - Выполняется запрос:\t{query[0]}.")
-            cursor.execute(query)
+    db_connection.autocommit = False
+    logging_into_seq.send_log_to_seq("PostgreSQL - - Начало транзакции.")
 
+    try:
+        with deadlines.statement(db_connection, db_name) as set_timeout, \
+                db_connection.cursor() as cursor:
+            if set_timeout:
+                cursor.execute(set_timeout)
+            yield cursor
+        db_connection.commit()
         logging_into_seq.send_log_to_seq(
             "PostgreSQL - - Транзакция успешно завершена.")
+        result_cache.invalidate(db_name, g.get('cache_tables_in_transaction', {}).pop(db_name, ()))
 
-    except (Exception, psycopg2.DatabaseError) as error:
+    except BaseException as error:
         logging_into_seq.send_log_to_seq(
             f"PostgreSQL - - Ошибка в транзакции. "
             f"Отмена всех остальных операций транзакции: {error}")
-        if db_connection:
-            db_connection.rollback()
+        db_connection.rollback()
+        # Таблицы транзакции сбрасываются и при откате: в кеше не должно остаться
+        # результатов, полученных во время транзакции
+        result_cache.invalidate(db_name, g.get('cache_tables_in_transaction', {}).pop(db_name, ()))
         raise
 
+    finally:
+        db_connection.autocommit = True
+
+
+def execute_sql_list_as_transaction(queries, db_name=None):
+    """Выполняет список запросов 'queries' как одну транзакцию при помощи контекстного менеджера.
+
+    Каждый запрос передается в виде кортежа (запрос, данные для запроса)
+    или строкой, если данных нет.
+    """
+
+    db_name = check_db_name(db_name)
+
+    with transaction(db_name) as cursor:
+        for query in queries:
+            if isinstance(query, str):
+                query = (query, None)
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - Выполняется запрос:\t{query[0]}.")
+            cursor.execute(*query)
+            invalidate_cache(db_name, query[0])
+
+    return 'ок'
+
+
+def in_transaction(db_name):
+    """Открыта ли в текущем запросе транзакция с базой данных db_name"""
+
+    db_connection = g.get('db_connections', {}).get(db_name)
+    return db_connection is not None and not db_connection.autocommit
+
+
+def invalidate_cache(db_name, query, tables=None):
+    """Сбрасывает кеш результатов для таблиц, которые изменяет запрос query.
+
+    Внутри транзакции кеш сбрасывается сразу и еще раз после ее фиксации: иначе между
+    сбросом и фиксацией в кеш могли бы снова попасть старые данные."""
+
+    tables = tables or result_cache.tables_in_query(query)
+    result_cache.invalidate(db_name, tables)
+
+    if in_transaction(db_name):
+        pending = g.setdefault('cache_tables_in_transaction', {})
+        pending.setdefault(db_name, set()).update(tables)
+
+
+def reads_own_writes(db_name):
+    """Запрос должен видеть свои изменения в db_name (открыта транзакция или уже была
+    запись): общие с другими запросами результаты (кеш, single-flight) не используются"""
+
+    return in_transaction(db_name) or db_name in g.get('db_written', ())
+
+
+def coalesced(loader, db_name, kind, query, data_for_query, row_factory, coalesce=None):
+    """Оборачивает loader select запроса в single_flight.do (см. app.single_flight).
+    kind отличает select_all от select_one с тем же запросом.
+
+    coalesce - объединять ли одинаковые одновременные запросы, по умолчанию
+    DB_SINGLE_FLIGHT из config.py (выключено). Ожидавшие получают тот же объект
+    результата, поэтому coalesce=True передает только вызов, который результат
+    не изменяет. Внутри транзакции и после записи запрос должен
+    видеть свои изменения, поэтому там запросы не объединяются."""
+
+    if coalesce is None:
+        coalesce = current_app.config['DB_SINGLE_FLIGHT']
+    if not coalesce or reads_own_writes(db_name):
+        return loader
+
+    key = (db_name, kind, prepared_statements.normalize_query(query), row_factory,
+           repr(data_for_query))
+
+    def load():
+        timeout = current_app.config['DB_SINGLE_FLIGHT_TIMEOUT']
+        left = deadlines.remaining()
+        if left is not None:
+            timeout = max(min(timeout, left), 0)
+        try:
+            result, shared = single_flight.do(db_name, key, loader, timeout)
+        except deadlines.DeadlineExceeded:
+            left = deadlines.remaining()
+            if left is not None and left <= 0:
+                raise
+            # Истек срок запроса, результат которого ждали, а у этого запроса время есть
+            return loader()
+        if shared:
+            logging_into_seq.send_log_to_seq(
+                "PostgreSQL - - Результат получен из такого же одновременного запроса.")
+        return result
+
+    return load
+
 
 def insert(query, data_for_query=None, db_name=None):
     """CRUD insert"""
@@ -233,6 +479,8 @@ def insert(query, data_for_query=None, db_name=None):
     db_name = check_db_name(db_name)
 
     cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
     logging_into_seq.send_log_to_seq(
         f"PostgreSQL - - {get_row_count(cursor)} запись(ей) успешно добавлена в таблицу.")
 
@@ -245,6 +493,8 @@ def update(query, data_for_query=None, db_name=None):
     db_name = check_db_name(db_name)
 
     cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
     logging_into_seq.send_log_to_seq(
         f"PostgreSQL - - {get_row_count(cursor)} запись успешно обновлена.")
 
@@ -257,30 +507,162 @@ def delete(query, data_for_query=None, db_name=None):
     db_name = check_db_name(db_name)
 
     cursor = execute_sql(query=query, db_name=db_name, data_for_query=data_for_query)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
     logging_into_seq.send_log_to_seq(
         f"PostgreSQL - - {get_row_count(cursor)} запись успешно удалена.")
 
     return 'ок'
 
 
-def select_all(query, data_for_query=None, db_name=None):
-    """CRUD select"""
+def select_all(query, data_for_query=None, db_name=None, row_factory=ROW_DICT, prepare=None,
+               cache_ttl=None, cache_tags=None, coalesce=None):
+    """CRUD select
+
+    row_factory - формат строк результата: ROW_DICT (по умолчанию), ROW_TUPLE,
+    ROW_RECORD или ROW_COLUMNS из app.row_factories.
+
+    prepare - выполнить через подготовленный запрос сервера (см. execute_sql).
+
+    cache_ttl - сколько секунд хранить результат в кеше (см. app.result_cache),
+    cache_tags - таблицы, при изменении которых результат устаревает
+    (по умолчанию - таблицы из текста запроса). Результат из кеша изменять нельзя.
+    Внутри транзакции и после записи в этом запросе кеш не используется.
+
+    coalesce - объединять одинаковые одновременные запросы (см. coalesced),
+    по умолчанию DB_SINGLE_FLIGHT (выключено). Общий результат изменять нельзя.
+    """
 
     db_name = check_db_name(db_name)
 
-    result = execute_and_fetchall_sql(query=query, data_for_query=data_for_query, db_name=db_name)
+    def load():
+        return execute_and_fetchall_sql(query=query, data_for_query=data_for_query,
+                                        db_name=db_name, row_factory=row_factory,
+                                        prepare=prepare, read_only=True)
+
+    load = coalesced(load, db_name, 'all', query, data_for_query, row_factory, coalesce)
+
+    if cache_ttl and not reads_own_writes(db_name):
+        result = result_cache.get_or_load(db_name, prepared_statements.normalize_query(query),
+                                          data_for_query, row_factory, cache_ttl, cache_tags,
+                                          load)
+    else:
+        result = load()
     logging_into_seq.send_log_to_seq(
-        f"PostgreSQL - - {len(result)} запись(ей) получено.")
+        f"PostgreSQL - - {rows_count(result, row_factory)} запись(ей) получено.")
 
     return result
 
-def select_one(query, data_for_query=None, db_name=None):
-    """CRUD select"""
+def select_one(query, data_for_query=None, db_name=None, row_factory=ROW_DICT, prepare=None,
+               cache_ttl=None, cache_tags=None, coalesce=None):
+    """CRUD select
+
+    cache_ttl, cache_tags - кеширование результата, coalesce - объединение
+    одновременных запросов, как в select_all.
+    """
 
     db_name = check_db_name(db_name)
 
-    result = execute_and_fetchone_sql(query=query, data_for_query=data_for_query, db_name=db_name)
+    def load():
+        return execute_and_fetchone_sql(query=query, data_for_query=data_for_query,
+                                        db_name=db_name, row_factory=row_factory,
+                                        prepare=prepare, read_only=True)
+
+    load = coalesced(load, db_name, 'one', query, data_for_query, row_factory, coalesce)
+
+    if cache_ttl and not reads_own_writes(db_name):
+        result = result_cache.get_or_load(db_name, prepared_statements.normalize_query(query),
+                                          ('one', data_for_query), row_factory, cache_ttl,
+                                          cache_tags, load)
+    else:
+        result = load()
     logging_into_seq.send_log_to_seq(
-        f"PostgreSQL - - {len(result)} запись(ей) получено.")
+        f"PostgreSQL - - {rows_count(result, row_factory)} запись(ей) получено.")
 
     return result
+
+
+def select_stream(query, data_for_query=None, db_name=None, batch_size=None,
+                  row_factory=ROW_DICT):
+    """CRUD select порциями через именованный серверный курсор
+
+    Возвращает генератор строк. Запрос выполняется при первом обращении к генератору,
+    строки забираются с сервера пачками по batch_size (по умолчанию DB_STREAM_BATCH_SIZE
+    из config.py), поэтому в памяти одновременно находится не больше одной пачки.
+
+    Серверный курсор живет только внутри транзакции, поэтому на время чтения
+    autocommit отключается, а после чтения транзакция закрывается и режим
+    соединения восстанавливается. Внутри database.transaction используется уже
+    открытая транзакция. row_factory - формат строк, кроме ROW_COLUMNS.
+    Читает с реплики, если она есть (см. get_read_connection). Выполнение запроса
+    и получение каждой пачки с сервера ограничены остатком срока запроса
+    (см. app.deadlines), время отдачи строк клиенту отмену не вызывает. Если срок
+    истек, следующая пачка уже не запрашивается.
+    Генератор нужно отдавать в ответ через
+    stream_with_context, чтобы соединение не вернулось в пул раньше времени.
+    """
+
+    if row_factory == ROW_COLUMNS:
+        raise ValueError("select_stream отдает строки по одной, ROW_COLUMNS не поддерживается")
+
+    db_name = check_db_name(db_name)
+    batch_size = batch_size or current_app.config['DB_STREAM_BATCH_SIZE']
+
+    connection_key, db_connection = get_read_connection(db_name)
+    query = prepared_statements.normalize_query(query)
+
+    outer_transaction = not db_connection.autocommit
+    db_connection.autocommit = False
+    cursor = db_connection.cursor(name=f"stream_{uuid.uuid4().hex}",
+                                  cursor_factory=get_cursor_factory(row_factory))
+    cursor.itersize = batch_size
+    count = 0
+    # Время запроса для профилировщика: выполнение и получение всех пачек
+    db_time = 0.0
+
+    try:
+        if sql_logging_enabled():
+            logging_into_seq.send_log_to_seq(f"PostgreSQL - - Выполняется потоковый запрос.",
+                                             {"sql": cursor.mogrify(query, data_for_query)})
+        with deadlines.statement(db_connection, connection_key) as set_timeout:
+            started = time.perf_counter()
+            if set_timeout:
+                with db_connection.cursor() as timeout_cursor:
+                    timeout_cursor.execute(set_timeout)
+            cursor.execute(query, data_for_query)
+            db_time = time.perf_counter() - started
+            metrics.observe_query(connection_key, db_time)
+
+        while True:
+            started = time.perf_counter()
+            # Срок ограничивает только получение пачки с сервера, а не время,
+            # пока клиент читает уже полученные строки
+            with deadlines.statement(db_connection, connection_key):
+                records = cursor.fetchmany(batch_size)
+            elapsed = time.perf_counter() - started
+            db_time += elapsed
+            metrics.add_timing('db', elapsed)
+            if not records:
+                break
+            count += len(records)
+            metrics.add_rows(db_name, len(records))
+            yield from make_rows(records, cursor.description, row_factory)
+
+        cursor.close()
+        if not outer_transaction:
+            db_connection.commit()
+        query_profiler.record(connection_key, query, data_for_query, db_time, count)
+    except (Exception, GeneratorExit) as err:
+        if not isinstance(err, GeneratorExit):
+            logging_into_seq.send_log_to_seq(f"Ошибка при работе с PostgreSQL: {err}")
+            query_profiler.record(connection_key, query, data_for_query, db_time, count,
+                                  error=True)
+        if not outer_transaction:
+            db_connection.rollback()
+        raise
+    finally:
+        if not outer_transaction:
+            db_connection.autocommit = True
+
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL - - {count} запись(ей) получено потоком.")
@@ -0,0 +1,287 @@
+"""Асинхронный доступ к базе данных
+
+Тот же набор функций, что и в app.database (select_all, select_one, insert, update,
+delete), но в виде корутин для async view. Используется неблокирующий драйвер
+psycopg 3 и его асинхронный пул соединений psycopg_pool.AsyncConnectionPool.
+
+Flask выполняет каждый async view в своем цикле событий, а пул соединений привязан
+к циклу, в котором создан. Поэтому все пулы и запросы живут в одном фоновом цикле
+событий процесса: корутины модуля передают запрос в этот цикл и ждут результат, не
+блокируя свой. Запросы к разным базам данных (например, ко всем видам спорта)
+выполняются одновременно:
+
+    @bp.route('/matches/')
+    async def matches():
+        results = await database_async.select_all_from(
+            ['tennis', 'football'], "SELECT ...", data_for_query)
+
+Настройки подключения берутся из PROJECT_DATA_BASES в config.py (основной сервер,
+реплики не используются), minconn/maxconn задают размер асинхронного пула.
+
+Данные подставляются в запрос на стороне клиента (AsyncClientCursor), как
+в psycopg2: одни и те же запросы работают в обоих модулях, а SET LOCAL
+statement_timeout срока запроса (см. app.deadlines) уходит с запросом одной
+командой. Запросы учитываются в /metrics и app.query_profiler, запись сбрасывает
+кеш результатов app.database так же, как database.insert/update/delete.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from flask import current_app
+from app import db_pools, deadlines, logging_into_seq, metrics, prepared_statements, query_profiler
+from app.database import check_db_name, invalidate_cache, mark_written, sql_logging_enabled
+from app.row_factories import ROW_DICT, make_row, make_rows, rows_count
+
+try:
+    import psycopg
+    import psycopg.rows
+    import psycopg_pool
+except ImportError:  # pragma: no cover - зависит от окружения
+    psycopg = None
+
+# Фоновый цикл событий процесса и его поток
+_LOOP = None
+_LOOP_PID = None
+_LOOP_LOCK = threading.Lock()
+
+# db_name -> задача открытия пула (результат - открытый AsyncConnectionPool)
+POOLS = {}
+
+
+def _get_loop():
+    """Возвращает фоновый цикл событий, при необходимости запуская его.
+
+    После fork поток цикла в дочернем процессе не существует, поэтому цикл
+    и пулы создаются заново."""
+
+    global _LOOP, _LOOP_PID
+
+    if _LOOP is not None and _LOOP_PID == os.getpid():
+        return _LOOP
+
+    with _LOOP_LOCK:
+        if _LOOP is None or _LOOP_PID != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(name="database_async", target=loop.run_forever,
+                             daemon=True).start()
+            POOLS.clear()
+            _LOOP, _LOOP_PID = loop, os.getpid()
+
+    return _LOOP
+
+
+async def _run(coro):
+    """Выполняет корутину в фоновом цикле событий и ждет ее результат в текущем цикле"""
+
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _get_loop()))
+
+
+def _conninfo(params):
+    params = dict(params)
+    min_size = params.pop('minconn', 1)
+    max_size = params.pop('maxconn', min_size)
+    if 'database' in params:
+        params['dbname'] = params.pop('database')
+
+    return psycopg.conninfo.make_conninfo(**params), min_size, max_size
+
+
+async def _open_pool(db_name, params):
+    conninfo, min_size, max_size = _conninfo(params)
+    db_pool = psycopg_pool.AsyncConnectionPool(
+        conninfo, min_size=min_size, max_size=max(max_size, min_size),
+        kwargs={'autocommit': True}, name=db_name, open=False)
+    await db_pool.open(wait=True)
+
+    return db_pool
+
+
+async def _get_pool(db_name, params):
+    """Возвращает открытый пул базы данных. Выполняется только в фоновом цикле,
+    поэтому создание пула не требует блокировок"""
+
+    task = POOLS.get(db_name)
+    if task is None:
+        task = POOLS[db_name] = asyncio.ensure_future(_open_pool(db_name, params))
+
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        if POOLS.get(db_name) is task:
+            del POOLS[db_name]
+        raise
+
+
+async def _execute(db_name, params, query, data_for_query, row_factory, fetch,
+                   set_timeout='', cancel_at=None, state=None):
+    """Выполняет запрос на соединении из пула. fetch - 'all', 'one' или None.
+
+    set_timeout и cancel_at - срок запроса (см. deadlines.begin). Был ли запрос
+    отменен по сроку, записывается в state['cancelled']."""
+
+    db_pool = await _get_pool(db_name, params)
+    cursor_row_factory = psycopg.rows.dict_row if row_factory == ROW_DICT \
+        else psycopg.rows.tuple_row
+
+    async with db_pool.connection() as connection:
+        cancel = deadlines.watch(connection, cancel_at) if cancel_at is not None else None
+        try:
+            async with psycopg.AsyncClientCursor(
+                    connection, row_factory=cursor_row_factory) as cursor:
+                await cursor.execute(set_timeout + query, data_for_query)
+                if set_timeout:
+                    # Первый результат - SET LOCAL
+                    cursor.nextset()
+                if fetch == 'all':
+                    return make_rows(await cursor.fetchall(), cursor.description, row_factory)
+                if fetch == 'one':
+                    return make_row(await cursor.fetchone(), cursor.description, row_factory)
+                return cursor.rowcount
+        finally:
+            # Соединение возвращается в пул только после снятия отмены: начатая
+            # отмена не должна попасть в следующий запрос соединения.
+            # Ожидание начатой отмены блокирует поток, поэтому идет не в цикле событий,
+            # общем для всех запросов процесса.
+            if cancel is not None:
+                cancelled = deadlines.unwatch(cancel, wait=False)
+                if cancelled is None:
+                    cancelled = await asyncio.get_running_loop().run_in_executor(
+                        None, deadlines.unwatch, cancel)
+                state['cancelled'] = cancelled
+
+
+async def execute_sql(query, data_for_query=None, db_name=None, row_factory=ROW_DICT,
+                      fetch=None):
+    """Выполняет sql запрос в фоновом цикле событий.
+
+    Имя базы данных и ее настройки определяются здесь, в контексте запроса Flask:
+    в фоновом цикле контекста приложения нет."""
+
+    if psycopg is None:
+        raise RuntimeError("Для app.database_async нужны пакеты psycopg и psycopg-pool.")
+
+    db_name = check_db_name(db_name)
+    params, _ = db_pools.split_database_config(current_app.config['PROJECT_DATA_BASES'][db_name])
+
+    query = prepared_statements.normalize_query(query)
+    if sql_logging_enabled():
+        logging_into_seq.send_log_to_seq(
+            f"PostgreSQL async - - Выполняется запрос к '{db_name}'.",
+            {"sql": query, "params": repr(data_for_query)})
+
+    set_timeout, cancel_at = deadlines.begin(db_name)
+    state = {'cancelled': False}
+    started = time.perf_counter()
+    try:
+        result = await _run(_execute(db_name, params, query, data_for_query, row_factory,
+                                     fetch, set_timeout, cancel_at, state))
+    except (Exception, psycopg.Error) as err:
+        elapsed = time.perf_counter() - started
+        metrics.observe_query(db_name, elapsed)
+        query_profiler.record(db_name, query, data_for_query, elapsed, error=True)
+        logging_into_seq.send_log_to_seq(f"Ошибка при работе с PostgreSQL: {err}")
+        if isinstance(err, psycopg.errors.QueryCanceled) and cancel_at is not None:
+            error = deadlines.exceeded_error(db_name, state['cancelled'])
+            if error is not None:
+                raise error from err
+        raise
+
+    elapsed = time.perf_counter() - started
+    metrics.observe_query(db_name, elapsed)
+    if fetch is None:
+        rows = result
+    else:
+        rows = rows_count(result, row_factory) if fetch == 'all' else int(result is not None)
+        metrics.add_rows(db_name, rows)
+    query_profiler.record(db_name, query, data_for_query, elapsed, rows)
+
+    return result
+
+
+async def insert(query, data_for_query=None, db_name=None):
+    """CRUD insert"""
+
+    db_name = check_db_name(db_name)
+
+    count = await execute_sql(query, data_for_query, db_name)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL async - - {count} запись(ей) успешно добавлена в таблицу.")
+
+    return 'ок'
+
+
+async def update(query, data_for_query=None, db_name=None):
+    """CRUD update"""
+
+    db_name = check_db_name(db_name)
+
+    count = await execute_sql(query, data_for_query, db_name)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL async - - {count} запись успешно обновлена.")
+
+    return 'ок'
+
+
+async def delete(query, data_for_query=None, db_name=None):
+    """CRUD delete"""
+
+    db_name = check_db_name(db_name)
+
+    count = await execute_sql(query, data_for_query, db_name)
+    mark_written(db_name)
+    invalidate_cache(db_name, query)
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL async - - {count} запись успешно удалена.")
+
+    return 'ок'
+
+
+async def select_all(query, data_for_query=None, db_name=None, row_factory=ROW_DICT):
+    """CRUD select"""
+
+    result = await execute_sql(query, data_for_query, db_name, row_factory, fetch='all')
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL async - - {rows_count(result, row_factory)} запись(ей) получено.")
+
+    return result
+
+
+async def select_one(query, data_for_query=None, db_name=None, row_factory=ROW_DICT):
+    """CRUD select"""
+
+    return await execute_sql(query, data_for_query, db_name, row_factory, fetch='one')
+
+
+async def select_all_from(db_names, query, data_for_query=None, row_factory=ROW_DICT):
+    """Выполняет один и тот же select во всех базах db_names одновременно.
+
+    Возвращает словарь {имя базы данных: результат}. Время ответа равно времени
+    самого медленного запроса, а не их сумме."""
+
+    results = await asyncio.gather(*(
+        select_all(query, data_for_query, db_name, row_factory) for db_name in db_names))
+
+    return dict(zip(db_names, results))
+
+
+async def _close_pools():
+    for task in list(POOLS.values()):
+        try:
+            db_pool = await task
+        except Exception:
+            continue
+        await db_pool.close()
+    POOLS.clear()
+
+
+def close_pools():
+    """Закрывает асинхронные пулы процесса (например, перед fork в мастер-процессе gunicorn)"""
+
+    if _LOOP is not None and _LOOP_PID == os.getpid():
+        asyncio.run_coroutine_threadsafe(_close_pools(), _LOOP).result()
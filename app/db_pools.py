@@ -0,0 +1,336 @@
+"""Пулы соединений с базами данных
+
+Пул ThreadedConnectionPool создается один раз на базу данных в каждом процессе.
+Создание защищено блокировкой, поэтому параллельные первые запросы не создадут
+лишних пулов. При создании пул сразу открывает minconn соединений, поэтому
+init_app прогревает пулы всех баз из PROJECT_DATA_BASES при запуске приложения.
+
+Соединения psycopg2 нельзя использовать в разных процессах. После fork
+(gunicorn с preload_app) унаследованные пулы не закрываются, а просто забываются,
+и процесс создает свои. Хуки для gunicorn находятся в gunicorn.conf.py.
+
+При возврате в пул незавершенная транзакция соединения откатывается. Перед выдачей
+соединение проверяется: закрытые и сломанные соединения
+заменяются новыми, незавершенные транзакции откатываются, а долго простаивавшие
+соединения при включенном DB_POOL_PRE_PING проверяются запросом SELECT 1.
+
+У базы данных в PROJECT_DATA_BASES могут быть реплики для чтения:
+
+    "tennis": {"host": "db1", "database": "tennis", ..., "replicas": [{"host": "db2"}, {"host": "db3"}]}
+
+или {"primary": {...}, "replicas": [...]}. Параметры реплики дополняют параметры
+основного сервера. Для каждой реплики создается свой пул с именем replica_key
+(например, 'tennis:replica0'), выбор реплики для чтения - в app.db_routing.
+"""
+
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import (ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+from app import logging_into_seq, metrics, prepared_statements
+
+POOLS = {}
+
+# Параметры подключения и настройки пулов, сохраненные init_app - нужны,
+# чтобы пересоздать пулы после fork без приложения. databases - параметры
+# по имени пула, replicas - имена пулов реплик по имени базы данных.
+_SETTINGS = {'databases': {}, 'replicas': {}, 'timeout': None, 'pre_ping': None}
+
+_LOCK = threading.Lock()
+_PID = os.getpid()
+# Пулы, унаследованные от родительского процесса. Ссылки на них хранятся, чтобы
+# сборщик мусора не закрыл сокеты, которыми пользуется родитель.
+_INHERITED = []
+
+
+class DatabasePool:
+    """Пул соединений одной базы данных с учетом занятых соединений.
+
+    Семафор на maxconn соединений позволяет ждать освободившееся соединение
+    не дольше timeout секунд вместо немедленного PoolError от ThreadedConnectionPool."""
+
+    def __init__(self, db_name, params, timeout=None, pre_ping=None):
+        params = dict(params)
+        self.db_name = db_name
+        self.minconn = params.pop('minconn', 1)
+        self.maxconn = params.pop('maxconn', self.minconn)
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.pool = psycopg2.pool.ThreadedConnectionPool(self.minconn, self.maxconn, **params)
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.last_used = {}
+        self.stats = metrics.Counters(
+            ('checkouts', 'checkout_failures', 'discarded', 'wait_time', 'max_wait_time'))
+
+    def _validate(self, connection):
+        """Проверяет соединение перед выдачей. Возвращает False, если его нужно заменить"""
+
+        if connection.closed:
+            return False
+
+        try:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+
+            last_used = self.last_used.get(id(connection))
+            if (self.pre_ping is not None and last_used is not None
+                    and time.monotonic() - last_used > self.pre_ping):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    @staticmethod
+    def _reset(connection):
+        """Откатывает незавершенную транзакцию и включает autocommit.
+        Возвращает False, если соединение сломано"""
+
+        try:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            if not connection.autocommit:
+                connection.autocommit = True
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def getconn(self):
+        """Выдает проверенное соединение в режиме autocommit"""
+
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            self.stats.add('checkout_failures')
+            raise pool.PoolError(
+                f"Нет свободных соединений с '{self.db_name}' за {self.timeout} с.")
+
+        try:
+            for _ in range(self.maxconn + 1):
+                connection = self.pool.getconn()
+                if self._validate(connection):
+                    break
+                self.discard(connection)
+            else:
+                raise pool.PoolError(f"Не удалось получить рабочее соединение с '{self.db_name}'.")
+
+            if not connection.autocommit:
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        except Exception:
+            self.slots.release()
+            self.stats.add('checkout_failures')
+            raise
+
+        wait = time.perf_counter() - started
+        with self.stats.lock:
+            self.stats['checkouts'] += 1
+            self.stats['wait_time'] += wait
+            self.stats['max_wait_time'] = max(self.stats['max_wait_time'], wait)
+        metrics.add_timing('pool', wait)
+
+        return connection
+
+    def discard(self, connection):
+        """Закрывает сломанное соединение и убирает его из пула"""
+
+        self.stats.add('discarded')
+        self.last_used.pop(id(connection), None)
+        prepared_statements.invalidate(connection)
+        self.pool.putconn(connection, close=True)
+
+    def putconn(self, connection, close=False):
+        """Возвращает соединение в пул.
+
+        Состояние соединения сбрасывается только при необходимости: статус транзакции
+        известен клиенту, поэтому у соединения без открытой транзакции обращений
+        к серверу нет, а открытая транзакция откатывается, чтобы не держать блокировки
+        в простаивающем соединении."""
+
+        try:
+            if not (close or connection.closed):
+                close = not self._reset(connection)
+
+            if close or connection.closed:
+                self.discard(connection)
+            else:
+                self.last_used[id(connection)] = time.monotonic()
+                self.pool.putconn(connection)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        for connection in self.pool._pool + list(self.pool._used.values()):
+            prepared_statements.invalidate(connection)
+        self.pool.closeall()
+        self.last_used.clear()
+
+    def get_stats(self):
+        """Метрики пула: занято, свободно, ожидание соединения и ошибки выдачи"""
+
+        stats = self.stats.snapshot()
+        stats['in_use'] = len(self.pool._used)
+        stats['idle'] = len(self.pool._pool)
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        stats['mean_wait_time'] = (stats['wait_time'] / stats['checkouts']
+                                   if stats['checkouts'] else 0.0)
+        return stats
+
+
+def replica_key(db_name, index):
+    """Имя пула реплики index базы данных db_name"""
+
+    return f"{db_name}:replica{index}"
+
+
+def split_database_config(params):
+    """Разделяет настройки базы данных из PROJECT_DATA_BASES на параметры
+    основного сервера и список параметров реплик"""
+
+    params = dict(params)
+    replicas = params.pop('replicas', None) or []
+    primary = params.pop('primary', params)
+
+    return primary, [dict(primary, **replica) for replica in replicas]
+
+
+def get_replicas(db_name):
+    """Имена пулов реплик базы данных db_name"""
+
+    return _SETTINGS['replicas'].get(db_name, ())
+
+
+def get_all_replicas():
+    """Имена пулов всех реплик"""
+
+    return [key for keys in list(_SETTINGS['replicas'].values()) for key in keys]
+
+
+def get_pool_params(db_name):
+    """Параметры пула db_name вместе с minconn/maxconn"""
+
+    return _SETTINGS['databases'][db_name]
+
+
+def connection_params(db_name):
+    """Параметры подключения пула db_name без настроек размера пула"""
+
+    params = dict(get_pool_params(db_name))
+    params.pop('minconn', None)
+    params.pop('maxconn', None)
+
+    return params
+
+
+def _check_pid():
+    """После fork забывает пулы родительского процесса"""
+
+    global _PID
+
+    if os.getpid() != _PID:
+        with _LOCK:
+            if os.getpid() != _PID:
+                _INHERITED.extend(POOLS.values())
+                POOLS.clear()
+                _PID = os.getpid()
+
+
+def get_pool(db_name):
+    """Возвращает пул базы данных, при необходимости создавая его.
+
+    Пул создается под блокировкой с повторной проверкой, поэтому на базу
+    данных в процессе всегда приходится ровно один пул."""
+
+    _check_pid()
+
+    db_pool = POOLS.get(db_name)
+    if db_pool is not None:
+        return db_pool
+
+    with _LOCK:
+        db_pool = POOLS.get(db_name)
+        if db_pool is None:
+            db_pool = DatabasePool(db_name, _SETTINGS['databases'][db_name],
+                                   _SETTINGS['timeout'], _SETTINGS['pre_ping'])
+            POOLS[db_name] = db_pool
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - Пул соединений для '{db_name}' создан успешно.")
+
+    return db_pool
+
+
+def getconn(db_name):
+    return get_pool(db_name).getconn()
+
+
+def putconn(db_name, connection, close=False):
+    _check_pid()
+
+    db_pool = POOLS.get(db_name)
+    if db_pool is None:
+        # Соединение из пула родительского процесса - не трогаем его.
+        return
+
+    db_pool.putconn(connection, close=close)
+
+
+def warm_up():
+    """Создает пулы всех баз данных из настроек. Ошибки подключения логируются,
+    пул будет создан позже, при первом запросе к базе"""
+
+    for db_name in _SETTINGS['databases']:
+        try:
+            get_pool(db_name)
+        except (Exception, psycopg2.DatabaseError) as err:
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - ошибка при создании пула '{db_name}': {err}")
+
+
+def close_pools():
+    """Закрывает все пулы процесса. Вызывается в мастер-процессе gunicorn перед fork"""
+
+    with _LOCK:
+        for db_pool in POOLS.values():
+            db_pool.closeall()
+        POOLS.clear()
+
+
+def get_pool_stats():
+    """Метрики всех пулов процесса"""
+
+    return {db_name: db_pool.get_stats() for db_name, db_pool in list(POOLS.items())}
+
+
+def init_app(app):
+    """Запоминает настройки пулов и, если включен DB_POOL_WARM_UP, прогревает пулы.
+    При APP_PRELOAD пулы прогреваются не здесь, а в каждом воркере после fork"""
+
+    databases = {}
+    replicas = {}
+    for db_name, params in (app.config['PROJECT_DATA_BASES'] or {}).items():
+        databases[db_name], replica_params = split_database_config(params)
+        for index, params in enumerate(replica_params):
+            databases[replica_key(db_name, index)] = params
+        if replica_params:
+            replicas[db_name] = tuple(replica_key(db_name, index)
+                                      for index in range(len(replica_params)))
+
+    _SETTINGS['databases'] = databases
+    _SETTINGS['replicas'] = replicas
+    _SETTINGS['timeout'] = app.config['DB_POOL_TIMEOUT']
+    _SETTINGS['pre_ping'] = app.config['DB_POOL_PRE_PING']
+    metrics.register_collector('bc_db_pool', 'database', get_pool_stats)
+
+    if app.config['DB_POOL_WARM_UP'] and not app.config['APP_PRELOAD']:
+        with app.app_context():
+            warm_up()
@@ -0,0 +1,210 @@
+"""Выбор реплики для чтения
+
+database.select_all/select_one/select_stream читают с реплик базы данных, если они
+заданы в PROJECT_DATA_BASES (см. app.db_pools), запись всегда идет на основной сервер.
+Реплика выбирается один раз на запрос и базу данных, после записи в этом запросе
+чтение идет с основного сервера (см. database.get_read_connection).
+
+Способ выбора задает DB_REPLICA_BALANCING в config.py:
+    least_outstanding - реплика с наименьшим числом запросов, которые сейчас ее используют;
+    latency - случайная реплика с весом, обратным среднему времени ее запросов.
+
+Фоновый поток каждые DB_REPLICA_HEALTH_INTERVAL секунд проверяет реплики запросом
+SELECT 1 через отдельное соединение. Реплика, не прошедшая DB_REPLICA_MAX_FAILURES
+проверок подряд (ошибки соединения в запросах тоже считаются), исключается из выбора
+до первой успешной проверки. Если доступных реплик нет, чтение идет с основного сервера.
+"""
+
+import os
+import random
+import threading
+import time
+import psycopg2
+from app import db_pools, logging_into_seq, metrics
+
+BALANCING_LEAST_OUTSTANDING = 'least_outstanding'
+BALANCING_LATENCY = 'latency'
+
+# Вес нового замера в скользящем среднем времени запросов реплики
+_LATENCY_ALPHA = 0.2
+
+_SETTINGS = {'app': None, 'balancing': BALANCING_LEAST_OUTSTANDING, 'health_interval': 5,
+             'max_failures': 3, 'connect_timeout': 2}
+
+# имя пула реплики -> состояние
+REPLICAS = {}
+
+_LOCK = threading.Lock()
+_CHECKER_PID = None
+
+
+class Replica:
+    """Состояние реплики: занятость, среднее время запросов и доступность"""
+
+    __slots__ = ('key', 'outstanding', 'latency', 'failures', 'healthy', 'stats')
+
+    def __init__(self, key):
+        self.key = key
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.healthy = True
+        self.stats = {'routed': 0, 'failures': 0, 'ejections': 0}
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['outstanding'] = self.outstanding
+        stats['latency'] = self.latency or 0.0
+        stats['healthy'] = int(self.healthy)
+        return stats
+
+
+def _get_replica(key):
+    replica = REPLICAS.get(key)
+    if replica is None:
+        with _LOCK:
+            replica = REPLICAS.setdefault(key, Replica(key))
+    return replica
+
+
+def choose(db_name):
+    """Имя пула реплики для чтения или None, если читать нужно с основного сервера.
+    Выбранная реплика считается занятой до вызова release"""
+
+    keys = db_pools.get_replicas(db_name)
+    if not keys:
+        return None
+
+    _ensure_checker()
+    replicas = [replica for replica in map(_get_replica, keys) if replica.healthy]
+    if not replicas:
+        return None
+
+    with _LOCK:
+        if _SETTINGS['balancing'] == BALANCING_LATENCY:
+            # Реплики без замеров получают вес самой быстрой, чтобы на них пошли запросы.
+            known = [replica.latency for replica in replicas if replica.latency]
+            default = min(known, default=1.0)
+            weights = [1 / (replica.latency or default) for replica in replicas]
+            replica = random.choices(replicas, weights)[0]
+        else:
+            random.shuffle(replicas)
+            replica = min(replicas, key=lambda item: item.outstanding)
+
+        replica.outstanding += 1
+        replica.stats['routed'] += 1
+
+    return replica.key
+
+
+def release(key):
+    """Запрос закончил работу с репликой"""
+
+    replica = _get_replica(key)
+    with _LOCK:
+        replica.outstanding = max(replica.outstanding - 1, 0)
+
+
+def observe(key, seconds):
+    """Учитывает время успешного запроса к реплике в ее скользящем среднем
+    и сбрасывает счетчик ошибок подряд"""
+
+    replica = _get_replica(key)
+    with _LOCK:
+        replica.failures = 0
+        if replica.latency is None:
+            replica.latency = seconds
+        else:
+            replica.latency += _LATENCY_ALPHA * (seconds - replica.latency)
+
+
+def report_failure(key):
+    """Ошибка соединения с репликой. После max_failures ошибок подряд реплика исключается"""
+
+    replica = _get_replica(key)
+    with _LOCK:
+        replica.failures += 1
+        replica.stats['failures'] += 1
+        eject = replica.healthy and replica.failures >= _SETTINGS['max_failures']
+        if eject:
+            replica.healthy = False
+            replica.stats['ejections'] += 1
+
+    if eject:
+        logging_into_seq.send_log_to_seq(
+            f"PostgreSQL - - реплика '{key}' исключена из чтения после "
+            f"{replica.failures} ошибок подряд.")
+
+
+def report_success(key):
+    """Успешная проверка реплики: сбрасывает счетчик ошибок и возвращает ее в выбор"""
+
+    replica = _get_replica(key)
+    with _LOCK:
+        replica.failures = 0
+        replica.healthy = True
+
+
+def check(key):
+    """Проверяет реплику запросом SELECT 1 через новое соединение"""
+
+    try:
+        # connect_timeout проверки заменяет connect_timeout из параметров реплики
+        connection = psycopg2.connect(**dict(db_pools.connection_params(key),
+                                             connect_timeout=_SETTINGS['connect_timeout']))
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        finally:
+            connection.close()
+    except (Exception, psycopg2.Error):
+        return False
+
+    return True
+
+
+def _check_replicas():
+    while True:
+        time.sleep(_SETTINGS['health_interval'])
+        # Контекст приложения нужен для логирования исключения реплики.
+        with _SETTINGS['app'].app_context():
+            for key in db_pools.get_all_replicas():
+                if check(key):
+                    report_success(key)
+                else:
+                    report_failure(key)
+
+
+def _ensure_checker():
+    """Запускает поток проверки реплик (после fork - заново в новом процессе)"""
+
+    global _CHECKER_PID
+
+    if (_CHECKER_PID == os.getpid() or not _SETTINGS['health_interval']
+            or _SETTINGS['app'] is None):
+        return
+
+    with _LOCK:
+        if _CHECKER_PID != os.getpid():
+            threading.Thread(name="db_routing", target=_check_replicas, daemon=True).start()
+            _CHECKER_PID = os.getpid()
+
+
+def get_stats():
+    """Состояние реплик по имени пула"""
+
+    return {key: replica.get_stats() for key, replica in list(REPLICAS.items())}
+
+
+def init_app(app):
+    """Запоминает настройки выбора и проверки реплик"""
+
+    balancing = app.config['DB_REPLICA_BALANCING']
+    if balancing not in (BALANCING_LEAST_OUTSTANDING, BALANCING_LATENCY):
+        raise ValueError(f"Неизвестный способ выбора реплики: {balancing}")
+
+    _SETTINGS['app'] = app
+    _SETTINGS['balancing'] = balancing
+    _SETTINGS['health_interval'] = app.config['DB_REPLICA_HEALTH_INTERVAL']
+    _SETTINGS['max_failures'] = app.config['DB_REPLICA_MAX_FAILURES']
+    metrics.register_collector('bc_db_replica', 'replica', get_stats)
@@ -0,0 +1,317 @@
+"""Ограничение времени работы запроса с базами данных (срок запроса)
+
+В начале обработки запроса вычисляется срок, к которому он должен закончить
+работу с базами данных: REQUEST_TIMEOUT секунд или значение декоратора timeout
+endpoint. Клиент может сократить срок заголовком REQUEST_TIMEOUT_HEADER (секунды),
+но не увеличить его.
+
+Каждый sql запрос (database.execute_sql, select_stream, блок database.transaction,
+database_async.execute_sql) получает остаток срока:
+    statement_timeout - вместе с запросом, в той же команде, выполняется
+        SET LOCAL statement_timeout = <остаток в мс>, и сервер сам прерывает запрос;
+    отмена - если запрос не закончился через DB_CANCEL_GRACE секунд после срока
+        (сервер не прервал его или завис обмен с сервером), поток deadlines
+        отменяет его через connection.cancel().
+Если срок уже истек, запрос к базе данных не отправляется. Запрос получает ответ
+504 (DeadlineExceeded), а соединение освобождается, не дожидаясь медленного запроса.
+
+SET LOCAL действует до конца транзакции: в режиме autocommit несколько команд
+одного обращения к серверу выполняются в одной неявной транзакции, поэтому
+значение не переживает запрос, и соединение возвращается в пул без сброса.
+
+Прерванные запросы считаются в /metrics по endpoint и базе данных:
+bc_db_deadline_exceeded_total{reason="expired|timeout|cancel"}.
+"""
+
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from psycopg2.extensions import QueryCanceledError
+from flask import current_app, g, has_app_context, has_request_context, jsonify, request
+from werkzeug.exceptions import GatewayTimeout
+from app import logging_into_seq, metrics
+
+_STATS_NAMES = ('expired', 'timeout', 'cancel', 'cancel_failures')
+
+STATS = metrics.Counters(_STATS_NAMES)
+
+_SETTINGS = {'enabled': True, 'grace': 0.5}
+
+# Запрос, прерванный сервером раньше срока не больше чем на столько секунд,
+# прерван statement_timeout (остаток срока округляется до миллисекунд)
+_TOLERANCE = 0.05
+
+_LOCK = threading.Lock()
+# Будит поток отмены, когда в очереди появился более ранний срок
+_CONDITION = threading.Condition(_LOCK)
+# Будит unwatch, ожидающий завершения отмены
+_CANCEL_DONE = threading.Condition(_LOCK)
+# Очередь отмены: (время отмены, номер, Watch)
+_QUEUE = []
+_SEQUENCE = itertools.count()
+# Размер очереди, при котором из нее убираются завершенные запросы
+_COMPACT_SIZE = 1024
+_WATCHDOG_PID = None
+
+
+class DeadlineExceeded(GatewayTimeout):
+    """Срок запроса истек: ответ 504"""
+
+    def __init__(self, db_name, reason):
+        super().__init__(f"Запрос к базе данных '{db_name}' не уложился в отведенное время.")
+        self.db_name = db_name
+        self.reason = reason
+
+
+class Watch:
+    """sql запрос, который нужно отменить, если он не закончится к сроку"""
+
+    __slots__ = ('connection', 'done', 'cancelling', 'cancelled')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.done = False
+        self.cancelling = False
+        self.cancelled = False
+
+
+def timeout(seconds):
+    """Декоратор: срок работы endpoint с базами данных в секундах вместо REQUEST_TIMEOUT
+    (None или 0 - без ограничения). Ставится рядом с маршрутом:
+
+        @bp.route('/export/')
+        @deadlines.timeout(300)
+        @log_this
+        def export():
+    """
+
+    def decorator(func):
+        func.request_timeout = seconds
+        return func
+
+    return decorator
+
+
+def _requested_timeout():
+    """Срок из заголовка запроса в секундах или None"""
+
+    value = request.headers.get(current_app.config['REQUEST_TIMEOUT_HEADER'])
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+
+    return seconds if math.isfinite(seconds) and seconds > 0 else None
+
+
+def start():
+    """before_request: срок запроса"""
+
+    view = current_app.view_functions.get(request.endpoint)
+    seconds = getattr(view, 'request_timeout', current_app.config['REQUEST_TIMEOUT'])
+    requested = _requested_timeout()
+    if requested is not None and (not seconds or requested < seconds):
+        seconds = requested
+
+    g.deadline = time.monotonic() + seconds if seconds else None
+
+
+def remaining():
+    """Сколько секунд осталось до срока текущего запроса. None - срока нет
+    (ограничение выключено, фоновый поток или endpoint без ограничения)"""
+
+    if not _SETTINGS['enabled'] or not has_app_context():
+        return None
+
+    deadline = g.get('deadline')
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _endpoint():
+    return (request.endpoint if has_request_context() else None) or 'unknown'
+
+
+def _exceeded(db_name, reason):
+    """Учитывает прерванный запрос и возвращает исключение для ответа 504"""
+
+    STATS.add(reason)
+    metrics.increment('bc_db_deadline_exceeded_total',
+                      (('endpoint', _endpoint()), ('database', db_name), ('reason', reason)))
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL - - запрос к '{db_name}' прерван: истек срок запроса ({reason}).")
+
+    return DeadlineExceeded(db_name, reason)
+
+
+def begin(db_name):
+    """Остаток срока для sql запроса к db_name: (команда SET LOCAL statement_timeout,
+    которую нужно отправить вместе с запросом или первой командой транзакции, время
+    отмены запроса по time.monotonic) или ('', None), если срока нет.
+    Если срок уже истек, бросает DeadlineExceeded"""
+
+    left = remaining()
+    if left is None:
+        return '', None
+
+    if left <= 0:
+        raise _exceeded(db_name, 'expired')
+
+    return (f"SET LOCAL statement_timeout = {max(int(left * 1000), 1)}; ",
+            time.monotonic() + left + _SETTINGS['grace'])
+
+
+def exceeded_error(db_name, cancelled):
+    """Исключение DeadlineExceeded для запроса, прерванного сервером
+    (QueryCanceledError). None - запрос отменен не по сроку (например,
+    pg_cancel_backend). cancelled - запрос отменил поток deadlines"""
+
+    if not cancelled and remaining() > _TOLERANCE:
+        return None
+
+    return _exceeded(db_name, 'cancel' if cancelled else 'timeout')
+
+
+@contextlib.contextmanager
+def statement(connection, db_name):
+    """Ограничивает sql запросы блока на соединении psycopg2 остатком срока
+    текущего запроса.
+
+    Отдает команду SET LOCAL statement_timeout (см. begin, пустая строка - срока
+    нет). Если срок истек, бросает DeadlineExceeded, QueryCanceledError из-за срока
+    тоже превращается в него."""
+
+    set_timeout, cancel_at = begin(db_name)
+    if cancel_at is None:
+        yield ''
+        return
+
+    cancel = watch(connection, cancel_at)
+    try:
+        yield set_timeout
+    except QueryCanceledError as err:
+        error = exceeded_error(db_name, unwatch(cancel))
+        if error is None:
+            raise
+        raise error from err
+    finally:
+        unwatch(cancel)
+
+
+def watch(connection, at):
+    """Ставит запрос соединения в очередь отмены на время at (time.monotonic).
+    connection - соединение psycopg2 или psycopg 3 (у обоих есть cancel())"""
+
+    global _COMPACT_SIZE
+
+    _ensure_watchdog()
+    watch = Watch(connection)
+    with _CONDITION:
+        # Завершенные запросы лежат в очереди до своего срока
+        if len(_QUEUE) >= _COMPACT_SIZE:
+            _QUEUE[:] = [entry for entry in _QUEUE if not entry[2].done]
+            heapq.heapify(_QUEUE)
+            _COMPACT_SIZE = max(2 * len(_QUEUE), 1024)
+        heapq.heappush(_QUEUE, (at, next(_SEQUENCE), watch))
+        if _QUEUE[0][2] is watch:
+            _CONDITION.notify()
+
+    return watch
+
+
+def unwatch(watch, wait=True):
+    """Убирает запрос из очереди отмены. Возвращает True, если запрос был отменен.
+
+    Если отмена уже отправляется, ждет ее завершения: иначе она может попасть
+    в следующий запрос того же соединения. wait=False - не ждать, а вернуть None
+    (для цикла событий, который нельзя блокировать: ждать нужно в другом потоке)."""
+
+    with _LOCK:
+        watch.done = True
+        if watch.cancelling and not wait:
+            return None
+        while watch.cancelling:
+            _CANCEL_DONE.wait()
+
+    return watch.cancelled
+
+
+def _run_watchdog():
+    with _CONDITION:
+        while True:
+            while _QUEUE and _QUEUE[0][2].done:
+                heapq.heappop(_QUEUE)
+            if not _QUEUE:
+                _CONDITION.wait()
+                continue
+
+            wait = _QUEUE[0][0] - time.monotonic()
+            if wait > 0:
+                _CONDITION.wait(wait)
+                continue
+
+            # cancel() открывает новое соединение с сервером, поэтому выполняется
+            # без блокировки: остальные запросы процесса его не ждут.
+            watch = heapq.heappop(_QUEUE)[2]
+            watch.cancelling = True
+            _LOCK.release()
+            try:
+                watch.connection.cancel()
+                cancelled = True
+            except Exception:
+                cancelled = False
+            finally:
+                _LOCK.acquire()
+            watch.cancelling = False
+            watch.cancelled = cancelled
+            if not cancelled:
+                STATS.add('cancel_failures')
+            _CANCEL_DONE.notify_all()
+
+
+def _ensure_watchdog():
+    """Запускает поток отмены (после fork - заново в новом процессе)"""
+
+    global _WATCHDOG_PID
+
+    if _WATCHDOG_PID == os.getpid():
+        return
+
+    with _LOCK:
+        if _WATCHDOG_PID != os.getpid():
+            _QUEUE.clear()
+            threading.Thread(name="deadlines", target=_run_watchdog, daemon=True).start()
+            _WATCHDOG_PID = os.getpid()
+
+
+def handle_deadline_exceeded(error):
+    """Ответ 504 в формате JSON"""
+
+    response = jsonify({'error': error.description})
+    response.status_code = error.code
+    return response
+
+
+def get_stats():
+    stats = STATS.snapshot()
+    stats['queue_size'] = len(_QUEUE)
+    return stats
+
+
+def init_app(app):
+    """Регистрирует срок запроса, если включен DB_DEADLINES.
+
+    Вызывается до admission.init_app: ожидание в очереди ограничителя входит в срок."""
+
+    app.register_error_handler(DeadlineExceeded, handle_deadline_exceeded)
+    _SETTINGS.update(enabled=app.config['DB_DEADLINES'], grace=app.config['DB_CANCEL_GRACE'])
+    if not _SETTINGS['enabled']:
+        return
+
+    app.before_request(start)
+    metrics.register_collector('bc_deadline', None, get_stats)
@@ -0,0 +1,225 @@
+"""Кеширование ответов на стороне клиента и сжатие
+
+after_request для успешных ответов на GET:
+    ETag - хеш тела ответа (blake2b), если view не поставил его сам. Запрос
+        с совпадающим If-None-Match получает 304 без тела;
+    сжатие - ответы больше HTTP_COMPRESS_MIN_SIZE байт сжимаются brotli (если
+        установлен пакет brotli и клиент его принимает) или gzip. Сжатое тело
+        запоминается по ETag в кеше процесса на HTTP_COMPRESS_CACHE_SIZE записей,
+        поэтому одинаковые ответы на частые опросы сжимаются один раз;
+    Cache-Control - политика endpoint из декоратора cache_control.
+
+Сжатые варианты ответа получают свой ETag ("<хеш>-gzip", "<хеш>-br"): строгий
+ETag обязан различаться у разных представлений одного ресурса.
+
+Потоковые ответы (json_stream_response) не трогаются: тело такого ответа
+не собирается в памяти.
+"""
+
+import functools
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+from app import metrics
+
+_STATS_NAMES = ('not_modified', 'compressed', 'compress_cache_hits', 'bytes_in', 'bytes_out')
+
+STATS = metrics.Counters(_STATS_NAMES)
+
+_SETTINGS = {'min_size': 1024, 'gzip_level': 6, 'brotli_quality': 5, 'cache_size': 128}
+
+# (ETag, кодировка) -> сжатое тело
+_COMPRESSED = OrderedDict()
+_LOCK = threading.Lock()
+
+_COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/')
+
+
+class Policy:
+    """Политика кеширования endpoint"""
+
+    __slots__ = ('cache_control', 'etag', 'compress')
+
+    def __init__(self, cache_control=None, etag=True, compress=True):
+        self.cache_control = cache_control
+        self.etag = etag
+        self.compress = compress
+
+
+DEFAULT_POLICY = Policy()
+
+
+def cache_control(max_age=None, public=False, private=False, no_cache=False, no_store=False,
+                  must_revalidate=False, stale_while_revalidate=None, etag=True,
+                  compress=True):
+    """Декоратор: политика кеширования ответа view. Ставится рядом с маршрутом:
+
+        @bp.route('/get_leagues_api_new/')
+        @cache_control(max_age=5, public=True, stale_while_revalidate=30)
+        @log_this
+        def get_leagues_api_new():
+
+    etag=False - не вычислять ETag, compress=False - не сжимать ответ."""
+
+    directives = []
+    if public:
+        directives.append('public')
+    if private:
+        directives.append('private')
+    if no_cache:
+        directives.append('no-cache')
+    if no_store:
+        directives.append('no-store')
+    if max_age is not None:
+        directives.append(f'max-age={max_age}')
+    if must_revalidate:
+        directives.append('must-revalidate')
+    if stale_while_revalidate is not None:
+        directives.append(f'stale-while-revalidate={stale_while_revalidate}')
+
+    policy = Policy(', '.join(directives) or None, etag, compress)
+
+    def decorator(func):
+        func.http_cache_policy = policy
+        return func
+
+    return decorator
+
+
+def get_policy():
+    """Политика endpoint текущего запроса"""
+
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'http_cache_policy', DEFAULT_POLICY)
+
+
+def content_etag(body):
+    """Строгий ETag тела ответа"""
+
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _brotli():
+    """Модуль brotli или None, если он не установлен. Импортируется при первом
+    сжатии ответа, а не при запуске воркера"""
+
+    try:
+        import brotli
+    except ImportError:  # pragma: no cover - зависит от окружения
+        return None
+    return brotli
+
+
+def choose_encoding():
+    """Кодировка сжатия, которую принимает клиент: br, gzip или None"""
+
+    accept = request.accept_encodings
+    if _brotli() is not None and accept['br'] and accept['br'] >= accept['gzip']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return _brotli().compress(body, quality=_SETTINGS['brotli_quality'])
+    return gzip.compress(body, compresslevel=_SETTINGS['gzip_level'], mtime=0)
+
+
+def get_compressed(etag, body, encoding):
+    """Сжатое тело из кеша или, при промахе, сжатое сейчас и сохраненное в кеш"""
+
+    key = (etag, encoding)
+    with _LOCK:
+        compressed = _COMPRESSED.get(key)
+        if compressed is not None:
+            _COMPRESSED.move_to_end(key)
+            STATS.add('compress_cache_hits')
+            return compressed
+
+    started = time.perf_counter()
+    compressed = compress(body, encoding)
+    metrics.add_timing('compress', time.perf_counter() - started)
+
+    with _LOCK:
+        _COMPRESSED[key] = compressed
+        while len(_COMPRESSED) > _SETTINGS['cache_size']:
+            _COMPRESSED.popitem(last=False)
+
+    return compressed
+
+
+def _is_compressible(response):
+    return (not response.content_encoding
+            and response.mimetype.startswith(_COMPRESSIBLE))
+
+
+def process_response(response):
+    """after_request: Cache-Control, ETag, 304 и сжатие"""
+
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200
+            or response.is_streamed or response.direct_passthrough):
+        return response
+
+    policy = get_policy()
+    if policy.cache_control and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = policy.cache_control
+
+    body = response.get_data()
+    encoding = None
+    if (policy.compress and len(body) >= _SETTINGS['min_size']
+            and _is_compressible(response)):
+        encoding = choose_encoding()
+        response.vary.add('Accept-Encoding')
+
+    etag, weak = response.get_etag()
+    if etag is None and policy.etag:
+        etag, weak = content_etag(body), False
+    if etag is not None:
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag, weak)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            STATS.add('not_modified')
+            return response
+
+    if encoding is not None:
+        compressed = get_compressed(etag, body, encoding) if etag else compress(body, encoding)
+        response.set_data(compressed)
+        response.content_encoding = encoding
+        STATS.add('compressed')
+        STATS.add('bytes_in', len(body))
+        STATS.add('bytes_out', len(compressed))
+
+    return response
+
+
+def get_stats():
+    stats = STATS.snapshot()
+    stats['compress_cache_entries'] = len(_COMPRESSED)
+    stats['compression_ratio'] = (stats['bytes_out'] / stats['bytes_in']
+                                  if stats['bytes_in'] else 0.0)
+    return stats
+
+
+def init_app(app):
+    """Регистрирует обработку ответов, если включен HTTP_CACHE.
+
+    Вызывается после metrics.init_app: after_request выполняются в обратном порядке
+    регистрации, и время сжатия успевает попасть в Server-Timing."""
+
+    if not app.config['HTTP_CACHE']:
+        return
+
+    _SETTINGS.update(
+        min_size=app.config['HTTP_COMPRESS_MIN_SIZE'],
+        gzip_level=app.config['HTTP_COMPRESS_LEVEL'],
+        brotli_quality=app.config['HTTP_BROTLI_QUALITY'],
+        cache_size=app.config['HTTP_COMPRESS_CACHE_SIZE'],
+    )
+    app.after_request(process_response)
+    metrics.register_collector('bc_http_cache', None, get_stats)
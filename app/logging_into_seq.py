@@ -1,33 +1,300 @@
 """Модуль обеспечивает логирование работы приложения в seq
-Используется библиотека seqlog. Работает через стандартный логгер Python"""
+Используется библиотека seqlog. Работает через стандартный логгер Python.
 
-import inspect
+Поток обработки запроса не сериализует записи и не ходит в сеть: запись вместе со
+своими свойствами кладется в ограниченную очередь, а фоновый поток собирает записи
+в пачки и отправляет их в seq.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
 from pathlib import Path
 from flask import current_app
 from flask_log_request_id import current_request_id
+import requests
 import seqlog
+from app import metrics
+
+# Информация о вызывающей функции, закешированная по объекту кода.
+_CALLERS = {}
+
+# Постоянные свойства, которые добавляются к каждой записи.
+_STATIC_PROPERTIES = {'AssemblyName': "bc_master"}
+
+_QUEUE_HANDLER = None
+
+
+def _caller_info(code):
+    """Возвращает имя функции и модуля для объекта кода.
+
+    Разбор пути файла выполняется один раз на объект кода, дальше результат
+    берется из кеша."""
 
+    try:
+        return _CALLERS[code]
+    except KeyError:
+        parts = Path(code.co_filename).with_suffix("").parts
+        info = _CALLERS[code] = (code.co_name, ".".join(parts[-3:]))
+        return info
 
-def send_log_to_seq(msg, properties={}):
+
+def is_enabled():
+    """Будут ли записи уровня INFO отправлены в seq. Позволяет не готовить
+    дорогие свойства записи, если она все равно будет отброшена"""
+
+    return current_app.logger.isEnabledFor(logging.INFO)
+
+
+def send_log_to_seq(msg, properties=None):
     """Отправляет данные на seq.
-    Обновляет глобальные константы для seqlog и отправляет данные в seq.
-    Константы можно добавлять любые, мы используем id текущего запроса, молуль и функцию,
+    Свойства передаются вместе с самой записью, а не через глобальные константы seqlog,
+    поэтому параллельные запросы не перезаписывают свойства друг друга.
+    Мы добавляем id текущего запроса, модуль, функцию и строку,
     из которых произведена запись"""
 
-    request_id = current_request_id()
-    func_name = inspect.getframeinfo(inspect.currentframe()
-                                     .f_back).function
-    parts = Path(inspect.currentframe()
-                 .f_back.f_code.co_filename).with_suffix("").parts
-    module_name = ".".join(parts[-3:])
-    lineno = inspect.currentframe().f_back.f_lineno
+    logger = current_app.logger
+    if not logger.isEnabledFor(logging.INFO):
+        return
+
+    started = time.perf_counter()
+    frame = sys._getframe(1)
+    code = frame.f_code
+    func_name, module_name = _caller_info(code)
+
+    log_props = dict(_STATIC_PROPERTIES)
+    if properties:
+        log_props.update(properties)
+    log_props['current_request_id'] = current_request_id()
+    log_props['func_name'] = func_name
+    log_props['module_name'] = module_name
+    log_props['lineno'] = frame.f_lineno
+
+    # Запись создается напрямую: так логгер не ищет вызывающую функцию повторно.
+    record = logger.makeRecord(logger.name, logging.INFO, code.co_filename,
+                               frame.f_lineno, msg, (), None, func_name,
+                               {'log_props': log_props})
+    logger.handle(record)
+    metrics.add_timing('log', time.perf_counter() - started)
+
+
+class SeqQueueHandler(logging.Handler):
+    """Обработчик логов с ограниченной очередью и фоновой отправкой пачками в seq.
+
+    emit только кладет запись в очередь. Если очередь заполнена, ждет не дольше
+    block_timeout секунд и отбрасывает запись. Сериализацию и сетевой запрос
+    выполняет фоновый поток, ответ seq проверяется (см. _publish)."""
+
+    _STOP = object()
+
+    def __init__(self, seq_handler, queue_size=10000, batch_size=10,
+                 auto_flush_timeout=None, block_timeout=0):
+        super().__init__(seq_handler.level)
+        self.seq_handler = seq_handler
+        self.batch_size = max(int(batch_size or 1), 1)
+        self.auto_flush_timeout = auto_flush_timeout or 1
+        self.block_timeout = block_timeout or 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = metrics.Counters(
+            ('enqueued', 'dropped', 'blocked', 'published', 'batches', 'failed'))
+        self._thread = None
+        self.start()
+
+    def post_fork(self):
+        """Вызывается в новом процессе после fork: поток отправки в нем не работает,
+        а очередь и HTTP-сессия seqlog принадлежат родителю. Записи, поставленные
+        в очередь родителем, отправит родитель"""
+
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.stats = metrics.Counters(self.stats)
+        session = self.seq_handler.session
+        self.seq_handler.session = requests.Session()
+        self.seq_handler.session.headers.update(session.headers)
+        self.start()
+
+    def start(self):
+        """Запускает фоновый поток отправки"""
+
+        self._thread = threading.Thread(name="SeqQueueHandler",
+                                        target=self._process_queue,
+                                        daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not self.block_timeout:
+                self.stats.add('dropped')
+                return
+            self.stats.add('blocked')
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self.stats.add('dropped')
+                return
+        self.stats.add('enqueued')
+
+    def _process_queue(self):
+        """Собирает записи в пачки: пачка отправляется, когда набралось batch_size
+        записей или прошло auto_flush_timeout секунд с первой записи в пачке"""
+
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                return
+
+            batch = [record]
+            stop = False
+            flush_at = time.monotonic() + self.auto_flush_timeout
+            while len(batch) < self.batch_size:
+                timeout = flush_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is self._STOP:
+                    stop = True
+                    break
+                batch.append(record)
+
+            self._publish(batch)
+            if stop:
+                return
+
+    def _serialize(self, records):
+        """Тело запроса в seq. Записи, которые не удалось сериализовать, отбрасываются
+        и учитываются в failed"""
+
+        encoder = self.seq_handler.json_encoder_class
+        try:
+            return json.dumps({'Events': [self.seq_handler._build_event_data(record)
+                                          for record in records]}, cls=encoder), len(records)
+        except (TypeError, ValueError):
+            pass
+
+        # Какая запись не сериализуется, неизвестно: проверяется каждая.
+        events = []
+        for record in records:
+            try:
+                events.append(json.dumps(self.seq_handler._build_event_data(record),
+                                         cls=encoder))
+            except (TypeError, ValueError):
+                self.stats.add('failed')
+                self.seq_handler.handleError(record)
+
+        return '{"Events": [' + ', '.join(events) + ']}', len(events)
+
+    def _publish(self, batch):
+        """Отправляет пачку в seq. SeqLogHandler.publish_log_batch сам перехватывает
+        ошибки сериализации и сети, поэтому запрос выполняется здесь: иначе потерянные
+        пачки считались бы отправленными"""
+
+        body, count = self._serialize(batch)
+        if not count:
+            return
+
+        try:
+            response = self.seq_handler.session.post(self.seq_handler.server_url, data=body)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.stats.add('failed', count)
+            # Как и seqlog, сообщает об ошибке только по первой записи пачки
+            self.seq_handler.handleError(batch[0])
+            return
+
+        self.stats.add('published', count)
+        self.stats.add('batches')
+
+    def close(self):
+        """Дожидается отправки накопленных записей и останавливает поток"""
+
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join(timeout=5)
+        self._thread = None
+        super().close()
+
+
+def get_log_queue_stats():
+    """Счетчики очереди логов: поставлено, отброшено, отправлено, пачек, ошибок"""
+
+    if _QUEUE_HANDLER is None:
+        return {}
+
+    stats = _QUEUE_HANDLER.stats.snapshot()
+    stats['queued'] = _QUEUE_HANDLER.queue.qsize()
+    return stats
+
+
+def init_app(app):
+    """Настраивает логирование в seq для приложения.
+
+    seqlog.log_to_seq настраивает корневой логгер, после чего его SeqLogHandler
+    заменяется на SeqQueueHandler. Дополнительные ключи SEQ_LOG_CONF:
+        queue_size - размер очереди записей (по умолчанию 10000);
+        block_timeout - сколько секунд ждать места в очереди перед тем,
+            как отбросить запись (по умолчанию 0 - отбрасывать сразу).
+    """
+
+    global _QUEUE_HANDLER
+
+    seq_log_config = app.config['SEQ_LOG_CONF']
+    seq_handler = seqlog.log_to_seq(
+        server_url=seq_log_config['server_url'],
+        api_key=seq_log_config['api_key'],
+        level=seq_log_config['level'],
+        batch_size=seq_log_config['batch_size'],
+        auto_flush_timeout=seq_log_config['auto_flush_timeout'],  # seconds
+        override_root_logger=seq_log_config['override_root_logger'],
+        json_encoder_class=app.json_encoder, )
+    # Пачки собирает SeqQueueHandler, собственный поток SeqLogHandler не нужен.
+    seq_handler.consumer.stop()
+
+    _STATIC_PROPERTIES.update(seqlog.get_global_log_properties())
+    _set_process_id()
+
+    root_logger = logging.getLogger()
+    root_logger.removeHandler(seq_handler)
+    if _QUEUE_HANDLER is not None:
+        root_logger.removeHandler(_QUEUE_HANDLER)
+        _QUEUE_HANDLER.close()
+
+    _QUEUE_HANDLER = SeqQueueHandler(
+        seq_handler,
+        queue_size=seq_log_config.get('queue_size', 10000),
+        batch_size=seq_log_config['batch_size'],
+        auto_flush_timeout=seq_log_config['auto_flush_timeout'],
+        block_timeout=seq_log_config.get('block_timeout', 0))
+    root_logger.addHandler(_QUEUE_HANDLER)
+    metrics.register_collector('bc_log_queue', None, get_log_queue_stats)
+
+
+def _set_process_id():
+    """seqlog запоминает ProcessId при импорте, а импорт мог быть до fork"""
+
+    pid = os.getpid()
+    _STATIC_PROPERTIES['ProcessId'] = pid
+    seqlog.set_global_log_properties(**dict(seqlog.get_global_log_properties(), ProcessId=pid))
+
+
+def post_fork():
+    """Заново запускает отправку логов в процессе, созданном fork (воркер gunicorn
+    с preload_app), и указывает в записях pid этого процесса"""
 
-    properties['AssemblyName'] = "bc_master"
-    properties['current_request_id'] = request_id
-    properties['func_name'] = func_name
-    properties['module_name'] = module_name
-    properties['lineno'] = lineno
+    _set_process_id()
+    if _QUEUE_HANDLER is not None:
+        _QUEUE_HANDLER.post_fork()
 
-    seqlog.set_global_log_properties(**properties)
 
-    current_app.logger.info(msg)
+@atexit.register
+def _flush_on_exit():
+    if _QUEUE_HANDLER is not None:
+        _QUEUE_HANDLER.close()
@@ -0,0 +1,266 @@
+"""Метрики производительности запросов
+
+Для каждого запроса накапливает в g.perf время работы с базой данных, ожидания
+соединения из пула, сериализации ответа и логирования (все замеры через
+time.perf_counter), а также количество полученных строк. По окончании запроса
+эти значения уходят клиенту в заголовке Server-Timing и попадают в гистограммы
+по endpoint. Время каждого sql запроса попадает в гистограмму по базе данных.
+
+GET /metrics отдает гистограммы, счетчики и показатели подсистем (пулы соединений,
+кеш результатов, очередь логов) в текстовом формате Prometheus. Метрики собираются
+в каждом процессе отдельно: при нескольких воркерах gunicorn каждый отдает свои.
+"""
+
+import threading
+import time
+from flask import Response, g, has_app_context, request
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Составляющие времени запроса для Server-Timing: имя в g.perf -> описание.
+# Заголовки HTTP передаются в latin-1, поэтому описания только латиницей.
+TIMINGS = {
+    'db': 'PostgreSQL',
+    'pool': 'Pool wait',
+    'serialize': 'JSON',
+    'log': 'Seq',
+    'compress': 'Compression',
+}
+
+_LOCK = threading.Lock()
+_HISTOGRAMS = {}
+_COUNTERS = {}
+_COLLECTORS = {}
+
+_HELP = {
+    'bc_request_duration_seconds': 'Время обработки запроса',
+    'bc_request_db_seconds': 'Время работы с базой данных за запрос',
+    'bc_request_pool_wait_seconds': 'Время ожидания соединения из пула за запрос',
+    'bc_request_serialize_seconds': 'Время сериализации ответа за запрос',
+    'bc_request_log_seconds': 'Время логирования за запрос',
+    'bc_db_query_duration_seconds': 'Время выполнения sql запроса',
+    'bc_requests_total': 'Количество обработанных запросов',
+    'bc_db_rows_total': 'Количество полученных из базы данных строк',
+    'bc_db_deadline_exceeded_total': 'Количество sql запросов, прерванных по сроку запроса',
+}
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами BUCKETS"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Counters(dict):
+    """Счетчики подсистемы для register_collector. Их одновременно увеличивают потоки
+    всех запросов процесса, а += у словаря не атомарен, поэтому изменения идут через
+    add или под lock. Читать можно как обычный словарь, согласованная копия - snapshot"""
+
+    def __init__(self, names):
+        super().__init__(dict.fromkeys(names, 0))
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self)
+
+
+def observe(name, labels, value):
+    """Добавляет значение в гистограмму name с метками labels (кортеж пар)"""
+
+    with _LOCK:
+        histogram = _HISTOGRAMS.get((name, labels))
+        if histogram is None:
+            histogram = _HISTOGRAMS[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+
+def increment(name, labels, value=1):
+    """Увеличивает счетчик name с метками labels"""
+
+    with _LOCK:
+        _COUNTERS[(name, labels)] = _COUNTERS.get((name, labels), 0) + value
+
+
+def add_timing(name, seconds):
+    """Добавляет время к составляющей name текущего запроса.
+    Вне запроса (фоновые потоки, запуск приложения) ничего не делает"""
+
+    if has_app_context():
+        perf = g.get('perf')
+        if perf is not None:
+            perf[name] = perf.get(name, 0.0) + seconds
+
+
+def add_rows(db_name, count):
+    """Учитывает полученные из базы данных строки"""
+
+    increment('bc_db_rows_total', (('database', db_name),), count)
+    if has_app_context():
+        perf = g.get('perf')
+        if perf is not None:
+            perf['rows'] = perf.get('rows', 0) + count
+
+
+def observe_query(db_name, seconds):
+    """Учитывает время одного sql запроса"""
+
+    observe('bc_db_query_duration_seconds', (('database', db_name),), seconds)
+    add_timing('db', seconds)
+    add_timing('queries', 1)
+
+
+def register_collector(prefix, label, collect):
+    """Регистрирует функцию collect, возвращающую показатели подсистемы.
+
+    collect возвращает {значение метки label: {показатель: число}} или, если label
+    пустой, просто {показатель: число}. Показатели выводятся как gauge prefix_показатель."""
+
+    _COLLECTORS[prefix] = (label, collect)
+
+
+def timed_json_encoder(encoder_class):
+    """Наследник encoder_class, который учитывает время сериализации в g.perf"""
+
+    class TimedJsonEncoder(encoder_class):
+
+        def encode(self, o):
+            started = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                add_timing('serialize', time.perf_counter() - started)
+
+    TimedJsonEncoder.__name__ = encoder_class.__name__
+    TimedJsonEncoder.__qualname__ = encoder_class.__qualname__
+
+    return TimedJsonEncoder
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                      for name, value in labels)
+    return '{' + values + '}'
+
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
+
+
+def render_prometheus():
+    """Все метрики процесса в текстовом формате Prometheus"""
+
+    lines = []
+
+    with _LOCK:
+        histograms = sorted(_HISTOGRAMS.items())
+        histograms = [(key, (list(h.counts), h.sum, h.count)) for key, h in histograms]
+        counters = sorted(_COUNTERS.items())
+
+    typed = set()
+    for (name, labels), (counts, total, count) in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    for prefix, (label, collect) in list(_COLLECTORS.items()):
+        try:
+            stats = collect()
+        except Exception:
+            continue
+        groups = stats.items() if label else [(None, stats)]
+        for label_value, values in groups:
+            labels = ((label, label_value),) if label else ()
+            for stat, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{prefix}_{stat}"
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics():
+    """Метрики в формате Prometheus"""
+
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Регистрирует замеры времени запроса, заголовок Server-Timing и GET /metrics.
+
+    Время сериализации учитывается через наследника app.json_encoder,
+    поэтому init_app вызывается после настройки json_encoder."""
+
+    app.json_encoder = timed_json_encoder(app.json_encoder)
+
+    @app.before_request
+    def start_request_timing():
+        g.perf = {}
+        g.perf_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_timing(response):
+        perf = g.get('perf')
+        if perf is None:
+            return response
+
+        total = time.perf_counter() - g.perf_start
+        endpoint = request.endpoint or 'unknown'
+        labels = (('endpoint', endpoint),)
+
+        observe('bc_request_duration_seconds', labels, total)
+        observe('bc_request_db_seconds', labels, perf.get('db', 0.0))
+        observe('bc_request_pool_wait_seconds', labels, perf.get('pool', 0.0))
+        observe('bc_request_serialize_seconds', labels, perf.get('serialize', 0.0))
+        observe('bc_request_log_seconds', labels, perf.get('log', 0.0))
+        increment('bc_requests_total', labels + (('status', response.status_code),))
+
+        timings = [f'{name};desc="{description}";dur={perf[name] * 1000:.3f}'
+                   for name, description in TIMINGS.items() if name in perf]
+        if 'rows' in perf:
+            timings.append(f'rows;desc="{perf["rows"]}"')
+        timings.append(f'total;dur={total * 1000:.3f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        return response
+
+    app.add_url_rule('/metrics', endpoint='metrics', view_func=metrics)
@@ -0,0 +1,305 @@
+"""Заранее подготовленные ответы endpoint
+
+Некоторые endpoint (например, get_leagues_api_new, когда будет перенесен его
+loader) отдают всем пользователям один и тот же результат. Такой ответ
+регистрируется через register: фоновый поток периодически вызывает loader
+в контексте приложения (с обычными функциями app.database), сериализует результат
+в байты JSON и подменяет готовый ответ одним присваиванием. Запрос отдает уже готовые байты с ETag (см. app.http_cache).
+
+    payloads.register('get_leagues_api_new', load_leagues, interval=30)
+
+    @bp.route('/get_leagues_api_new/')
+    def get_leagues_api_new():
+        return payloads.response('get_leagues_api_new')
+
+Ответ обновляется каждые interval секунд со случайным отклонением jitter (доля
+interval), чтобы воркеры не обновляли ответы одновременно. Пока ответ младше
+interval + stale секунд, запрос получает его сразу, даже если обновление
+запаздывает (stale-while-revalidate), и поток обновления будится. Если ответа нет
+или он старше, запрос строит его сам; одновременные запросы ждут одно построение.
+
+Если loader завершился ошибкой, запрос получает 503 с Cache-Control: no-store
+(PayloadUnavailable), а не ошибку с кодом 200, которую закешировали бы клиенты.
+Следующая попытка построения - не раньше чем через PAYLOAD_RETRY секунд, интервал
+удваивается с каждой ошибкой подряд (но не больше interval): до этого запросы
+сразу получают 503, а не вызывают loader каждый раз.
+
+loader вызывается вне запроса, поэтому имя базы данных он должен передавать явно
+(db_name), а не брать из префикса маршрута. У каждого процесса свой поток и свои
+ответы; при APP_PRELOAD поток запускается в воркере после fork (app.startup).
+Пока не зарегистрировано ни одного ответа, поток не запускается.
+"""
+
+import os
+import random
+import threading
+import time
+from flask import Response, current_app, jsonify
+from werkzeug.exceptions import ServiceUnavailable
+from app import http_cache, logging_into_seq, metrics, serialization
+
+_STATS_NAMES = ('refreshes', 'failures', 'hits', 'stale_hits', 'misses')
+
+_SETTINGS = {'app': None, 'enabled': True, 'interval': 60, 'stale': 300, 'jitter': 0.1,
+             'retry': 1}
+
+# имя -> Payload
+PAYLOADS = {}
+
+_LOCK = threading.Lock()
+_WAKE = threading.Event()
+_SCHEDULER_PID = None
+# Процесс, в котором вызван start: ответ, зарегистрированный позже, запускает поток сам
+_STARTED_PID = None
+
+
+class PayloadUnavailable(ServiceUnavailable):
+    """Ответ не удалось построить: 503 с Retry-After"""
+
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"Ответ '{name}' временно недоступен, повторите запрос позже.",
+                         retry_after=retry_after)
+        self.payload_name = name
+
+
+class Snapshot:
+    """Готовый ответ: тело JSON, его ETag и время построения (time.monotonic)"""
+
+    __slots__ = ('body', 'etag', 'built_at')
+
+    def __init__(self, body, etag, built_at):
+        self.body = body
+        self.etag = etag
+        self.built_at = built_at
+
+
+class Payload:
+    """Зарегистрированный ответ и расписание его обновления"""
+
+    def __init__(self, name, loader, interval=None, stale=None, jitter=None):
+        self.name = name
+        self.loader = loader
+        self.interval = interval
+        self.stale = stale
+        self.jitter = jitter
+        self.snapshot = None
+        self.next_refresh = 0.0
+        # Ошибок построения подряд и время, раньше которого новая попытка не делается
+        self.failures_in_row = 0
+        self.retry_at = 0.0
+        self.build_lock = threading.Lock()
+        self.stats = metrics.Counters(_STATS_NAMES)
+        self.stats['build_seconds'] = 0.0
+
+    def get_interval(self):
+        return self.interval or _SETTINGS['interval']
+
+    def get_stale(self):
+        return self.stale if self.stale is not None else _SETTINGS['stale']
+
+    def schedule(self, now):
+        jitter = self.jitter if self.jitter is not None else _SETTINGS['jitter']
+        interval = self.get_interval()
+        self.next_refresh = now + interval * (1 + random.uniform(-jitter, jitter))
+
+    def build(self):
+        """Вызывает loader, сериализует результат и подменяет готовый ответ.
+        После ошибки следующая попытка откладывается (см. retry_at)"""
+
+        started = time.perf_counter()
+        try:
+            body = serialization.dumps_bytes(
+                self.loader(), ensure_ascii=current_app.config['JSON_AS_ASCII'])
+        except Exception:
+            self.stats.add('failures')
+            self.failures_in_row += 1
+            delay = min(_SETTINGS['retry'] * 2 ** (self.failures_in_row - 1),
+                        self.get_interval())
+            self.retry_at = self.next_refresh = time.monotonic() + delay
+            raise
+
+        self.failures_in_row = 0
+        self.retry_at = 0.0
+        self.schedule(time.monotonic())
+        self.stats['build_seconds'] = time.perf_counter() - started
+        self.stats.add('refreshes')
+        self.snapshot = Snapshot(body, http_cache.content_etag(body), time.monotonic())
+
+        return self.snapshot
+
+    def build_once(self, snapshot):
+        """Строит ответ, если его еще не построил другой поток после snapshot.
+        Пока не прошло время повтора после ошибки, бросает PayloadUnavailable"""
+
+        with self.build_lock:
+            if self.snapshot is not snapshot:
+                return self.snapshot
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                raise PayloadUnavailable(self.name, max(int(wait + 0.999), 1))
+            return self.build()
+
+    def build_for_request(self, snapshot):
+        """build_once для запроса: ошибка loader превращается в ответ 503"""
+
+        try:
+            return self.build_once(snapshot)
+        except PayloadUnavailable:
+            raise
+        except Exception as err:
+            logging_into_seq.send_log_to_seq(
+                f"Ошибка при построении ответа '{self.name}': {err}")
+            raise PayloadUnavailable(self.name, max(int(_SETTINGS['retry']), 1)) from err
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        snapshot = self.snapshot
+        stats['age_seconds'] = time.monotonic() - snapshot.built_at if snapshot else 0.0
+        stats['bytes'] = len(snapshot.body) if snapshot else 0
+        stats['failures_in_row'] = self.failures_in_row
+        return stats
+
+
+def register(name, loader=None, interval=None, stale=None, jitter=None):
+    """Регистрирует ответ name, который строит loader(). Без loader - декоратор.
+
+    interval, stale (секунды) и jitter (доля interval) по умолчанию берутся
+    из PAYLOAD_REFRESH_INTERVAL, PAYLOAD_STALE и PAYLOAD_JITTER."""
+
+    def decorator(func):
+        PAYLOADS[name] = Payload(name, func, interval, stale, jitter)
+        _WAKE.set()
+        if _STARTED_PID == os.getpid():
+            _ensure_scheduler()
+        return func
+
+    if loader is None:
+        return decorator
+
+    return decorator(loader)
+
+
+def get_body(name):
+    """Готовый ответ name (Snapshot), при необходимости построенный в этом запросе"""
+
+    payload = PAYLOADS[name]
+    snapshot = payload.snapshot
+
+    if not _SETTINGS['enabled']:
+        return payload.build_for_request(snapshot)
+
+    _ensure_scheduler()
+
+    if snapshot is None:
+        payload.stats.add('misses')
+        return payload.build_for_request(None)
+
+    age = time.monotonic() - snapshot.built_at
+    if age <= payload.get_interval():
+        payload.stats.add('hits')
+        return snapshot
+
+    if age <= payload.get_interval() + payload.get_stale():
+        payload.stats.add('stale_hits')
+        payload.next_refresh = 0.0
+        _WAKE.set()
+        return snapshot
+
+    payload.stats.add('misses')
+    return payload.build_for_request(snapshot)
+
+
+def response(name):
+    """Ответ JSON из готовых байтов с ETag"""
+
+    snapshot = get_body(name)
+    result = Response(snapshot.body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    result.set_etag(snapshot.etag)
+    return result
+
+
+def refresh(name):
+    """Перестраивает ответ name сейчас (например, после изменения данных)"""
+
+    payload = PAYLOADS[name]
+    with payload.build_lock:
+        return payload.build()
+
+
+def _run_scheduler():
+    while True:
+        _WAKE.clear()
+        now = time.monotonic()
+        due = [payload for payload in list(PAYLOADS.values()) if payload.next_refresh <= now]
+
+        for payload in due:
+            with _SETTINGS['app'].app_context():
+                try:
+                    payload.build_once(payload.snapshot)
+                except Exception as err:
+                    logging_into_seq.send_log_to_seq(
+                        f"Ошибка при обновлении ответа '{payload.name}': {err}")
+
+        timeout = min((payload.next_refresh for payload in list(PAYLOADS.values())),
+                      default=now + _SETTINGS['interval']) - time.monotonic()
+        _WAKE.wait(max(timeout, 0.01))
+
+
+def _ensure_scheduler():
+    """Запускает поток обновления (после fork - заново в новом процессе).
+    Пока не зарегистрировано ни одного ответа, поток не нужен и не запускается"""
+
+    global _SCHEDULER_PID
+
+    if (_SCHEDULER_PID == os.getpid() or not _SETTINGS['enabled']
+            or _SETTINGS['app'] is None or not PAYLOADS):
+        return
+
+    with _LOCK:
+        if _SCHEDULER_PID != os.getpid():
+            for payload in PAYLOADS.values():
+                payload.next_refresh = 0.0
+            threading.Thread(name="payloads", target=_run_scheduler, daemon=True).start()
+            _SCHEDULER_PID = os.getpid()
+
+
+def start():
+    """Запускает обновление ответов в текущем процессе"""
+
+    global _STARTED_PID
+
+    _STARTED_PID = os.getpid()
+    _ensure_scheduler()
+
+
+def handle_unavailable(error):
+    """Ответ 503 в формате JSON, который клиенты и прокси не кешируют"""
+
+    response = jsonify({'error': error.description})
+    response.status_code = error.code
+    response.headers['Retry-After'] = str(error.retry_after)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def get_stats():
+    return {name: payload.get_stats() for name, payload in list(PAYLOADS.items())}
+
+
+def init_app(app):
+    """Запоминает настройки и, если приложение не загружается в мастер-процессе
+    gunicorn (APP_PRELOAD), сразу запускает поток обновления ответов"""
+
+    _SETTINGS.update(
+        app=app,
+        enabled=app.config['PAYLOADS'],
+        interval=app.config['PAYLOAD_REFRESH_INTERVAL'],
+        stale=app.config['PAYLOAD_STALE'],
+        jitter=app.config['PAYLOAD_JITTER'],
+        retry=app.config['PAYLOAD_RETRY'],
+    )
+    app.register_error_handler(PayloadUnavailable, handle_unavailable)
+    metrics.register_collector('bc_payload', 'payload', get_stats)
+
+    if not app.config['APP_PRELOAD']:
+        start()
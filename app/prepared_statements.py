@@ -0,0 +1,197 @@
+"""Кеш текста запросов и подготовленных запросов
+
+normalize_query запоминает нормализованный текст запроса (без переносов строк
+и лишних пробелов), поэтому одна и та же строка обрабатывается один раз.
+
+execute_prepared выполняет запрос через PREPARE/EXECUTE на стороне сервера.
+Разбор и планирование запроса сервер выполняет один раз на соединение, дальше
+вызывается только EXECUTE с параметрами. Подготовленные запросы живут в сессии
+соединения, поэтому кеш ведется отдельно для каждого соединения, ограничен
+DB_PREPARED_CACHE_SIZE запросами (вытесняются давно не использованные) и
+сбрасывается, когда пул закрывает соединение.
+
+Подготовленный запрос не используется (запрос выполняется обычным execute):
+    - внутри транзакции: ошибка PREPARE прервала бы ее;
+    - если параметр - список или кортеж: psycopg2 раскрывает их в запросе
+      (IN %s, ARRAY), а параметр PREPARE - одно значение;
+    - если PREPARE не удался - такой запрос запоминается в кеше соединения
+      и больше не подготавливается;
+    - в вызове, где параметр, для которого сервер вывел тип text, получает
+      не строку (например, SELECT %s с числом): результат отличался бы от обычного
+      запроса. Типы параметров хранятся в кеше и проверяются при каждом вызове.
+"""
+
+import functools
+import itertools
+import re
+from collections import OrderedDict
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+# id(соединения) -> (соединение, OrderedDict{(запрос, есть ли параметры):
+#     (имя запроса, параметры, номера параметров типа text)})
+# Имя None - запрос нельзя подготовить
+_CACHES = {}
+_NAMES = itertools.count(1)
+
+_PLACEHOLDER = re.compile(r"%%|%s|%\((\w+)\)s")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_query(query):
+    """Удаляет из запроса переносы строк и лишние пробелы"""
+
+    return ' '.join(query.split())
+
+
+@functools.lru_cache(maxsize=1024)
+def convert_placeholders(query):
+    """Переводит плейсхолдеры psycopg2 (%s, %(name)s) в параметры PREPARE ($1, $2...).
+
+    Возвращает запрос для PREPARE и либо количество позиционных параметров,
+    либо кортеж имен именованных. Если в запросе смешаны оба вида - None."""
+
+    names = []
+    positional = 0
+
+    def replace(match):
+        nonlocal positional
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            positional += 1
+            return f"${positional}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    prepared_query = _PLACEHOLDER.sub(replace, query)
+    if positional and names:
+        return None
+
+    return prepared_query, tuple(names) if names else positional
+
+
+def _get_cache(connection):
+    entry = _CACHES.get(id(connection))
+    if entry is None or entry[0] is not connection:
+        entry = _CACHES[id(connection)] = (connection, OrderedDict())
+
+    return entry[1]
+
+
+def invalidate(connection):
+    """Забывает подготовленные запросы соединения (соединение закрыто или сброшено)"""
+
+    entry = _CACHES.get(id(connection))
+    if entry is not None and entry[0] is connection:
+        del _CACHES[id(connection)]
+
+
+def _values(params, data_for_query, has_params):
+    """Значения параметров EXECUTE в порядке $1, $2..."""
+
+    if isinstance(params, tuple):
+        return [data_for_query[param] for param in params]
+    return list(data_for_query) if has_params else []
+
+
+def _add(cursor, key, name, params, text_params, cache_size):
+    cache = _get_cache(cursor.connection)
+    cache[key] = (name, params, text_params)
+    while len(cache) > cache_size:
+        old_name = cache.popitem(last=False)[1][0]
+        if old_name is not None:
+            cursor.execute(f"DEALLOCATE {old_name}")
+
+
+def _prepare(cursor, key, query, data_for_query, cache_size):
+    """Выполняет PREPARE и добавляет запрос в кеш соединения.
+    Возвращает (имя, параметры, номера параметров типа text) или None, если запрос
+    нельзя подготовить"""
+
+    has_params = data_for_query is not None
+    if has_params:
+        converted = convert_placeholders(query)
+        if converted is None:
+            _add(cursor, key, None, None, (), cache_size)
+            return None
+        prepared_query, params = converted
+    else:
+        prepared_query, params = query, 0
+
+    name = f"bc_stmt_{next(_NAMES)}"
+    try:
+        # Типы параметров, которые вывел сервер, приходят в том же обращении.
+        # Обычный курсор: у cursor может быть фабрика строк-словарей
+        with cursor.connection.cursor() as prepare_cursor:
+            prepare_cursor.execute(f"PREPARE {name} AS {prepared_query}; "
+                                   f"SELECT parameter_types::text[] FROM pg_prepared_statements "
+                                   f"WHERE name = '{name}'")
+            types = prepare_cursor.fetchone()[0]
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error:
+        _add(cursor, key, None, None, (), cache_size)
+        return None
+
+    text_params = tuple(index for index, type_name in enumerate(types)
+                        if type_name in ('text', 'unknown'))
+    _add(cursor, key, name, params, text_params, cache_size)
+    return name, params, text_params
+
+
+def execute_prepared(cursor, query, data_for_query=None, cache_size=100, prefix=''):
+    """Выполняет нормализованный запрос query через подготовленный запрос сервера.
+
+    prefix - команды, которые отправляются в одной команде с EXECUTE
+    (например, SET LOCAL statement_timeout из app.deadlines).
+
+    Возвращает False, если запрос нельзя подготовить (смешаны %s и %(name)s,
+    запрос состоит из нескольких команд, соединение в транзакции и другие случаи
+    из описания модуля) - тогда его нужно выполнить обычным cursor.execute."""
+
+    connection = cursor.connection
+    if (';' in query.rstrip(' ;') or not connection.autocommit
+            or connection.info.transaction_status != TRANSACTION_STATUS_IDLE):
+        return False
+
+    has_params = data_for_query is not None
+    if has_params:
+        items = data_for_query.values() if isinstance(data_for_query, dict) else data_for_query
+        if any(isinstance(value, (list, tuple)) for value in items):
+            return False
+
+    key = (query, has_params)
+    cache = _get_cache(connection)
+    prepared = cache.get(key)
+
+    if prepared is None:
+        prepared = _prepare(cursor, key, query, data_for_query, cache_size)
+        if prepared is None:
+            return False
+    else:
+        cache.move_to_end(key)
+
+    name, params, text_params = prepared
+    if name is None:
+        return False
+    values = _values(params, data_for_query, has_params)
+    # Параметр, для которого сервер вывел тип text, получает не строку: обычный
+    # запрос подставил бы значение своего типа, поэтому этот вызов - без PREPARE
+    if any(not isinstance(values[index], (str, type(None))) for index in text_params):
+        return False
+
+    statement = f"{prefix}EXECUTE {name}"
+    if values:
+        statement += f" ({', '.join(['%s'] * len(values))})"
+
+    try:
+        cursor.execute(statement, values or None)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Подготовленный запрос пропал из сессии (например, после DISCARD ALL).
+        invalidate(cursor.connection)
+        return execute_prepared(cursor, query, data_for_query, cache_size, prefix)
+
+    return True
@@ -0,0 +1,297 @@
+"""Профилировщик sql запросов
+
+database.execute_sql и select_stream передают сюда время и количество строк каждого
+выполненного запроса. Запросы группируются по отпечатку - тексту запроса, в котором
+литералы и параметры заменены на '?', а списки IN (...) свернуты. Для каждой базы
+данных (пула) и отпечатка считаются вызовы, ошибки, суммарное, среднее, максимальное время и p99 (по последним
+_WINDOW вызовам), строки, а также endpoint, из которых запрос вызывался. Хранится
+не больше DB_PROFILER_MAX_QUERIES отпечатков, давно не вызывавшиеся вытесняются.
+
+Запросы дольше DB_SLOW_QUERY_THRESHOLD секунд попадают в журнал медленных запросов
+вместе с параметрами. Для доли DB_EXPLAIN_SAMPLE_RATE медленных select запросов
+(не чаще раза в DB_EXPLAIN_INTERVAL секунд на отпечаток) фоновый поток выполняет
+EXPLAIN (ANALYZE, BUFFERS) в транзакции только для чтения (не дольше
+DB_EXPLAIN_TIMEOUT секунд) и сохраняет план.
+
+GET /metrics/queries?sort=total&limit=50 отдает отчет (параметры медленных запросов
+в него не попадают, они есть только в seq), а каждые
+DB_PROFILER_DUMP_INTERVAL секунд самые дорогие запросы логируются в seq.
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from flask import has_request_context, jsonify, request
+from app import db_pools, logging_into_seq
+
+# Сколько последних вызовов отпечатка хранится для p99
+_WINDOW = 500
+
+_LITERALS = re.compile(
+    r"'(?:[^']|'')*'"            # строки
+    r"|\$\d+"                    # параметры PREPARE
+    r"|%\(\w+\)s|%s"             # плейсхолдеры psycopg2
+    r"|(?<![\w.])\d+(?:\.\d+)?(?:e[+-]?\d+)?(?![\w.])",  # числа
+    re.IGNORECASE)
+_LISTS = re.compile(r"\b(in\s*)\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SELECT = re.compile(r"^\s*(?:select|with)\b", re.IGNORECASE)
+_WRITE = re.compile(r"\b(?:insert|update|delete|merge|into|for\s+update)\b", re.IGNORECASE)
+
+_SETTINGS = {'app': None, 'enabled': True, 'slow_threshold': 0.5, 'explain_rate': 0.0,
+             'explain_interval': 300, 'explain_timeout': 30, 'dump_interval': 0,
+             'dump_limit': 20, 'max_queries': 1000}
+
+# (имя пула, id отпечатка) -> QueryStats, давно не вызывавшиеся - в начале
+QUERIES = collections.OrderedDict()
+SLOW_QUERIES = collections.deque(maxlen=100)
+
+_LOCK = threading.Lock()
+_EXPLAIN_QUEUE = queue.Queue(maxsize=100)
+_THREADS = {}
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(query):
+    """Отпечаток запроса и его короткий id"""
+
+    text = _LISTS.sub(r'\1(...)', _LITERALS.sub('?', ' '.join(query.split())))
+    return text, hashlib.md5(text.encode()).hexdigest()[:16]
+
+
+class QueryStats:
+    """Статистика одного отпечатка запроса"""
+
+    __slots__ = ('query_id', 'fingerprint', 'db_name', 'calls', 'errors', 'total', 'max',
+                 'rows', 'durations', 'endpoints', 'plan', 'explained_at')
+
+    def __init__(self, query_id, text, db_name):
+        self.query_id = query_id
+        self.fingerprint = text
+        self.db_name = db_name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.durations = collections.deque(maxlen=_WINDOW)
+        self.endpoints = collections.Counter()
+        self.plan = None
+        self.explained_at = 0.0
+
+    def add(self, duration, rows, error, endpoint):
+        self.calls += 1
+        self.errors += error
+        self.total += duration
+        self.max = max(self.max, duration)
+        if rows is not None and rows > 0:
+            self.rows += rows
+        self.durations.append(duration)
+        if endpoint is not None:
+            self.endpoints[endpoint] += 1
+
+    def p99(self):
+        durations = sorted(self.durations)
+        if not durations:
+            return 0.0
+        return durations[min(int(len(durations) * 0.99), len(durations) - 1)]
+
+    def as_dict(self):
+        return {
+            'query_id': self.query_id,
+            'db': self.db_name,
+            'fingerprint': self.fingerprint,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'max': self.max,
+            'p99': self.p99(),
+            'rows': self.rows,
+            'rows_per_call': self.rows / self.calls if self.calls else 0.0,
+            'endpoints': dict(self.endpoints.most_common(10)),
+            'plan': self.plan,
+        }
+
+
+def record(db_name, query, data_for_query, duration, rows=None, error=False):
+    """Учитывает выполненный запрос. query - нормализованный текст запроса,
+    db_name - имя пула (основной сервер или реплика)"""
+
+    if not _SETTINGS['enabled']:
+        return
+
+    text, query_id = fingerprint(query)
+    endpoint = request.endpoint if has_request_context() else None
+
+    key = (db_name, query_id)
+    with _LOCK:
+        stats = QUERIES.get(key)
+        if stats is None:
+            stats = QUERIES[key] = QueryStats(query_id, text, db_name)
+            while len(QUERIES) > _SETTINGS['max_queries']:
+                QUERIES.popitem(last=False)
+        else:
+            QUERIES.move_to_end(key)
+        stats.add(duration, rows, error, endpoint)
+
+    if duration >= _SETTINGS['slow_threshold']:
+        _slow_query(stats, db_name, query, data_for_query, duration, rows, endpoint)
+
+
+def _slow_query(stats, db_name, query, data_for_query, duration, rows, endpoint):
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'query_id': stats.query_id,
+        'db': db_name,
+        'endpoint': endpoint,
+        'query': query,
+        'params': repr(data_for_query),
+        'duration': duration,
+        'rows': rows,
+    }
+    SLOW_QUERIES.append(entry)
+    logging_into_seq.send_log_to_seq(
+        f"PostgreSQL - - Медленный запрос {stats.query_id}: {duration:.3f} с.", entry)
+
+    now = time.monotonic()
+    if (_SETTINGS['explain_rate'] and random.random() < _SETTINGS['explain_rate']
+            and now - stats.explained_at >= _SETTINGS['explain_interval']
+            and _SELECT.match(query) and not _WRITE.search(query)):
+        stats.explained_at = now
+        _start_thread('explain', _explain_worker)
+        try:
+            _EXPLAIN_QUEUE.put_nowait((stats, entry, db_name, query, data_for_query))
+        except queue.Full:
+            pass
+
+
+def explain(db_name, query, data_for_query):
+    """План запроса EXPLAIN (ANALYZE, BUFFERS) в формате JSON.
+
+    ANALYZE выполняет запрос, поэтому он выполняется в транзакции только для чтения,
+    которая затем откатывается. Время выполнения ограничено DB_EXPLAIN_TIMEOUT."""
+
+    connection = db_pools.getconn(db_name)
+    try:
+        connection.autocommit = False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute("SET LOCAL statement_timeout = %s",
+                               (max(int(_SETTINGS['explain_timeout'] * 1000), 1),))
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", data_for_query)
+                plan = cursor.fetchone()[0]
+        finally:
+            connection.rollback()
+            connection.autocommit = True
+    finally:
+        db_pools.putconn(db_name, connection)
+
+    return plan
+
+
+def _explain_worker():
+    while True:
+        stats, entry, db_name, query, data_for_query = _EXPLAIN_QUEUE.get()
+        with _SETTINGS['app'].app_context():
+            try:
+                plan = explain(db_name, query, data_for_query)
+            except Exception as err:
+                logging_into_seq.send_log_to_seq(
+                    f"PostgreSQL - - EXPLAIN запроса {stats.query_id} не выполнен: {err}")
+                continue
+            stats.plan = entry['plan'] = plan
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - План медленного запроса {stats.query_id}.",
+                {'query_id': stats.query_id, 'plan': json.dumps(plan, ensure_ascii=False)})
+
+
+def get_report(sort='total', limit=50, params=True):
+    """Отпечатки, отсортированные по убыванию sort (total, mean, p99, max, calls, rows),
+    и журнал медленных запросов. params=False - без параметров медленных запросов"""
+
+    with _LOCK:
+        queries = [stats.as_dict() for stats in QUERIES.values()]
+
+    queries.sort(key=lambda stats: stats.get(sort) or 0, reverse=True)
+
+    slow_queries = list(SLOW_QUERIES)
+    if not params:
+        slow_queries = [{key: value for key, value in entry.items() if key != 'params'}
+                        for entry in slow_queries]
+
+    return {'queries': queries[:limit], 'slow_queries': slow_queries}
+
+
+def reset():
+    with _LOCK:
+        QUERIES.clear()
+        SLOW_QUERIES.clear()
+
+
+def _dump_worker():
+    while True:
+        time.sleep(_SETTINGS['dump_interval'])
+        with _SETTINGS['app'].app_context():
+            report = get_report(limit=_SETTINGS['dump_limit'])
+            logging_into_seq.send_log_to_seq(
+                f"PostgreSQL - - Профиль запросов: {len(QUERIES)} отпечатков.",
+                {'queries': json.dumps([dict(stats, plan=None) for stats in report['queries']],
+                                       ensure_ascii=False)})
+
+
+def _start_thread(name, target):
+    """Запускает фоновый поток один раз в процессе (после fork - заново)"""
+
+    pid = os.getpid()
+    if _THREADS.get(name) == pid:
+        return
+
+    with _LOCK:
+        if _THREADS.get(name) != pid:
+            threading.Thread(name=f"query_profiler_{name}", target=target, daemon=True).start()
+            _THREADS[name] = pid
+
+
+def queries_report():
+    """Отчет профилировщика: ?sort=total|mean|p99|max|calls|rows&limit=50.
+    Параметры запросов могут содержать персональные данные, поэтому не отдаются"""
+
+    return jsonify(get_report(request.args.get('sort', 'total'),
+                              request.args.get('limit', 50, type=int), params=False))
+
+
+def ensure_dump_thread():
+    if _SETTINGS['dump_interval']:
+        _start_thread('dump', _dump_worker)
+
+
+def init_app(app):
+    """Настройки профилировщика из config.py и отчет GET /metrics/queries"""
+
+    global SLOW_QUERIES
+
+    config = app.config
+    _SETTINGS.update(
+        app=app,
+        enabled=config['DB_PROFILER'],
+        max_queries=config['DB_PROFILER_MAX_QUERIES'],
+        slow_threshold=config['DB_SLOW_QUERY_THRESHOLD'],
+        explain_rate=config['DB_EXPLAIN_SAMPLE_RATE'],
+        explain_interval=config['DB_EXPLAIN_INTERVAL'],
+        explain_timeout=config['DB_EXPLAIN_TIMEOUT'],
+        dump_interval=config['DB_PROFILER_DUMP_INTERVAL'],
+        dump_limit=config['DB_PROFILER_DUMP_LIMIT'],
+    )
+    SLOW_QUERIES = collections.deque(SLOW_QUERIES, maxlen=config['DB_SLOW_QUERY_LOG_SIZE'])
+
+    if config['DB_PROFILER']:
+        app.add_url_rule('/metrics/queries', endpoint='queries_report', view_func=queries_report)
+        app.before_request(ensure_dump_thread)
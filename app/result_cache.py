@@ -0,0 +1,361 @@
+"""Кеш результатов select запросов
+
+Справочные данные (списки лиг, турниров и т.п.) меняются редко, а запрашиваются
+постоянно. database.select_all/select_one с параметром cache_ttl сначала ищут
+результат в кеше и идут в PostgreSQL только при промахе.
+
+Ключ кеша - имя базы данных, нормализованный текст запроса, формат строк и параметры.
+Каждая запись помечена тегами - таблицами, из которых читает запрос. Функции записи
+database.insert/update/delete и app.bulk_write сбрасывают теги своих таблиц: запись
+считается устаревшей, если любой ее тег сброшен после того, как она была сохранена.
+Внутри транзакции и после записи в том же запросе кеш не используется: результат
+может содержать незафиксированные данные.
+
+Хранилище задается RESULT_CACHE_BACKEND в config.py:
+    memory - словарь в памяти процесса (у каждого воркера gunicorn свой кеш);
+    file - файлы в каталоге RESULT_CACHE_PATH, общие для всех воркеров на сервере;
+    redis - сервер RESULT_CACHE_URL, общий для всех серверов (нужен пакет redis).
+Размер кеша ограничен RESULT_CACHE_MAX_ENTRIES, давно не использованные записи вытесняются.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from app import logging_into_seq, metrics
+
+_TABLE = re.compile(
+    r'\b(?:join|into|update|table)\s+(?:if\s+(?:not\s+)?exists\s+|only\s+)?(?!lateral\b)'
+    r'((?:"?\w+"?\.)?"?\w+"?)', re.IGNORECASE)
+_TOKEN = re.compile(r"'(?:[^']|'')*'|(?:\"[^\"]*\"|\w+)(?:\.(?:\"[^\"]*\"|\w+))*|\S")
+# Слова, которые заканчивают список таблиц FROM
+_FROM_END = frozenset((
+    'where', 'group', 'order', 'limit', 'offset', 'having', 'window', 'union', 'intersect',
+    'except', 'returning', 'for', 'fetch', 'select', 'values', 'set'))
+
+
+def _listed_tables(query):
+    """Таблицы списков FROM a, b [JOIN c ON ..., d] и TRUNCATE a, b на всех уровнях
+    вложенности: имя после FROM, JOIN, TRUNCATE [TABLE] и после запятой в таком списке"""
+
+    tables = []
+    # Для каждого уровня скобок: идет ли список таблиц
+    in_list = [False]
+    expect_table = False
+    for token in _TOKEN.findall(query):
+        word = token.lower()
+        if token == '(':
+            in_list.append(False)
+        elif token == ')':
+            if len(in_list) > 1:
+                in_list.pop()
+        elif expect_table and word in ('only', 'lateral', 'table'):
+            continue
+        elif expect_table and (token[0] == '"' or token[0].isalnum() or token[0] == '_'):
+            tables.append(token)
+        elif word in ('from', 'join', 'truncate'):
+            in_list[-1] = True
+            expect_table = True
+            continue
+        elif word in _FROM_END:
+            in_list[-1] = False
+        elif token == ',' and in_list[-1]:
+            expect_table = True
+            continue
+        expect_table = False
+
+    return tables
+
+_STATS_NAMES = ('hits', 'misses', 'sets', 'expired', 'stale', 'evictions', 'invalidations')
+
+STATS = metrics.Counters(_STATS_NAMES)
+
+_BACKEND = None
+
+
+@functools.lru_cache(maxsize=1024)
+def tables_in_query(query):
+    """Таблицы, которые упоминаются в запросе (после FROM, JOIN, INTO, UPDATE,
+    TRUNCATE), в том числе все таблицы списка FROM a, b"""
+
+    found = _TABLE.findall(query) + _listed_tables(query)
+
+    tables = set()
+    for table in found:
+        table = table.replace('"', '').lower()
+        tables.add(table.split('.')[-1])
+
+    return frozenset(tables)
+
+
+def _tag(db_name, table):
+    return f"{db_name}:{table}"
+
+
+class MemoryBackend:
+    """Кеш в памяти процесса. Значения хранятся как есть, без копирования -
+    результаты из кеша изменять нельзя"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                STATS.add('evictions')
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def tag_versions(self, tags):
+        return [self.tags.get(tag, 0) for tag in tags]
+
+    def bump_tags(self, tags, version):
+        for tag in tags:
+            self.tags[tag] = version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+
+class FileBackend:
+    """Кеш в файлах: записи видны всем процессам сервера.
+
+    Запись сохраняется во временный файл и переименовывается, поэтому процессы
+    не читают недописанные файлы. Время доступа к записи - mtime файла, по нему
+    вытесняются давно не использованные записи."""
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.tags_path = os.path.join(path, 'tags')
+        self.max_entries = max_entries
+        self.writes = 0
+        os.makedirs(self.tags_path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pickle")
+
+    def _write(self, file_name, data):
+        tmp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_name, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_name, file_name)
+
+    def get(self, key):
+        file_name = self._file(key)
+        try:
+            with open(file_name, 'rb') as cache_file:
+                entry = pickle.load(cache_file)
+            os.utime(file_name)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return entry
+
+    def set(self, key, entry):
+        self._write(self._file(key), pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self._evict()
+
+    def _evict(self):
+        """Удаляет самые старые по времени доступа записи сверх max_entries"""
+
+        with os.scandir(self.path) as files:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in files
+                       if entry.name.endswith('.pickle')]
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for _, file_name in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(file_name)
+                STATS.add('evictions')
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def tag_versions(self, tags):
+        versions = []
+        for tag in tags:
+            try:
+                with open(os.path.join(self.tags_path, tag), 'rb') as tag_file:
+                    versions.append(int(tag_file.read() or 0))
+            except (OSError, ValueError):
+                versions.append(0)
+        return versions
+
+    def bump_tags(self, tags, version):
+        for tag in tags:
+            self._write(os.path.join(self.tags_path, tag), str(version).encode())
+
+    def clear(self):
+        for root, _, files in os.walk(self.path):
+            for file_name in files:
+                try:
+                    os.remove(os.path.join(root, file_name))
+                except OSError:
+                    pass
+
+
+class RedisBackend:
+    """Кеш в redis, общий для всех серверов. Время жизни записей и вытеснение
+    выполняет сам redis (настройте maxmemory-policy allkeys-lru)"""
+
+    def __init__(self, url, prefix='bc_master:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, entry):
+        ttl = max(int(entry['expires_at'] - time.time()) + 1, 1)
+        self.client.set(self.prefix + key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def tag_versions(self, tags):
+        if not tags:
+            return []
+        return [int(version or 0) for version in
+                self.client.mget([self.prefix + 'tag:' + tag for tag in tags])]
+
+    def bump_tags(self, tags, version):
+        if tags:
+            self.client.mset({self.prefix + 'tag:' + tag: version for tag in tags})
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_key(db_name, query, data_for_query, row_factory):
+    """Ключ кеша для запроса"""
+
+    return hashlib.sha1(
+        repr((db_name, query, row_factory, data_for_query)).encode()).hexdigest()
+
+
+def get_or_load(db_name, query, data_for_query, row_factory, ttl, tags, loader):
+    """Возвращает результат запроса из кеша или вызывает loader и кеширует результат.
+
+    tags - таблицы, при изменении которых запись устаревает. По умолчанию
+    таблицы берутся из текста запроса."""
+
+    if _BACKEND is None:
+        return loader()
+
+    key = make_key(db_name, query, data_for_query, row_factory)
+    tags = [_tag(db_name, table) for table in (tags or tables_in_query(query))]
+
+    try:
+        entry = _BACKEND.get(key)
+    except Exception as err:
+        logging_into_seq.send_log_to_seq(f"Кеш результатов - - ошибка чтения: {err}")
+        entry = None
+
+    now = time.time()
+    if entry is not None:
+        if entry['expires_at'] <= now:
+            STATS.add('expired')
+        elif max(_BACKEND.tag_versions(tags), default=0) >= entry['created_at']:
+            STATS.add('stale')
+        else:
+            STATS.add('hits')
+            return entry['result']
+
+    STATS.add('misses')
+    created_at = time.time_ns()
+    result = loader()
+
+    try:
+        _BACKEND.set(key, {'created_at': created_at, 'expires_at': now + ttl, 'result': result})
+        STATS.add('sets')
+    except Exception as err:
+        logging_into_seq.send_log_to_seq(f"Кеш результатов - - ошибка записи: {err}")
+
+    return result
+
+
+def invalidate(db_name, tables):
+    """Сбрасывает записи кеша, которые читают из таблиц tables базы данных db_name"""
+
+    if _BACKEND is None or not tables:
+        return
+
+    tags = [_tag(db_name, table) for table in tables]
+    _BACKEND.bump_tags(tags, time.time_ns())
+    STATS.add('invalidations')
+
+
+def invalidate_query(db_name, query):
+    """Сбрасывает записи кеша для таблиц, которые изменяет запрос query"""
+
+    invalidate(db_name, tables_in_query(query))
+
+
+def clear():
+    if _BACKEND is not None:
+        _BACKEND.clear()
+
+
+def get_stats():
+    """Счетчики кеша и доля попаданий"""
+
+    stats = STATS.snapshot()
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    stats['miss_ratio'] = stats['misses'] / lookups if lookups else 0.0
+    return stats
+
+
+def init_app(app):
+    """Создает хранилище кеша по настройкам RESULT_CACHE_* из config.py"""
+
+    global _BACKEND
+
+    metrics.register_collector('bc_result_cache', None, get_stats)
+
+    backend = app.config['RESULT_CACHE_BACKEND']
+    max_entries = app.config['RESULT_CACHE_MAX_ENTRIES']
+
+    if not backend:
+        _BACKEND = None
+    elif backend == 'memory':
+        _BACKEND = MemoryBackend(max_entries)
+    elif backend == 'file':
+        _BACKEND = FileBackend(app.config['RESULT_CACHE_PATH'], max_entries)
+    elif backend == 'redis':
+        _BACKEND = RedisBackend(app.config['RESULT_CACHE_URL'])
+    else:
+        raise ValueError(f"Неизвестное хранилище кеша результатов: {backend}")
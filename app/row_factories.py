@@ -0,0 +1,144 @@
+"""Форматы строк, в которых database возвращает результат запроса
+
+    ROW_DICT - словарь на каждую строку (RealDictCursor), формат по умолчанию;
+    ROW_TUPLE - кортеж на каждую строку, как его вернул курсор;
+    ROW_RECORD - кортеж Row (как namedtuple): доступ по имени столбца, индексу
+        и атрибуту, класс создается один раз на набор столбцов;
+    ROW_COLUMNS - столбцы: словарь {имя столбца: список значений}.
+
+Кортежи и Row не хранят имена столбцов в каждой строке, поэтому занимают в разы
+меньше памяти, чем словари. В JSON строки ROW_TUPLE и ROW_RECORD - массивы
+значений в порядке столбцов.
+"""
+
+import functools
+import keyword
+import operator
+
+ROW_DICT = 'dict'
+ROW_TUPLE = 'tuple'
+ROW_RECORD = 'record'
+ROW_COLUMNS = 'columns'
+
+ROW_FACTORIES = (ROW_DICT, ROW_TUPLE, ROW_RECORD, ROW_COLUMNS)
+
+
+class Row(tuple):
+    """Строка результата запроса.
+
+    Кортеж значений, как namedtuple: имена столбцов и их индексы общие для всех
+    строк и лежат в классе, созданном row_class. В JSON сериализуется как массив."""
+
+    __slots__ = ()
+
+    _fields = ()
+    _index = {}
+
+    def __new__(cls, values):
+        return tuple.__new__(cls, values)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={value!r}" for name, value in zip(self._fields, self))
+        return f"Row({values})"
+
+    def __reduce__(self):
+        return _restore_row, (self._fields, tuple(self))
+
+    def get(self, key, default=None):
+        """Значение столбца по имени или default"""
+
+        index = self._index.get(key)
+        if index is None:
+            return default
+        return tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._fields
+
+    def _asdict(self):
+        """Строка в виде словаря {столбец: значение}"""
+
+        return dict(zip(self._fields, self))
+
+
+def _field_property(index):
+    return property(operator.itemgetter(index))
+
+
+@functools.lru_cache(maxsize=256)
+def row_class(fields):
+    """Создает класс строки для набора столбцов fields (кортеж имен).
+
+    Класс кешируется, поэтому повторные запросы с теми же столбцами
+    используют уже созданный класс. Столбцы с именами-идентификаторами
+    доступны еще и как атрибуты."""
+
+    namespace = {
+        '__slots__': (),
+        '_fields': fields,
+        '_index': {name: index for index, name in enumerate(fields)},
+    }
+    for index, name in enumerate(fields):
+        if (name.isidentifier() and not keyword.iskeyword(name)
+                and not name.startswith('_') and not hasattr(Row, name)):
+            namespace[name] = _field_property(index)
+
+    return type('Row', (Row,), namespace)
+
+
+def _restore_row(fields, values):
+    return row_class(fields)(values)
+
+
+def column_names(description):
+    """Имена столбцов из cursor.description"""
+
+    return tuple(column[0] for column in description)
+
+
+def make_rows(records, description, row_factory):
+    """Приводит список кортежей курсора к формату row_factory"""
+
+    if row_factory == ROW_TUPLE or row_factory == ROW_DICT:
+        return records
+
+    fields = column_names(description)
+
+    if row_factory == ROW_RECORD:
+        return list(map(row_class(fields), records))
+
+    if row_factory == ROW_COLUMNS:
+        if not records:
+            return {name: [] for name in fields}
+        return dict(zip(fields, map(list, zip(*records))))
+
+    raise ValueError(f"Неизвестный формат строк: {row_factory}")
+
+
+def make_row(record, description, row_factory):
+    """Приводит одну строку курсора к формату row_factory"""
+
+    if record is None:
+        return None
+
+    rows = make_rows([record], description, row_factory)
+    if row_factory == ROW_COLUMNS:
+        return rows
+
+    return rows[0]
+
+
+def rows_count(result, row_factory):
+    """Количество строк в результате формата row_factory (None - строки нет)"""
+
+    if result is None:
+        return 0
+    if row_factory == ROW_COLUMNS:
+        return len(next(iter(result.values()), ()))
+
+    return len(result)
@@ -0,0 +1,119 @@
+"""Быстрая сериализация ответов в JSON
+
+JsonEncoder - json_encoder приложения. Если установлен orjson, encode сериализует
+весь ответ за один вызов на C, а Python вызывается только для типов, которые
+orjson не знает (Decimal, наследники tuple: app.row_factories.Row, namedtuple).
+Без orjson, а также для вызовов, которые orjson не поддерживает (ensure_ascii=True,
+отступ не 2, свой separators), работает базовый config.JsonEncoder из стандартной
+библиотеки.
+
+Оба пути дают одинаковый JSON по содержанию:
+    Decimal - число (float);
+    datetime, date, time - строка ISO 8601;
+    UUID - строка;
+    кортежи ROW_TUPLE, строки Row и другие наследники tuple - массив.
+
+ensure_ascii приложения задает JSON_AS_ASCII в config.py (по умолчанию выключен,
+иначе orjson не используется). Отключить orjson можно через JSON_ENGINE=stdlib.
+"""
+
+import datetime
+import decimal
+import uuid
+import config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+ENGINE_ORJSON = 'orjson'
+ENGINE_STDLIB = 'stdlib'
+
+_ENGINE = ENGINE_ORJSON if orjson is not None else ENGINE_STDLIB
+
+
+def _default(obj):
+    """Типы, которые orjson не сериализует сам"""
+
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, tuple):
+        # Наследники tuple (Row, namedtuple) - массивы, как в json из стандартной
+        # библиотеки: копия кортежа дешевле словаря на каждую строку
+        return tuple(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonEncoder(config.JsonEncoder):
+    """json_encoder приложения: orjson, если возможно, иначе config.JsonEncoder"""
+
+    def default(self, obj):
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        return super().default(obj)
+
+    def _orjson_option(self):
+        """Опции orjson для параметров encoder или None, если orjson их не поддерживает"""
+
+        if _ENGINE != ENGINE_ORJSON or self.ensure_ascii or not self.check_circular:
+            return None
+        if self.indent is not None and self.indent != 2:
+            return None
+        if self.indent is None and self.item_separator != ',':
+            return None
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent == 2:
+            option |= orjson.OPT_INDENT_2
+
+        return option
+
+    def encode(self, o):
+        option = self._orjson_option()
+        if option is not None:
+            try:
+                return orjson.dumps(o, default=_default, option=option).decode()
+            except TypeError:
+                # Например, целое больше 64 бит - такое сериализует только json.
+                pass
+
+        return super().encode(o)
+
+
+def dumps_bytes(obj, ensure_ascii=False):
+    """Компактный JSON в байтах (как тело ответа jsonify) - для заранее
+    подготовленных ответов. С orjson сериализует сразу в bytes, без промежуточной строки"""
+
+    if _ENGINE == ENGINE_ORJSON and not ensure_ascii:
+        try:
+            return orjson.dumps(obj, default=_default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+
+    encoder = JsonEncoder(ensure_ascii=ensure_ascii, separators=(',', ':'))
+    return encoder.encode(obj).encode('utf-8')
+
+
+def get_engine():
+    """Какой сериализатор используется: orjson или stdlib"""
+
+    return _ENGINE
+
+
+def init_app(app):
+    """Выбирает сериализатор по JSON_ENGINE и устанавливает JsonEncoder в приложение"""
+
+    global _ENGINE
+
+    engine = app.config['JSON_ENGINE']
+    if engine not in (ENGINE_ORJSON, ENGINE_STDLIB):
+        raise ValueError(f"Неизвестный сериализатор JSON: {engine}")
+    _ENGINE = engine if orjson is not None else ENGINE_STDLIB
+
+    app.json_encoder = JsonEncoder
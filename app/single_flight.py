@@ -0,0 +1,86 @@
+"""Объединение одинаковых одновременных запросов (single-flight)
+
+В пиковые моменты много запросов к одному endpoint одновременно выполняют один
+и тот же select с одинаковыми параметрами, и каждый занимает свое соединение пула.
+database.select_all/select_one с coalesce=True (или при DB_SINGLE_FLIGHT)
+выполняют такой select через do: первый вызов (ведущий) идет в базу данных,
+а вызовы с тем же ключом, пришедшие до его завершения, ждут и получают тот же результат (или то же исключение).
+
+Объединяются вызовы в пределах процесса, то есть потоки одного воркера gunicorn
+(worker_class gthread). Результат общий для всех ожидавших - изменять его нельзя.
+"""
+
+import threading
+from app import metrics
+
+_STATS_NAMES = ('leaders', 'coalesced', 'errors', 'timeouts')
+
+# db_name -> счетчики
+STATS = {}
+
+_CALLS = {}
+_LOCK = threading.Lock()
+
+
+class _Call:
+    """Выполняющийся запрос: ожидающие ждут event и забирают result или error"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _count(db_name, name):
+    stats = STATS.get(db_name)
+    if stats is None:
+        stats = STATS.setdefault(db_name, metrics.Counters(_STATS_NAMES))
+    stats.add(name)
+
+
+def do(db_name, key, loader, timeout=None):
+    """Вызывает loader или ждет результат уже выполняющегося вызова с тем же key.
+
+    Если ведущий вызов не завершился за timeout секунд, ожидающий выполняет
+    loader сам. Возвращает (результат, был ли он получен от другого вызова)."""
+
+    with _LOCK:
+        call = _CALLS.get(key)
+        leader = call is None
+        if leader:
+            call = _CALLS[key] = _Call()
+
+    if not leader:
+        if not call.event.wait(timeout):
+            _count(db_name, 'timeouts')
+            return loader(), False
+        _count(db_name, 'coalesced')
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    _count(db_name, 'leaders')
+    try:
+        call.result = loader()
+    except BaseException as err:
+        call.error = err
+        _count(db_name, 'errors')
+        raise
+    finally:
+        with _LOCK:
+            del _CALLS[key]
+        call.event.set()
+
+    return call.result, False
+
+
+def get_stats():
+    """Счетчики по базам данных: ведущих вызовов, объединенных, ошибок, таймаутов ожидания"""
+
+    return {db_name: stats.snapshot() for db_name, stats in list(STATS.items())}
+
+
+def init_app(app):
+    metrics.register_collector('bc_single_flight', 'database', get_stats)
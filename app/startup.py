@@ -0,0 +1,98 @@
+"""Режим запуска приложения и замеры холодного старта
+
+При APP_PRELOAD (см. gunicorn.conf.py) gunicorn выполняет create_app один раз
+в мастер-процессе, а воркеры получают готовое приложение через fork и делят
+его память с мастером (copy-on-write). Мастер в этом режиме не создает пулы
+соединений. Ресурсы процесса нельзя наследовать: в воркере после fork вызывается
+post_fork - заново запускается поток отправки логов в seq, создаются пулы
+соединений, запускается обновление ответов app.payloads, а в логах указывается
+pid воркера.
+
+Время старта процесса попадает в /metrics (bc_startup_*):
+    import_seconds - импорт пакета app;
+    create_app_seconds - create_app;
+    boot_seconds - от начала импорта (в воркере - от fork) до готовности;
+    first_request_seconds - первый запрос процесса;
+    first_request_after_boot_seconds - от готовности до окончания первого запроса.
+"""
+
+import os
+import threading
+import time
+from flask import g
+from app import db_pools, logging_into_seq, metrics, payloads
+
+STATS = {}
+
+_LOCK = threading.Lock()
+_STATE = {'pid': os.getpid(), 'booted': None, 'first_request': False}
+
+
+def mark(name, seconds):
+    """Запоминает замер name в секундах"""
+
+    STATS[name] = seconds
+
+
+def booted(started):
+    """Процесс готов обрабатывать запросы. started - perf_counter начала старта"""
+
+    _STATE['booted'] = time.perf_counter()
+    mark('boot_seconds', _STATE['booted'] - started)
+
+
+def record_first_request(e=None):
+    """teardown_request: время первого запроса процесса"""
+
+    if _STATE['first_request'] or _STATE['pid'] != os.getpid():
+        return
+
+    with _LOCK:
+        if _STATE['first_request']:
+            return
+        _STATE['first_request'] = True
+
+    now = time.perf_counter()
+    started = g.get('start')
+    if started is not None:
+        mark('first_request_seconds', now - started)
+    if _STATE['booted'] is not None:
+        mark('first_request_after_boot_seconds', now - _STATE['booted'])
+
+    logging_into_seq.send_log_to_seq("Первый запрос процесса обработан.", dict(STATS))
+
+
+def post_fork(app):
+    """Вызывается в воркере gunicorn сразу после fork.
+
+    Поток отправки логов и соединения с базами данных мастер-процесса в воркере
+    не работают, поэтому создаются заново. Замеры первого запроса сбрасываются:
+    у каждого воркера свой холодный старт."""
+
+    started = time.perf_counter()
+    _STATE.update(pid=os.getpid(), booted=None, first_request=False)
+    STATS.pop('first_request_seconds', None)
+    STATS.pop('first_request_after_boot_seconds', None)
+
+    logging_into_seq.post_fork()
+    with app.app_context():
+        db_pools.warm_up()
+        payloads.start()
+        booted(started)
+        logging_into_seq.send_log_to_seq("Воркер запущен.", dict(STATS))
+
+
+def get_stats():
+    return dict(STATS)
+
+
+def init_app(app, started, import_seconds=None):
+    """Регистрирует замеры старта. started - perf_counter начала create_app"""
+
+    if import_seconds is not None:
+        mark('import_seconds', import_seconds)
+    mark('create_app_seconds', time.perf_counter() - started)
+    booted(started - (import_seconds or 0.0))
+
+    app.teardown_request(record_first_request)
+    metrics.register_collector('bc_startup', None, get_stats)
@@ -1,5 +1,6 @@
 import app.views as views
 from flask import Blueprint, current_app, jsonify
+from app.http_cache import cache_control
 from app.views.commons import log_this_into_seq as log_this
 import logging
 
@@ -7,6 +8,7 @@ bp = Blueprint('main', __name__, url_prefix='/api')
 
 
 @bp.route('/get_leagues_api_new/')
+@cache_control(max_age=5, public=True, stale_while_revalidate=30)
 @log_this
 def get_leagues_api_new():
     """
@@ -1 +1,4 @@
-from .log_this_into_seq import log_this_into_seq
\ No newline at end of file
+from .log_this_into_seq import log_this_into_seq
+from .json_stream_response import json_stream_response
+from .object_to_array import object_to_array
+from .transform import Level, aggregate, columns_of, group_by, index_by, nest, pivot, to_dicts
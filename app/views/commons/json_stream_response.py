@@ -0,0 +1,47 @@
+"""Потоковая отдача больших выборок в формате JSON."""
+
+from flask import Response, current_app, stream_with_context
+
+
+def json_stream_response(rows, ndjson=False, chunk_rows=None):
+    """Отдает строки клиенту по мере их получения из базы данных.
+
+    rows - любой итерируемый объект, например генератор database.select_stream.
+    По умолчанию формирует JSON массив, с ndjson=True - по одному JSON объекту в строке
+    (application/x-ndjson). Строки сериализуются json_encoder приложения и отправляются
+    кусками по chunk_rows строк (по умолчанию JSON_STREAM_CHUNK_ROWS из config.py),
+    поэтому ответ целиком в памяти не собирается, а первый байт уходит клиенту сразу
+    после первой пачки из базы.
+
+    Генератор оборачивается в stream_with_context: контекст запроса (и соединения
+    с базой данных в g) живут до конца отдачи ответа.
+    """
+
+    chunk_rows = chunk_rows or current_app.config['JSON_STREAM_CHUNK_ROWS']
+    encode = current_app.json_encoder(
+        ensure_ascii=current_app.config['JSON_AS_ASCII'],
+        separators=(',', ':')).encode
+
+    if ndjson:
+        start, separator, end = '', '\n', '\n'
+        mimetype = 'application/x-ndjson'
+    else:
+        start, separator, end = '[', ',', ']\n'
+        mimetype = current_app.config['JSONIFY_MIMETYPE']
+
+    def generate():
+        chunk = [start]
+        first = True
+        for row in rows:
+            if not first:
+                chunk.append(separator)
+            first = False
+            chunk.append(encode(row))
+            if len(chunk) >= 2 * chunk_rows:
+                yield ''.join(chunk)
+                chunk = []
+        if not (first and ndjson):
+            chunk.append(end)
+        yield ''.join(chunk)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
@@ -1,21 +1,45 @@
 """Декоратор для логирования функций."""
 
+import asyncio
 import functools
 import logging
+from werkzeug.exceptions import HTTPException
+
+# Ответ об ошибке не кешируется клиентами и прокси, даже если у endpoint
+# есть политика Cache-Control (см. app.http_cache.cache_control)
+_ERROR_RESPONSE = ({'error': 'it was an error'}, 200, {'Cache-Control': 'no-store'})
 
 
 def log_this_into_seq(func):
     """Обработчик ошибок.
     В случае поднятия исключения отправляет полное описание ошибки в SEQ.
     Чтобы сохранить в декораторе имя оборачиваемой функции/docstring,
-    используем functools.wraps()"""
+    используем functools.wraps().
+    Для async view декоратор тоже возвращает корутину.
+    HTTPException (например, 503 при перегрузке базы данных) пробрасывается дальше:
+    Flask сам превращает ее в ответ с нужным кодом."""
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as err:
+                logging.error(err, exc_info=True)
+                return _ERROR_RESPONSE
+
+        return async_wrapper
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except HTTPException:
+            raise
         except Exception as err:
             logging.error(err, exc_info=True)
-            return {'error': 'it was an error'}
+            return _ERROR_RESPONSE
 
     return wrapper
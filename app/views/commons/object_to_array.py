@@ -1,7 +1,14 @@
 """Вспомогательные функции"""
 
+
 def object_to_array(data):
-    """
+    """Рекурсивно приводит объекты к словарям и спискам, как objectToArray в PHP.
+
+    Строки Row и namedtuple становятся словарями {столбец: значение}, объекты -
+    словарями своих атрибутов, кортежи и множества - списками. Для результатов
+    запросов лучше подходят функции app.views.commons.transform: они строят
+    вложенную структуру ответа за один проход по строкам.
+
         function objectToArray($obj) {
             if(is_object($obj)) $obj = (array) $obj;
             if(is_array($obj)) {
@@ -13,4 +20,16 @@ def object_to_array(data):
             else $new = $obj;
             return $new;
         }
-    """
\ No newline at end of file
+    """
+
+    if hasattr(data, '_asdict'):
+        data = data._asdict()
+    elif hasattr(data, '__dict__') and not isinstance(data, type):
+        data = vars(data)
+
+    if isinstance(data, dict):
+        return {key: object_to_array(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple, set, frozenset)):
+        return [object_to_array(value) for value in data]
+
+    return data
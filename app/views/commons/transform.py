@@ -0,0 +1,305 @@
+"""Преобразование результатов запросов в структуры ответов
+
+Функции работают с тем, что вернул app.database, за один проход по строкам:
+    index_by - словарь строк по ключу ($res[$row['id']] = $row);
+    group_by - словарь списков строк по ключу ($res[$row['id']][] = $row);
+    pivot - таблица {строка: {столбец: значение}};
+    nest - вложенная структура, например лиги -> турниры -> матчи;
+    columns_of - столбцы {имя: список значений};
+    aggregate - count, sum, min, max, mean числовых столбцов по группам.
+
+Строки могут быть в любом формате app.row_factories: словари (ROW_DICT), Row
+(ROW_RECORD) или кортежи курсора (ROW_TUPLE). Для кортежей нужно передать имена
+столбцов columns (например, row_factories.column_names(cursor.description)),
+тогда столбцы можно указывать по именам. Ключ - имя столбца или кортеж имен
+(составной ключ).
+
+aggregate считает на NumPy, если он установлен: строки проходятся один раз, чтобы
+найти группы и собрать столбцы в массивы, сами вычисления выполняются в NumPy.
+NumPy импортируется при первом вызове aggregate, а не при запуске воркера.
+"""
+
+import collections
+import functools
+import math
+from operator import itemgetter
+
+# Уровень вложенности nest: key - ключ узла, fields - столбцы узла (по умолчанию
+# столбцы ключа), children - имя списка дочерних узлов или строк
+Level = collections.namedtuple('Level', 'key fields children', defaults=(None, 'items'))
+
+
+def _index(name, columns):
+    if columns is not None and isinstance(name, str):
+        return columns.index(name)
+    return name
+
+
+def _key_getter(key, columns=None):
+    """Функция, возвращающая значение ключа строки (кортеж для составного ключа)"""
+
+    if isinstance(key, (list, tuple)):
+        if len(key) == 1:
+            index = _index(key[0], columns)
+            return lambda row: (row[index],)
+        return itemgetter(*(_index(name, columns) for name in key))
+
+    return itemgetter(_index(key, columns))
+
+
+def _fields_getter(fields, columns=None):
+    """Функция, возвращающая кортеж значений fields строки"""
+
+    return _key_getter(tuple(fields), columns)
+
+
+def _fields(rows, columns):
+    """Имена столбцов: columns или столбцы первой строки"""
+
+    if columns is not None:
+        return tuple(columns)
+    for row in rows:
+        return tuple(row.keys())
+    return ()
+
+
+def _record_maker(fields, columns):
+    """Функция, создающая словарь {столбец: значение} из строки. fields=None - все столбцы"""
+
+    if fields is None:
+        if columns is not None:
+            names = tuple(columns)
+            return lambda row: dict(zip(names, row))
+        return lambda row: row if isinstance(row, dict) else row._asdict()
+
+    names = tuple(fields)
+    get = _fields_getter(names, columns)
+    return lambda row: dict(zip(names, get(row)))
+
+
+def to_dicts(rows, columns=None):
+    """Строки в виде словарей"""
+
+    return list(map(_record_maker(None, columns), rows))
+
+
+def index_by(rows, key, fields=None, columns=None):
+    """Словарь {ключ: строка}. При повторе ключа остается последняя строка.
+    fields - оставить в строке только эти столбцы"""
+
+    get_key = _key_getter(key, columns)
+    if fields is None and columns is None:
+        return {get_key(row): row for row in rows}
+
+    make = _record_maker(fields, columns)
+    return {get_key(row): make(row) for row in rows}
+
+
+def group_by(rows, key, fields=None, columns=None):
+    """Словарь {ключ: [строки]} в порядке первого появления ключа"""
+
+    get_key = _key_getter(key, columns)
+    make = None if fields is None and columns is None else _record_maker(fields, columns)
+
+    groups = {}
+    for row in rows:
+        group_key = get_key(row)
+        group = groups.get(group_key)
+        if group is None:
+            group = groups[group_key] = []
+        group.append(row if make is None else make(row))
+
+    return groups
+
+
+def pivot(rows, index, column, value, aggregate=None, columns=None):
+    """Таблица {index: {column: value}}.
+
+    При повторе пары (index, column) остается последнее значение или, если задана
+    aggregate(накопленное, новое), результат ее вызова (например, operator.add)."""
+
+    get_index = _key_getter(index, columns)
+    get_column = _key_getter(column, columns)
+    get_value = _key_getter(value, columns)
+
+    table = {}
+    for row in rows:
+        line_key = get_index(row)
+        line = table.get(line_key)
+        if line is None:
+            line = table[line_key] = {}
+        name = get_column(row)
+        if aggregate is not None and name in line:
+            line[name] = aggregate(line[name], get_value(row))
+        else:
+            line[name] = get_value(row)
+
+    return table
+
+
+def nest(rows, levels, leaf=None, keyed=False, columns=None):
+    """Вложенная структура из плоского результата запроса с join.
+
+    levels - уровни Level(key, fields, children) от внешнего к внутреннему. Узел
+    уровня создается при первом появлении его ключа среди строк с тем же родителем
+    и содержит столбцы fields и список children. В список children последнего уровня
+    попадают строки со столбцами leaf (None - все столбцы, пустой кортеж - строки
+    не добавляются). Строки могут идти в любом порядке, порядок узлов - порядок
+    первого появления.
+
+    keyed=True - узлы хранятся в словарях по значению ключа, как ассоциативные
+    массивы PHP ($res[$league_id]['tournaments'][$tournament_id]...).
+
+        nest(rows, [Level('league_id', ('league_id', 'league_name'), 'tournaments'),
+                    Level('tournament_id', ('tournament_id', 'tournament_name'), 'matches')],
+             leaf=('match_id', 'home', 'away'))
+    """
+
+    spec = []
+    for level in levels:
+        level = Level(*level)
+        fields = level.fields
+        if fields is None:
+            fields = level.key if isinstance(level.key, (list, tuple)) else (level.key,)
+        spec.append((_key_getter(level.key, columns), _record_maker(fields, columns),
+                     level.children))
+    make_leaf = _record_maker(leaf, columns) if leaf != () else None
+
+    # Узлы каждого уровня по пути ключей от корня
+    lookups = [{} for _ in spec]
+    last = len(spec) - 1
+    result = {} if keyed else []
+
+    for row in rows:
+        container = result
+        path = ()
+        for depth, (get_key, make_node, children) in enumerate(spec):
+            node_key = get_key(row)
+            path += (node_key,)
+            node = lookups[depth].get(path)
+            if node is None:
+                node = lookups[depth][path] = make_node(row)
+                node[children] = {} if keyed and depth < last else []
+                if keyed:
+                    container[node_key] = node
+                else:
+                    container.append(node)
+            container = node[children]
+        if make_leaf is not None:
+            container.append(make_leaf(row))
+
+    return result
+
+
+def columns_of(rows, fields=None, columns=None):
+    """Столбцы {имя: список значений} (как ROW_COLUMNS) только для fields"""
+
+    rows = rows if isinstance(rows, list) else list(rows)
+    fields = tuple(fields) if fields is not None else _fields(rows, columns)
+    if not rows:
+        return {name: [] for name in fields}
+
+    return {name: list(map(_key_getter(name, columns), rows)) for name in fields}
+
+
+def _group_index(rows, by, columns):
+    """Номер группы каждой строки и ключи групп в порядке первого появления"""
+
+    get_key = _key_getter(by, columns)
+    groups = {}
+    inverse = [groups.setdefault(get_key(row), len(groups)) for row in rows]
+    return inverse, list(groups)
+
+
+def _aggregate_python(rows, inverse, size, fields, columns):
+    get_values = _fields_getter(fields, columns)
+    # Для каждой группы и столбца: [sum, count, min, max]
+    stats = [[[0, 0, None, None] for _ in fields] for _ in range(size)]
+
+    for group, values in zip(inverse, map(get_values, rows)):
+        for accumulator, value in zip(stats[group], values):
+            if value is None:
+                continue
+            accumulator[0] += value
+            accumulator[1] += 1
+            if accumulator[2] is None or value < accumulator[2]:
+                accumulator[2] = value
+            if accumulator[3] is None or value > accumulator[3]:
+                accumulator[3] = value
+
+    return [[(float(total) if count else None, count,
+              None if low is None else float(low), None if high is None else float(high))
+             for total, count, low, high in group] for group in stats]
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """Модуль numpy или None, если он не установлен"""
+
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - зависит от окружения
+        return None
+    return numpy
+
+
+def _aggregate_numpy(rows, inverse, size, fields, columns):
+    numpy = _numpy()
+    inverse = numpy.fromiter(inverse, dtype=numpy.intp, count=len(inverse))
+    values = columns_of(rows, fields, columns)
+
+    result = [[None] * len(fields) for _ in range(size)]
+    for position, name in enumerate(fields):
+        try:
+            data = numpy.array(values[name], dtype=float)
+        except TypeError:
+            # Есть пустые значения: None заменяется на nan
+            data = numpy.fromiter(
+                (math.nan if value is None else value for value in values[name]),
+                dtype=float, count=len(inverse))
+        present = ~numpy.isnan(data)
+        counts = numpy.bincount(inverse, weights=present, minlength=size)
+        sums = numpy.bincount(inverse, weights=numpy.where(present, data, 0.0), minlength=size)
+        # fmin/fmax пропускают nan, поэтому пустые значения не влияют на результат.
+        lows = numpy.full(size, math.nan)
+        highs = numpy.full(size, math.nan)
+        numpy.fmin.at(lows, inverse, data)
+        numpy.fmax.at(highs, inverse, data)
+
+        for group in range(size):
+            count = int(counts[group])
+            result[group][position] = (
+                float(sums[group]) if count else None, count,
+                float(lows[group]) if count else None, float(highs[group]) if count else None)
+
+    return result
+
+
+def aggregate(rows, by, fields, columns=None, use_numpy=None):
+    """Агрегаты числовых столбцов fields по группам ключа by.
+
+    Возвращает {ключ: {'count': строк, столбец: {'sum', 'min', 'max', 'mean'}}},
+    группы - в порядке первого появления. Пустые значения (NULL) пропускаются.
+    use_numpy - считать на NumPy (по умолчанию - если он установлен)."""
+
+    rows = rows if isinstance(rows, list) else list(rows)
+    fields = tuple(fields)
+    inverse, keys = _group_index(rows, by, columns)
+
+    if use_numpy is None:
+        use_numpy = _numpy() is not None
+    if use_numpy and _numpy() is None:
+        raise RuntimeError("Для aggregate(use_numpy=True) нужен пакет numpy.")
+
+    calculate = _aggregate_numpy if use_numpy else _aggregate_python
+    stats = calculate(rows, inverse, len(keys), fields, columns) if rows else []
+    counts = collections.Counter(inverse)
+
+    result = {}
+    for group, key in enumerate(keys):
+        entry = result[key] = {'count': counts[group]}
+        for name, (total, count, low, high) in zip(fields, stats[group]):
+            entry[name] = {'sum': total, 'min': low, 'max': high,
+                           'mean': total / count if count else None}
+
+    return result
@@ -0,0 +1,95 @@
+"""Микро-бенчмарки слоя базы данных и логирования
+
+Измеряет время одного вызова в контексте запроса Flask, как его видит view:
+    execute_sql - SELECT 1 (курсор, логирование запроса, выполнение);
+    select_all - выборки generate_series на несколько размеров и форматов строк;
+    send_log_to_seq - запись лога в очередь (включенное и выключенное логирование).
+
+Нужен PostgreSQL из PROJECT_DATA_BASES, логи уходят в заглушку seq. Запуск:
+
+    python -m benchmarks.bench_db [--db api] [--rows 1 100 1000 10000] [--repeat 50]
+"""
+
+import argparse
+import logging
+
+from app import create_app, database, logging_into_seq
+from app.row_factories import ROW_DICT, ROW_RECORD, ROW_TUPLE
+from benchmarks.common import bench_config, default_db_name, measure, request_context
+from benchmarks.stub_seq import StubSeqServer
+
+SELECT_ROWS = ("SELECT g AS id, 'Команда ' || g AS name, (g %% 1000) / 100.0 AS odds, "
+               "now() AS start_time FROM generate_series(1, %s) g")
+
+
+def bench_execute_sql(app, db_name, repeat):
+    with request_context(app):
+        def execute():
+            database.execute_sql("SELECT 1", db_name=db_name).close()
+
+        return [{'benchmark': 'execute_sql', 'db': db_name, **measure(execute, repeat)}]
+
+
+def bench_select_all(app, db_name, row_counts, repeat):
+    results = []
+    with request_context(app):
+        for count in row_counts:
+            for row_factory in (ROW_DICT, ROW_TUPLE, ROW_RECORD):
+                timing = measure(lambda: database.select_all(
+                    SELECT_ROWS, (count,), db_name, row_factory=row_factory), repeat)
+                results.append({'benchmark': 'select_all', 'db': db_name, 'rows': count,
+                                'row_format': row_factory, **timing})
+
+    return results
+
+
+def bench_logging(app, repeat):
+    """Время send_log_to_seq в потоке запроса; отправка в seq идет в фоновом потоке"""
+
+    results = []
+    with request_context(app):
+        properties = {'sql': SELECT_ROWS, 'params': '(100,)'}
+        for level in (logging.INFO, logging.WARNING):
+            app.logger.setLevel(level)
+            timing = measure(lambda: logging_into_seq.send_log_to_seq(
+                "PostgreSQL - - Выполняется запрос.", properties), repeat)
+            results.append({'benchmark': 'send_log_to_seq',
+                            'logging': 'enabled' if level == logging.INFO else 'disabled',
+                            **timing})
+        app.logger.setLevel(logging.NOTSET)
+
+    return results
+
+
+def run(db_name=None, row_counts=(1, 100, 1000, 10000), repeat=50, seq_server=None):
+    db_name = db_name or default_db_name()
+    seq_server = seq_server or StubSeqServer().start()
+    app = create_app(bench_config(seq_server.url))
+
+    results = bench_execute_sql(app, db_name, repeat)
+    results += bench_select_all(app, db_name, row_counts, repeat)
+    results += bench_logging(app, repeat * 20)
+
+    return results
+
+
+def print_results(results):
+    for result in results:
+        name = ' '.join(f"{key}={value}" for key, value in result.items()
+                        if isinstance(value, str) or key == 'rows')
+        print(f"{name:<60} p50 {result['p50'] * 1000:9.3f} мс   "
+              f"p99 {result['p99'] * 1000:9.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="имя базы данных из PROJECT_DATA_BASES")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print_results(run(args.db, args.rows, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Сравнение сериализации ответов: config.JsonEncoder и app.serialization.JsonEncoder
+
+Строки похожи на результат select по матчам: id, названия, коэффициенты NUMERIC
+(Decimal), время начала, флаги. Запуск из корня проекта:
+
+    python -m benchmarks.bench_json [--rows 100 1000 10000] [--repeat 20]
+"""
+
+import argparse
+import datetime
+import decimal
+import json
+import random
+import uuid
+
+import config
+from app import serialization
+from app.row_factories import ROW_RECORD, ROW_TUPLE, make_rows
+from benchmarks.common import measure
+
+COLUMNS = ('match_id', 'league', 'home', 'away', 'start_time', 'odds_home', 'odds_draw',
+           'odds_away', 'total', 'is_live', 'event_uid')
+
+
+def make_records(count, seed=0):
+    """Кортежи строк, как их отдает курсор"""
+
+    rnd = random.Random(seed)
+    start = datetime.datetime(2021, 9, 1, 12, 0)
+    return [(
+        100000 + i,
+        f"Лига {rnd.randint(1, 50)}",
+        f"Команда {rnd.randint(1, 500)}",
+        f"Команда {rnd.randint(1, 500)}",
+        start + datetime.timedelta(minutes=15 * i),
+        decimal.Decimal(f"{rnd.uniform(1.01, 9.99):.2f}"),
+        decimal.Decimal(f"{rnd.uniform(1.01, 9.99):.2f}"),
+        decimal.Decimal(f"{rnd.uniform(1.01, 9.99):.2f}"),
+        decimal.Decimal(f"{rnd.uniform(0.5, 5.5):.1f}"),
+        bool(i % 3),
+        uuid.UUID(int=rnd.getrandbits(128)),
+    ) for i in range(count)]
+
+
+def make_datasets(count):
+    """Одни и те же строки в форматах ROW_DICT, ROW_TUPLE и ROW_RECORD"""
+
+    records = make_records(count)
+    description = [(name,) for name in COLUMNS]
+    return {
+        'dict': [dict(zip(COLUMNS, record)) for record in records],
+        'tuple': make_rows(records, description, ROW_TUPLE),
+        'record': make_rows(records, description, ROW_RECORD),
+    }
+
+
+class BaselineEncoder(config.JsonEncoder):
+    """config.JsonEncoder с поддержкой дат и UUID - иначе базовый вариант
+    не сериализует эти строки вовсе"""
+
+    def default(self, obj):
+        if isinstance(obj, datetime.date):
+            return obj.isoformat()
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        return super().default(obj)
+
+
+def _encoder(encoder_class):
+    # Параметры, с которыми Flask jsonify создает encoder.
+    return encoder_class(ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def run(row_counts=(100, 1000, 10000), repeat=20):
+    """Результаты для всех размеров выборки и форматов строк"""
+
+    encoders = {'baseline': _encoder(BaselineEncoder),
+                'serialization': _encoder(serialization.JsonEncoder)}
+    results = []
+
+    for count in row_counts:
+        for row_format, rows in make_datasets(count).items():
+            payload = {'result': rows}
+            outputs = {}
+            for name, encoder in encoders.items():
+                timing = measure(lambda: encoder.encode(payload), repeat)
+                outputs[name] = json.loads(encoder.encode(payload))
+                results.append({'benchmark': 'json_encode', 'encoder': name,
+                                'engine': serialization.get_engine() if name != 'baseline'
+                                else 'stdlib',
+                                'rows': count, 'row_format': row_format, **timing})
+            if outputs['baseline'] != outputs['serialization']:
+                raise AssertionError(f"Разный JSON для {row_format}, {count} строк")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeat)
+    print_results(results)
+
+
+def print_results(results):
+    baseline = {(r['rows'], r['row_format']): r['p50'] for r in results
+                if r['encoder'] == 'baseline'}
+
+    print(f"{'rows':>7} {'format':>7} {'encoder':>14} {'p50, ms':>9} {'speedup':>8}")
+    for result in results:
+        key = (result['rows'], result['row_format'])
+        print(f"{result['rows']:>7} {result['row_format']:>7} {result['encoder']:>14} "
+              f"{result['p50'] * 1000:>9.3f} {baseline[key] / result['p50']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Бенчмарк холодного старта процесса
+
+Каждый замер - новый процесс Python, как новый воркер gunicorn без preload_app:
+импорт пакета app, create_app и первый запрос через тестовый клиент. Времена
+берутся из app.startup (те же показатели, что bc_startup_* в /metrics).
+Замеры выполняются с включенной и выключенной документацией API (API_DOC_ENABLED).
+
+    python -m benchmarks.bench_startup [--repeat 10] [--path /]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import summarize
+from benchmarks.stub_seq import StubSeqServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys
+from app import create_app, startup
+from benchmarks.common import bench_config
+app = create_app(bench_config(sys.argv[1]))
+app.test_client().get(sys.argv[2])
+print(json.dumps(startup.get_stats()))
+"""
+
+METRICS = ('import_seconds', 'create_app_seconds', 'boot_seconds', 'first_request_seconds')
+
+
+def cold_start(seq_url, path, api_doc):
+    """Замеры старта одного нового процесса"""
+
+    env = dict(os.environ, API_DOC_ENABLED=json.dumps(api_doc))
+    output = subprocess.run([sys.executable, '-c', CHILD, seq_url, path], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat=10, path='/', seq_server=None):
+    seq_server = seq_server or StubSeqServer().start()
+
+    results = []
+    for api_doc in (False, True):
+        starts = [cold_start(seq_server.url, path, api_doc) for _ in range(repeat)]
+        for metric in METRICS:
+            timings = [stats[metric] for stats in starts if metric in stats]
+            results.append({'benchmark': f"startup_{metric[:-len('_seconds')]}",
+                            'path': path, 'api_doc': api_doc, **summarize(timings)})
+
+    return results
+
+
+def print_results(results):
+    for result in results:
+        print(f"{result['benchmark']:<24} api_doc={result['api_doc']!s:<5} "
+              f"p50 {result['p50'] * 1000:9.3f} мс   p99 {result['p99'] * 1000:9.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--path', default='/', help="путь первого запроса")
+    args = parser.parse_args()
+
+    print_results(run(args.repeat, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Общие части бенчмарков: замеры, перцентили, приложение для бенчмарков и базовые результаты
+
+Приложение создается фабрикой create_app с настройками BenchConfig: логи уходят
+в заглушку seq (benchmarks.stub_seq), базы данных берутся из PROJECT_DATA_BASES
+(.env или переменные окружения), как при обычном запуске.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import statistics
+import time
+
+from config import Config
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Эталонные результаты, которые хранятся в репозитории
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def percentile(values, percent):
+    """Перцентиль percent (0-100) методом ближайшего ранга"""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(timings):
+    """Сводка по списку времен в секундах"""
+
+    return {
+        'count': len(timings),
+        'mean': statistics.fmean(timings) if timings else None,
+        'p50': percentile(timings, 50),
+        'p99': percentile(timings, 99),
+        'min': min(timings, default=None),
+        'max': max(timings, default=None),
+    }
+
+
+def measure(func, repeat, warmup=1):
+    """Выполняет func warmup + repeat раз и возвращает сводку по времени вызова"""
+
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    return summarize(timings)
+
+
+def bench_config(seq_url, **overrides):
+    """Класс настроек приложения для бенчмарков"""
+
+    seq_log_conf = dict(Config.SEQ_LOG_CONF or {}, server_url=seq_url, api_key=None)
+    seq_log_conf.setdefault('level', 'INFO')
+    seq_log_conf.setdefault('batch_size', 100)
+    seq_log_conf.setdefault('auto_flush_timeout', 1)
+    seq_log_conf.setdefault('override_root_logger', True)
+
+    attributes = {'SEQ_LOG_CONF': seq_log_conf, 'RESULT_CACHE_BACKEND': ''}
+    attributes.update(overrides)
+
+    return type('BenchConfig', (Config,), attributes)
+
+
+@contextlib.contextmanager
+def request_context(app, path='/'):
+    """Контекст запроса с выполненными before_request (g.db_connections, g.perf),
+    как при настоящем запросе. Соединения возвращаются в пул при выходе"""
+
+    with app.test_request_context(path):
+        app.preprocess_request()
+        yield
+
+
+def default_db_name():
+    """Первая база данных из PROJECT_DATA_BASES"""
+
+    databases = Config.PROJECT_DATA_BASES or {}
+    if not databases:
+        raise SystemExit("Не заданы PROJECT_DATA_BASES (.env или переменная окружения).")
+
+    return next(iter(databases))
+
+
+def environment():
+    """Описание окружения, в котором получены результаты"""
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save_results(name, results, path=None):
+    """Сохраняет результаты в JSON: {environment, results}. Возвращает путь файла"""
+
+    path = path or os.path.join(RESULTS_PATH, f"{name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump({'environment': environment(), 'results': results}, results_file,
+                  ensure_ascii=False, indent=2)
+
+    return path
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as results_file:
+        return json.load(results_file)['results']
+
+
+# Поля, которые определяют замер (остальные - измеренные значения)
+KEY_FIELDS = ('benchmark', 'encoder', 'db', 'path', 'rows', 'row_format', 'logging',
+              'concurrency', 'api_doc')
+
+
+def _key(result):
+    return tuple((name, result[name]) for name in KEY_FIELDS if name in result)
+
+
+def compare(baseline, current, metric='p50', threshold=0.1):
+    """Сравнивает результаты с базовыми по метрике времени metric.
+
+    Возвращает список (результат, базовое значение, текущее значение, изменение),
+    изменение - доля (0.25 - на 25% медленнее). Регрессия - изменение больше threshold."""
+
+    baseline = {_key(result): result for result in baseline}
+    changes = []
+    for result in current:
+        base = baseline.get(_key(result))
+        if base is None or not base.get(metric) or result.get(metric) is None:
+            continue
+        change = result[metric] / base[metric] - 1
+        changes.append((result, base[metric], result[metric], change, change > threshold))
+
+    return changes
+
+
+def print_comparison(changes, metric='p50'):
+    """Печатает сравнение и возвращает количество регрессий"""
+
+    regressions = 0
+    for result, base, value, change, regression in changes:
+        name = ' '.join(f"{k}={v}" for k, v in _key(result))
+        mark = 'РЕГРЕССИЯ' if regression else ''
+        print(f"{name}: {metric} {base * 1000:.3f} -> {value * 1000:.3f} мс "
+              f"({change:+.1%}) {mark}")
+        regressions += regression
+
+    return regressions
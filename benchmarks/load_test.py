@@ -0,0 +1,180 @@
+"""Нагрузочный тест: пропускная способность и задержки endpoint под конкурентной нагрузкой
+
+По умолчанию поднимает приложение из фабрики create_app в многопоточном сервере
+werkzeug (логи уходят в заглушку seq) и добавляет к нему endpoint бенчмарков:
+    /api/bench/ping - без базы данных (накладные расходы Flask, логирования, метрик);
+    /api/bench/select/<rows> - database.select_all на rows строк и ответ в JSON.
+С --url нагружает уже запущенный сервер (например, gunicorn) по путям --paths.
+
+    python -m benchmarks.load_test [--concurrency 8] [--requests 2000]
+        [--paths /api/bench/ping /api/bench/select/100] [--url http://127.0.0.1:5000]
+"""
+
+import argparse
+import http.client
+import threading
+import time
+import urllib.parse
+
+from flask import Blueprint
+from werkzeug.serving import make_server
+
+from app import create_app, database
+from benchmarks.common import bench_config, default_db_name, summarize
+from benchmarks.stub_seq import StubSeqServer
+
+DEFAULT_PATHS = ('/api/bench/ping', '/api/bench/select/10', '/api/bench/select/1000')
+
+SELECT_ROWS = ("SELECT g AS id, 'Команда ' || g AS name, (g %% 1000) / 100.0 AS odds, "
+               "now() AS start_time FROM generate_series(1, %s) g")
+
+
+def bench_blueprint(db_name):
+    """Endpoint бенчмарков. Запросы идут в db_name: префикс /api может не
+    совпадать с именем базы данных"""
+
+    bp = Blueprint('bench', __name__, url_prefix='/api/bench')
+
+    @bp.route('/ping')
+    def ping():
+        return {'result': 'ok'}
+
+    @bp.route('/select/<int:rows>')
+    def select(rows):
+        return {'result': database.select_all(SELECT_ROWS, (rows,), db_name)}
+
+    return bp
+
+
+class LocalServer:
+    """Приложение в многопоточном сервере werkzeug на свободном порту"""
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(name="LocalServer", target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+def _client(url, paths, requests, latencies, errors, lock):
+    """Поток клиента: выполняет запросы по очереди, по кругу по paths"""
+
+    parsed = urllib.parse.urlsplit(url)
+    connection = None
+    own_latencies = {path: [] for path in paths}
+    own_errors = 0
+
+    for index in range(requests):
+        path = paths[index % len(paths)]
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                own_errors += 1
+            if response.getheader('Connection', '').lower() == 'close' or response.version < 11:
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            own_errors += 1
+            if connection is not None:
+                connection.close()
+            connection = None
+            continue
+        own_latencies[path].append(time.perf_counter() - started)
+
+    if connection is not None:
+        connection.close()
+
+    with lock:
+        for path, values in own_latencies.items():
+            latencies[path].extend(values)
+        errors[0] += own_errors
+
+
+def load(url, paths, concurrency=8, requests=2000):
+    """Выполняет requests запросов в concurrency потоков. Результат по каждому пути:
+    количество, ошибки, запросов в секунду, p50 и p99"""
+
+    latencies = {path: [] for path in paths}
+    errors = [0]
+    lock = threading.Lock()
+    per_client = max(requests // concurrency, 1)
+
+    clients = [threading.Thread(target=_client,
+                                args=(url, paths, per_client, latencies, errors, lock))
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    results = [{'benchmark': 'load', 'path': 'all', 'concurrency': concurrency,
+                'errors': errors[0], 'elapsed': elapsed, 'rps': total / elapsed,
+                **summarize([value for values in latencies.values() for value in values])}]
+    for path, values in latencies.items():
+        results.append({'benchmark': 'load', 'path': path, 'concurrency': concurrency,
+                        'rps': len(values) / elapsed, **summarize(values)})
+
+    return results
+
+
+def run(url=None, paths=DEFAULT_PATHS, concurrency=8, requests=2000, db_name=None,
+        seq_server=None):
+    """Нагружает url или, если он не задан, локальный сервер приложения"""
+
+    if url:
+        return load(url, paths, concurrency, requests)
+
+    seq_server = seq_server or StubSeqServer().start()
+    app = create_app(bench_config(seq_server.url))
+    app.register_blueprint(bench_blueprint(db_name or default_db_name()))
+
+    with LocalServer(app) as server:
+        load(server.url, paths, concurrency, min(requests, 10 * concurrency))  # прогрев
+        results = load(server.url, paths, concurrency, requests)
+
+    for result in results:
+        result['logs_received'] = seq_server.stats['events']
+
+    return results
+
+
+def print_results(results):
+    for result in results:
+        print(f"{result['path']:<28} {result['count']:>7} запросов  {result['rps']:>9.1f} rps  "
+              f"p50 {result['p50'] * 1000:8.2f} мс  p99 {result['p99'] * 1000:8.2f} мс"
+              if result['count'] else f"{result['path']:<28} нет успешных запросов")
+    print(f"ошибок: {results[0]['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="адрес запущенного сервера; по умолчанию локальный")
+    parser.add_argument('--paths', nargs='+', default=list(DEFAULT_PATHS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--db', help="имя базы данных из PROJECT_DATA_BASES")
+    args = parser.parse_args()
+
+    print_results(run(args.url, args.paths, args.concurrency, args.requests, args.db))
+
+
+if __name__ == '__main__':
+    main()
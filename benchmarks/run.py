@@ -0,0 +1,88 @@
+"""Запуск всех бенчмарков, сохранение результатов и сравнение с базовыми
+
+Результаты сохраняются в benchmarks/results/<name>.json (окружение и список
+замеров, каталог не хранится в git). Эталонные результаты лежат в репозитории
+в benchmarks/baseline.json - с ними сравнивается запуск с --compare без файла:
+
+    python -m benchmarks.run --compare
+
+Чтобы проверить изменение на регрессии на своей машине, сохраните базовые
+результаты до изменения и сравните с ними результаты после:
+
+    python -m benchmarks.run --name baseline
+    ... изменения ...
+    python -m benchmarks.run --name current --compare benchmarks/results/baseline.json
+
+--save-baseline обновляет benchmarks/baseline.json (после изменений, которые
+осознанно меняют производительность).
+
+Сравнение выполняется по p50; регрессия - замедление больше --threshold
+(по умолчанию 10%). При регрессиях код возврата 1.
+"""
+
+import argparse
+import sys
+
+from benchmarks import bench_db, bench_json, bench_startup, load_test
+from benchmarks.common import (BASELINE_PATH, compare, load_results, print_comparison,
+                               save_results)
+from benchmarks.stub_seq import StubSeqServer
+
+SUITES = ('json', 'db', 'load', 'startup')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--name', default='current', help="имя файла результатов")
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--db', help="имя базы данных из PROJECT_DATA_BASES")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH,
+                        help="файл базовых результатов (без значения - benchmarks/baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="сохранить результаты в benchmarks/baseline.json")
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    seq_server = StubSeqServer().start()
+    results = []
+
+    if 'json' in args.suites:
+        json_results = bench_json.run(repeat=args.repeat)
+        bench_json.print_results(json_results)
+        results += json_results
+
+    if 'db' in args.suites:
+        db_results = bench_db.run(args.db, repeat=args.repeat, seq_server=seq_server)
+        bench_db.print_results(db_results)
+        results += db_results
+
+    if 'load' in args.suites:
+        load_results_ = load_test.run(concurrency=args.concurrency, requests=args.requests,
+                                      db_name=args.db, seq_server=seq_server)
+        load_test.print_results(load_results_)
+        results += load_results_
+
+    if 'startup' in args.suites:
+        startup_results = bench_startup.run(repeat=max(args.repeat // 5, 1),
+                                            seq_server=seq_server)
+        bench_startup.print_results(startup_results)
+        results += startup_results
+
+    print(f"Результаты сохранены в {save_results(args.name, results)}")
+    if args.save_baseline:
+        print(f"Эталонные результаты сохранены в "
+              f"{save_results(args.name, results, BASELINE_PATH)}")
+
+    if args.compare:
+        regressions = print_comparison(
+            compare(load_results(args.compare), results, threshold=args.threshold))
+        if regressions:
+            print(f"Регрессий: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Заглушка сервера seq для бенчмарков
+
+Принимает пачки логов seqlog по HTTP ({"Events": [...]}), считает пачки и записи
+и сразу отвечает 201, поэтому отправка логов не упирается во внешний сервер.
+
+    python -m benchmarks.stub_seq [--port 5341]
+"""
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSeqServer(ThreadingHTTPServer):
+    """HTTP сервер-заглушка seq. port=0 - свободный порт"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.stats = {'batches': 0, 'events': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(name="StubSeqServer", target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            events = len(json.loads(body)['Events'])
+        except (ValueError, KeyError, TypeError):
+            events = 0
+        with self.server.lock:
+            self.server.stats['batches'] += 1
+            self.server.stats['events'] += events
+            self.server.stats['bytes'] += len(body)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка сервера seq")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5341)
+    args = parser.parse_args()
+
+    server = StubSeqServer(args.host, args.port)
+    print(f"Заглушка seq слушает {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
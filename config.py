@@ -12,7 +12,10 @@ SEQ_LOG_CONF = ''
 
 
 class JsonEncoder(json.JSONEncoder):
-    """Добавление метода сериализации данных типа Decimal в json формат."""
+    """Добавление метода сериализации данных типа Decimal в json формат.
+
+    Строки app.row_factories.Row - кортежи, json сериализует их сам как массивы,
+    так же как ROW_TUPLE и столбцы ROW_COLUMNS."""
 
     def default(self, obj):
         if isinstance(obj, decimal.Decimal):
@@ -45,7 +48,116 @@ class Config(object):
         'PROJECT_DATA_BASES')) or PROJECT_DATA_BASES
     SEQ_LOG_CONF = json_loads(os.environ.get('SEQ_LOG_CONF')) or SEQ_LOG_CONF
 
-    # API_DOC: настройки авто документирования проекта
+    # Пулы соединений: прогрев при запуске, ожидание свободного соединения (секунды)
+    # (null - без ограничения) и проверка SELECT 1 соединений, простаивавших дольше
+    # DB_POOL_PRE_PING секунд (0 - каждого соединения, null - выключена)
+    DB_POOL_WARM_UP = json_loads(os.environ.get('DB_POOL_WARM_UP', 'true'))
+    DB_POOL_TIMEOUT = json_loads(os.environ.get('DB_POOL_TIMEOUT', '5'))
+    DB_POOL_PRE_PING = json_loads(os.environ.get('DB_POOL_PRE_PING', '30'))
+
+    # Реплики для чтения (ключ replicas в PROJECT_DATA_BASES, см. app.db_routing):
+    # способ выбора реплики (least_outstanding или latency), интервал проверки реплик
+    # в секундах (0 - не проверять) и число ошибок подряд, после которого реплика исключается
+    DB_REPLICA_BALANCING = os.environ.get('DB_REPLICA_BALANCING') or 'least_outstanding'
+    DB_REPLICA_HEALTH_INTERVAL = json_loads(os.environ.get('DB_REPLICA_HEALTH_INTERVAL', '5'))
+    DB_REPLICA_MAX_FAILURES = json_loads(os.environ.get('DB_REPLICA_MAX_FAILURES')) or 3
+
+    # Ограничение одновременных запросов к базе данных (см. app.admission): включено ли,
+    # верхняя граница limit (по умолчанию - удвоенное число соединений пулов базы),
+    # размер очереди и время ожидания в ней (секунды), во сколько раз задержка должна
+    # превысить базовую для уменьшения limit, и Retry-After ответа 503 (секунды)
+    DB_ADMISSION = json_loads(os.environ.get('DB_ADMISSION', 'true'))
+    DB_ADMISSION_MAX_LIMIT = json_loads(os.environ.get('DB_ADMISSION_MAX_LIMIT'))
+    DB_ADMISSION_QUEUE_SIZE = json_loads(os.environ.get('DB_ADMISSION_QUEUE_SIZE')) or 50
+    DB_ADMISSION_QUEUE_TIMEOUT = json_loads(os.environ.get('DB_ADMISSION_QUEUE_TIMEOUT')) or 1
+    DB_ADMISSION_TOLERANCE = json_loads(os.environ.get('DB_ADMISSION_TOLERANCE')) or 2
+    DB_ADMISSION_RETRY_AFTER = json_loads(os.environ.get('DB_ADMISSION_RETRY_AFTER')) or 1
+
+    # Срок работы запроса с базами данных (см. app.deadlines): включен ли, срок
+    # по умолчанию в секундах (0 - без ограничения, endpoint меняет его декоратором
+    # deadlines.timeout), заголовок, которым клиент может сократить срок, и через сколько
+    # секунд после срока незавершенный sql запрос отменяется
+    DB_DEADLINES = json_loads(os.environ.get('DB_DEADLINES', 'true'))
+    REQUEST_TIMEOUT = json_loads(os.environ.get('REQUEST_TIMEOUT', '30'))
+    REQUEST_TIMEOUT_HEADER = os.environ.get('REQUEST_TIMEOUT_HEADER') or 'X-Request-Timeout'
+    DB_CANCEL_GRACE = json_loads(os.environ.get('DB_CANCEL_GRACE', '0.5'))
+
+    # Логировать текст каждого sql запроса с подставленными данными
+    DB_LOG_SQL = json_loads(os.environ.get('DB_LOG_SQL', 'true'))
+    # Выполнять запросы через PREPARE/EXECUTE и размер кеша подготовленных запросов на соединение
+    DB_PREPARED_STATEMENTS = json_loads(os.environ.get('DB_PREPARED_STATEMENTS', 'false'))
+    DB_PREPARED_CACHE_SIZE = json_loads(os.environ.get('DB_PREPARED_CACHE_SIZE')) or 100
+
+    # Объединять одинаковые одновременные select_all/select_one в один запрос к базе
+    # и сколько секунд ждать результат выполняющегося запроса, прежде чем выполнить свой.
+    # Результат общий для всех ожидавших, поэтому по умолчанию выключено: вызов включает
+    # объединение сам (coalesce=True), если не изменяет результат
+    DB_SINGLE_FLIGHT = json_loads(os.environ.get('DB_SINGLE_FLIGHT', 'false'))
+    DB_SINGLE_FLIGHT_TIMEOUT = json_loads(os.environ.get('DB_SINGLE_FLIGHT_TIMEOUT')) or 30
+
+    # Размер пачки строк, которую select_stream забирает с сервера за один раз
+    DB_STREAM_BATCH_SIZE = json_loads(os.environ.get('DB_STREAM_BATCH_SIZE')) or 2000
+    # Количество строк, которые insert_many/execute_many отправляют за одно обращение к серверу
+    DB_BATCH_PAGE_SIZE = json_loads(os.environ.get('DB_BATCH_PAGE_SIZE')) or 1000
+    # Сериализатор ответов: orjson (если установлен) или stdlib, см. app.serialization.
+    # orjson не экранирует не-ASCII символы, поэтому используется только с JSON_AS_ASCII = false
+    JSON_ENGINE = os.environ.get('JSON_ENGINE') or 'orjson'
+    JSON_AS_ASCII = json_loads(os.environ.get('JSON_AS_ASCII', 'false'))
+    # Количество строк, которые json_stream_response отправляет клиенту одним куском
+    JSON_STREAM_CHUNK_ROWS = json_loads(os.environ.get('JSON_STREAM_CHUNK_ROWS')) or 500
+
+    # Профилировщик sql запросов (см. app.query_profiler): статистика не больше чем
+    # по DB_PROFILER_MAX_QUERIES отпечаткам (давно не вызывавшиеся вытесняются), запросы дольше
+    # DB_SLOW_QUERY_THRESHOLD секунд попадают в журнал из DB_SLOW_QUERY_LOG_SIZE записей,
+    # для доли DB_EXPLAIN_SAMPLE_RATE из них (0 - выключено) не чаще раза в DB_EXPLAIN_INTERVAL
+    # секунд на запрос выполняется EXPLAIN ANALYZE (не дольше DB_EXPLAIN_TIMEOUT секунд),
+    # каждые DB_PROFILER_DUMP_INTERVAL секунд
+    # (0 - выключено) DB_PROFILER_DUMP_LIMIT самых дорогих запросов логируются в seq
+    DB_PROFILER = json_loads(os.environ.get('DB_PROFILER', 'true'))
+    DB_PROFILER_MAX_QUERIES = json_loads(os.environ.get('DB_PROFILER_MAX_QUERIES')) or 1000
+    DB_SLOW_QUERY_THRESHOLD = json_loads(os.environ.get('DB_SLOW_QUERY_THRESHOLD')) or 0.5
+    DB_SLOW_QUERY_LOG_SIZE = json_loads(os.environ.get('DB_SLOW_QUERY_LOG_SIZE')) or 100
+    DB_EXPLAIN_SAMPLE_RATE = json_loads(os.environ.get('DB_EXPLAIN_SAMPLE_RATE')) or 0
+    DB_EXPLAIN_INTERVAL = json_loads(os.environ.get('DB_EXPLAIN_INTERVAL')) or 300
+    DB_EXPLAIN_TIMEOUT = json_loads(os.environ.get('DB_EXPLAIN_TIMEOUT')) or 30
+    DB_PROFILER_DUMP_INTERVAL = json_loads(os.environ.get('DB_PROFILER_DUMP_INTERVAL', '300'))
+    DB_PROFILER_DUMP_LIMIT = json_loads(os.environ.get('DB_PROFILER_DUMP_LIMIT')) or 20
+
+    # Заранее подготовленные ответы (см. app.payloads): обновлять ли их в фоновом потоке,
+    # интервал обновления, сколько секунд сверх интервала отдавать устаревший ответ,
+    # пока он обновляется, случайное отклонение интервала (доля) и через сколько секунд
+    # повторять построение после ошибки (удваивается с каждой ошибкой подряд)
+    PAYLOADS = json_loads(os.environ.get('PAYLOADS', 'true'))
+    PAYLOAD_REFRESH_INTERVAL = json_loads(os.environ.get('PAYLOAD_REFRESH_INTERVAL')) or 60
+    PAYLOAD_STALE = json_loads(os.environ.get('PAYLOAD_STALE', '300'))
+    PAYLOAD_JITTER = json_loads(os.environ.get('PAYLOAD_JITTER', '0.1'))
+    PAYLOAD_RETRY = json_loads(os.environ.get('PAYLOAD_RETRY')) or 1
+
+    # ETag, ответы 304 и сжатие ответов (см. app.http_cache): включено ли, минимальный
+    # размер сжимаемого ответа в байтах, уровень gzip, качество brotli и сколько сжатых
+    # ответов хранить в кеше процесса. brotli - необязательный пакет из requirements/optional.txt
+    HTTP_CACHE = json_loads(os.environ.get('HTTP_CACHE', 'true'))
+    HTTP_COMPRESS_MIN_SIZE = json_loads(os.environ.get('HTTP_COMPRESS_MIN_SIZE')) or 1024
+    HTTP_COMPRESS_LEVEL = json_loads(os.environ.get('HTTP_COMPRESS_LEVEL')) or 6
+    HTTP_BROTLI_QUALITY = json_loads(os.environ.get('HTTP_BROTLI_QUALITY')) or 5
+    HTTP_COMPRESS_CACHE_SIZE = json_loads(os.environ.get('HTTP_COMPRESS_CACHE_SIZE')) or 128
+
+    # Кеш результатов select запросов: memory, file, redis или пустая строка (выключен).
+    # Для redis нужен пакет redis из requirements/optional.txt
+    RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    RESULT_CACHE_MAX_ENTRIES = json_loads(os.environ.get('RESULT_CACHE_MAX_ENTRIES')) or 1000
+    RESULT_CACHE_PATH = os.environ.get(
+        'RESULT_CACHE_PATH') or os.path.join(TMP_FILES_PATH, 'result_cache')
+    RESULT_CACHE_URL = os.environ.get('RESULT_CACHE_URL') or 'redis://localhost:6379/0'
+
+    # Приложение загружается один раз в мастер-процессе gunicorn и передается воркерам
+    # через fork (см. gunicorn.conf.py и app.startup). Мастер при этом не создает пулы
+    APP_PRELOAD = json_loads(os.environ.get('APP_PRELOAD', 'false'))
+
+    # API_DOC: настройки авто документирования проекта. Документация строится при
+    # запуске, поэтому по умолчанию включена только при FLASK_ENV=development
+    API_DOC_ENABLED = json_loads(os.environ.get(
+        'API_DOC_ENABLED', json.dumps(os.environ.get('FLASK_ENV') == 'development')))
     API_DOC_MEMBER = ['api']
     # RESTful Api документы, которые должны быть исключены
     RESTFUL_API_DOC_EXCLUDE = []
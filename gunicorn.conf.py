@@ -0,0 +1,42 @@
+"""Настройки gunicorn
+
+Запуск:
+    gunicorn -c gunicorn.conf.py bc_master:app
+
+При APP_PRELOAD=true приложение загружается один раз в мастер-процессе (preload_app),
+воркеры получают его через fork и делят память с мастером. Чтобы сборщик мусора
+не копировал эту память в каждый воркер, объекты мастера замораживаются (gc.freeze)
+перед созданием воркеров. Соединения с базами данных нельзя передавать между
+процессами, поэтому мастер-процесс закрывает свои пулы перед созданием воркера,
+а поток логов и пулы воркера создает app.startup.post_fork.
+
+Без preload_app мастер приложение не загружает, а воркер создает и прогревает пулы
+в create_app, поэтому хуки fork ничего не делают.
+"""
+
+import gc
+from config import Config
+
+preload_app = Config.APP_PRELOAD
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def pre_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+
+    from app import database_async, db_pools
+    db_pools.close_pools()
+    database_async.close_pools()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+
+    from app import startup
+    startup.post_fork(server.app.wsgi())
@@ -0,0 +1,5 @@
+"""Тесты модулей приложения, которые не требуют базы данных.
+
+Запуск из корня проекта:
+python -m pytest
+"""
@@ -0,0 +1,30 @@
+"""Общие фикстуры тестов"""
+
+import pytest
+from flask import Flask
+from app import result_cache
+
+
+@pytest.fixture
+def app():
+    """Минимальное приложение Flask без баз данных: логирование в seq выключено
+    (уровень логгера по умолчанию выше INFO)"""
+
+    app = Flask(__name__)
+    app.config.update(REQUEST_TIMEOUT=30, REQUEST_TIMEOUT_HEADER='X-Request-Timeout')
+    return app
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    """Кеш результатов в памяти вместо настроенного в приложении"""
+
+    backend = result_cache.MemoryBackend(max_entries=10)
+    monkeypatch.setattr(result_cache, '_BACKEND', backend)
+    return backend
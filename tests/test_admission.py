@@ -0,0 +1,115 @@
+"""Тесты app.admission"""
+
+import threading
+import time
+import pytest
+from flask import g
+from app import admission
+
+
+def _limiter(limit=2, max_limit=10, queue_size=1, tolerance=2):
+    return admission.Limiter('api', limit, max_limit, queue_size, tolerance)
+
+
+def test_acquire_and_release():
+    limiter = _limiter(limit=1)
+
+    assert limiter.acquire(0) is None
+    assert limiter.inflight == 1
+    assert limiter.acquire(0.01) == 'timeout'
+
+    limiter.release()
+    assert limiter.inflight == 0
+    assert limiter.acquire(0) is None
+
+
+def test_queue_full():
+    limiter = _limiter(limit=1, queue_size=0)
+    limiter.acquire(0)
+
+    assert limiter.acquire(1) == 'queue_full'
+    assert limiter.get_stats()['rejected'] == 1
+
+
+def test_waiting_request_admitted_after_release():
+    limiter = _limiter(limit=1)
+    limiter.acquire(0)
+    results = []
+
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    limiter.release()
+    waiter.join(5)
+
+    assert results == [None]
+    assert limiter.inflight == 1
+    assert limiter.get_stats()['queued'] == 1
+
+
+def test_limit_grows_under_normal_latency():
+    limiter = _limiter(limit=2)
+    for _ in range(20):
+        limiter.acquire(0)
+        limiter.release(latency=0.01)
+
+    assert limiter.limit > 2
+    assert limiter.baseline == pytest.approx(0.01)
+
+
+def test_limit_capped_by_max_limit():
+    limiter = _limiter(limit=2, max_limit=3)
+    for _ in range(100):
+        limiter.acquire(0)
+        limiter.acquire(0)
+        limiter.release(latency=0.01)
+        limiter.release(latency=0.01)
+
+    assert limiter.limit == 3
+
+
+def test_limit_decreases_once_per_slow_batch():
+    limiter = _limiter(limit=10)
+    limiter.acquire(0)
+    limiter.release(latency=0.01)
+
+    for _ in range(5):
+        limiter.acquire(0)
+        limiter.release(latency=1.0)
+
+    assert limiter.limit == pytest.approx(10 * admission._DECREASE_FACTOR)
+    assert limiter.get_stats()['decreases'] == 1
+
+
+def test_overload_decreases_limit_to_minimum():
+    limiter = _limiter(limit=2)
+    for _ in range(50):
+        limiter.acquire(0)
+        limiter.decrease_after = 0.0
+        limiter.release(overloaded=True)
+
+    assert limiter.limit == limiter.min_limit
+
+
+def test_admit_waits_no_longer_than_deadline(app, monkeypatch):
+    app.config.update(PROJECT_DATA_BASES={'api': {}}, DB_ADMISSION_QUEUE_TIMEOUT=10,
+                      DB_ADMISSION_RETRY_AFTER=3)
+
+    @app.route('/api/leagues/')
+    def leagues():
+        return ''
+
+    limiter = _limiter(limit=1)
+    limiter.acquire(0)
+    monkeypatch.setattr(admission, 'LIMITERS', {'api': limiter})
+
+    with app.test_request_context('/api/leagues/'):
+        g.deadline = time.monotonic() + 0.05
+        started = time.monotonic()
+        with pytest.raises(admission.Overloaded) as error:
+            admission.admit()
+
+    assert time.monotonic() - started < 1
+    assert error.value.code == 503
+    assert error.value.retry_after == 3
@@ -0,0 +1,54 @@
+"""Тесты кодирования значений для COPY в app.bulk_write"""
+
+import datetime
+import decimal
+import psycopg2.extras
+import pytest
+from app import bulk_write
+
+
+@pytest.mark.parametrize('values, literal', [
+    ([1, 2], '{"1","2"}'),
+    ([], '{}'),
+    (['a"b', 'c\\d', None], '{"a\\"b","c\\\\d",NULL}'),
+    ([[1, 2], [3, 4]], '{{"1","2"},{"3","4"}}'),
+    ([True, False], '{"t","f"}'),
+])
+def test_array_literal(values, literal):
+    assert bulk_write._array_literal(values) == literal
+
+
+@pytest.mark.parametrize('value, text', [
+    (None, '\\N'),
+    (1, '1'),
+    (decimal.Decimal('1.50'), '1.50'),
+    (True, 't'),
+    (False, 'f'),
+    ('a\tb\nc\rd\\e', 'a\\tb\\nc\\rd\\\\e'),
+    (datetime.date(2021, 9, 1), '2021-09-01'),
+    (b'\x00\xff', '\\\\x00ff'),
+    ({'a': 'б'}, '{"a": "б"}'),
+    (psycopg2.extras.Json([1, 2]), '[1, 2]'),
+    ([1, None], '{"1",NULL}'),
+])
+def test_copy_value(value, text):
+    assert bulk_write._copy_value(value) == text
+
+
+def test_copy_rows_reader():
+    rows = [(1, 'a'), (2, None), (3, 'c\td')]
+    expected = '1\ta\n2\t\\N\n3\tc\\td\n'
+
+    assert bulk_write.CopyRowsReader(rows).read() == expected
+
+    reader = bulk_write.CopyRowsReader(rows)
+    chunks = []
+    while True:
+        chunk = reader.read(5)
+        if not chunk:
+            break
+        assert len(chunk) <= 5
+        chunks.append(chunk)
+
+    assert ''.join(chunks) == expected
+    assert reader.count == 3
@@ -0,0 +1,108 @@
+"""Тесты транзакций app.database и сброса кеша результатов без базы данных"""
+
+import pytest
+from flask import g
+from app import database, result_cache
+
+
+class FakeCursor:
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, data_for_query=None):
+        self.queries.append(query)
+
+
+class FakeConnection:
+    """Соединение psycopg2, которое только запоминает commit и rollback"""
+
+    def __init__(self):
+        self.autocommit = True
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def connection(app_context):
+    connection = FakeConnection()
+    g.db_connections = {'api': connection}
+    return connection
+
+
+def _load(value):
+    return result_cache.get_or_load('api', "select * from leagues", None, 'dict', 60, None,
+                                    lambda: value)
+
+
+def test_reads_own_writes(connection):
+    assert not database.reads_own_writes('api')
+
+    with database.transaction('api'):
+        assert database.in_transaction('api')
+        assert database.reads_own_writes('api')
+
+    assert not database.in_transaction('api')
+    assert database.reads_own_writes('api')
+    assert not database.reads_own_writes('tennis')
+
+
+def test_commit_invalidates_tables_of_transaction(connection, memory_cache):
+    _load('old')
+
+    with database.transaction('api'):
+        database.invalidate_cache('api', "update leagues set name = %s")
+        # Другой запрос успел закешировать данные до фиксации транзакции
+        assert _load('old') == 'old'
+
+    assert connection.commits == 1
+    assert connection.autocommit
+    assert _load('new') == 'new'
+
+
+def test_rollback_invalidates_tables_of_transaction(connection, memory_cache):
+    _load('old')
+
+    with pytest.raises(RuntimeError):
+        with database.transaction('api'):
+            database.invalidate_cache('api', "delete from leagues")
+            assert _load('during') == 'during'
+            raise RuntimeError
+
+    assert connection.rollbacks == 1
+    assert connection.autocommit
+    assert 'api' not in g.cache_tables_in_transaction
+    assert _load('after') == 'after'
+
+
+def test_commit_keeps_pending_tables_of_other_database(connection, memory_cache):
+    g.cache_tables_in_transaction = {'tennis': {'matches'}}
+
+    with database.transaction('api'):
+        database.invalidate_cache('api', "insert into leagues (id) values (1)")
+
+    assert g.cache_tables_in_transaction == {'tennis': {'matches'}}
+
+
+def test_nested_transaction_commits_once(connection):
+    with database.transaction('api'):
+        with database.transaction('api'):
+            pass
+        assert connection.commits == 0
+
+    assert connection.commits == 1
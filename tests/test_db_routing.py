@@ -0,0 +1,73 @@
+"""Тесты app.db_routing"""
+
+import pytest
+from app import db_pools, db_routing
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    """Две реплики базы данных api, поток проверки не запускается"""
+
+    monkeypatch.setattr(db_routing, 'REPLICAS', {})
+    monkeypatch.setitem(db_routing._SETTINGS, 'app', None)
+    monkeypatch.setattr(db_pools, 'get_replicas',
+                        lambda db_name: ('api_r1', 'api_r2') if db_name == 'api' else ())
+    return ('api_r1', 'api_r2')
+
+
+def test_no_replicas(replicas):
+    assert db_routing.choose('tennis') is None
+
+
+def test_least_outstanding(replicas):
+    first = db_routing.choose('api')
+    second = db_routing.choose('api')
+    assert {first, second} == set(replicas)
+
+    db_routing.release(first)
+    assert db_routing.choose('api') == first
+    assert db_routing.REPLICAS[first].stats['routed'] == 2
+
+
+def test_release_not_below_zero(replicas):
+    db_routing.release('api_r1')
+    assert db_routing.REPLICAS['api_r1'].outstanding == 0
+
+
+def test_failed_replica_ejected_until_success(replicas, app_context, monkeypatch):
+    monkeypatch.setitem(db_routing._SETTINGS, 'max_failures', 2)
+
+    db_routing.report_failure('api_r1')
+    assert db_routing.REPLICAS['api_r1'].healthy
+    db_routing.report_failure('api_r1')
+    assert not db_routing.REPLICAS['api_r1'].healthy
+
+    assert all(db_routing.choose('api') == 'api_r2' for _ in range(5))
+
+    db_routing.report_success('api_r1')
+    assert db_routing.REPLICAS['api_r1'].healthy
+
+
+def test_no_healthy_replicas(replicas, app_context, monkeypatch):
+    monkeypatch.setitem(db_routing._SETTINGS, 'max_failures', 1)
+    for key in replicas:
+        db_routing.report_failure(key)
+
+    assert db_routing.choose('api') is None
+
+
+def test_observe_latency_average(replicas):
+    db_routing.observe('api_r1', 1.0)
+    db_routing.observe('api_r1', 2.0)
+
+    assert db_routing.REPLICAS['api_r1'].latency == pytest.approx(1.0 + db_routing._LATENCY_ALPHA)
+
+
+def test_latency_balancing_prefers_fast_replica(replicas, monkeypatch):
+    monkeypatch.setitem(db_routing._SETTINGS, 'balancing', db_routing.BALANCING_LATENCY)
+    db_routing.observe('api_r1', 0.001)
+    db_routing.observe('api_r2', 1.0)
+
+    chosen = [db_routing.choose('api') for _ in range(200)]
+
+    assert chosen.count('api_r1') > chosen.count('api_r2')
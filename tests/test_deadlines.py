@@ -0,0 +1,116 @@
+"""Тесты app.deadlines"""
+
+import threading
+import time
+import pytest
+from flask import g
+from psycopg2.extensions import QueryCanceledError
+from app import deadlines
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+@pytest.fixture
+def routes(app):
+    @app.route('/default/')
+    def default():
+        return ''
+
+    @app.route('/unlimited/')
+    @deadlines.timeout(None)
+    def unlimited():
+        return ''
+
+    @app.route('/long/')
+    @deadlines.timeout(300)
+    def long():
+        return ''
+
+    return app
+
+
+@pytest.mark.parametrize('path, header, seconds', [
+    ('/default/', None, 30),
+    ('/default/', '2.5', 2.5),
+    ('/default/', '60', 30),
+    ('/default/', 'abc', 30),
+    ('/default/', '-1', 30),
+    ('/long/', None, 300),
+    ('/unlimited/', '5', 5),
+    ('/unlimited/', None, None),
+])
+def test_start(routes, path, header, seconds):
+    headers = {'X-Request-Timeout': header} if header else {}
+    with routes.test_request_context(path, headers=headers):
+        deadlines.start()
+        left = deadlines.remaining()
+
+    if seconds is None:
+        assert left is None
+    else:
+        assert seconds - 1 < left <= seconds
+
+
+def test_remaining_outside_app_context():
+    assert deadlines.remaining() is None
+
+
+def test_begin(app_context):
+    assert deadlines.begin('api') == ('', None)
+
+    g.deadline = time.monotonic() + 2
+    set_timeout, cancel_at = deadlines.begin('api')
+    assert set_timeout.startswith('SET LOCAL statement_timeout = ')
+    assert 1000 < int(set_timeout.split('=')[1].strip(' ;')) <= 2000
+    assert cancel_at > g.deadline
+
+
+def test_begin_expired(app_context):
+    g.deadline = time.monotonic() - 1
+
+    with pytest.raises(deadlines.DeadlineExceeded) as error:
+        deadlines.begin('api')
+
+    assert error.value.code == 504
+    assert error.value.reason == 'expired'
+
+
+def test_watchdog_cancels_overdue_query():
+    connection = FakeConnection()
+    watch = deadlines.watch(connection, time.monotonic())
+
+    assert connection.cancelled.wait(5)
+    assert deadlines.unwatch(watch) is True
+
+
+def test_unwatch_before_deadline():
+    connection = FakeConnection()
+    watch = deadlines.watch(connection, time.monotonic() + 60)
+
+    assert deadlines.unwatch(watch) is False
+    assert not connection.cancelled.is_set()
+
+
+def test_statement_cancelled_not_by_deadline(app_context):
+    g.deadline = time.monotonic() + 60
+
+    with pytest.raises(QueryCanceledError):
+        with deadlines.statement(FakeConnection(), 'api'):
+            raise QueryCanceledError('canceling statement due to user request')
+
+
+def test_statement_timeout_becomes_deadline_exceeded(app_context):
+    g.deadline = time.monotonic() + 0.01
+    with pytest.raises(deadlines.DeadlineExceeded) as error:
+        with deadlines.statement(FakeConnection(), 'api'):
+            time.sleep(0.02)
+            raise QueryCanceledError('canceling statement due to statement timeout')
+
+    assert error.value.reason == 'timeout'
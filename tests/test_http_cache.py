@@ -0,0 +1,105 @@
+"""Тесты app.http_cache на тестовом приложении Flask"""
+
+import gzip
+import pytest
+from flask import Response, jsonify
+from app import http_cache
+
+BIG = {'items': list(range(1000))}
+
+
+@pytest.fixture
+def client(app):
+    @app.route('/small/')
+    def small():
+        return jsonify({'id': 1})
+
+    @app.route('/big/')
+    def big():
+        return jsonify(BIG)
+
+    @app.route('/cached/')
+    @http_cache.cache_control(max_age=5, public=True, stale_while_revalidate=30)
+    def cached():
+        return jsonify({'id': 1})
+
+    @app.route('/no_etag/')
+    @http_cache.cache_control(no_store=True, etag=False, compress=False)
+    def no_etag():
+        return jsonify(BIG)
+
+    @app.route('/stream/')
+    def stream():
+        return Response(iter([b'[', b']']), mimetype='application/json')
+
+    @app.route('/post/', methods=['POST'])
+    def post():
+        return jsonify({'id': 1})
+
+    app.after_request(http_cache.process_response)
+    return app.test_client()
+
+
+def test_content_etag():
+    assert http_cache.content_etag(b'a') == http_cache.content_etag(b'a')
+    assert http_cache.content_etag(b'a') != http_cache.content_etag(b'b')
+
+
+def test_cache_control_directives():
+    @http_cache.cache_control(max_age=0, private=True, no_cache=True, must_revalidate=True)
+    def view():
+        pass
+
+    assert view.http_cache_policy.cache_control == 'private, no-cache, max-age=0, must-revalidate'
+
+
+def test_etag_and_not_modified(client):
+    response = client.get('/small/')
+    etag = response.headers['ETag']
+    assert etag.strip('"') == http_cache.content_etag(response.get_data())
+    assert 'Cache-Control' not in response.headers
+
+    response = client.get('/small/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+
+def test_cache_control_header(client):
+    response = client.get('/cached/')
+    assert response.headers['Cache-Control'] == 'public, max-age=5, stale-while-revalidate=30'
+
+
+def test_gzip_with_own_etag(client):
+    plain = client.get('/big/')
+    response = client.get('/big/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+    response = client.get('/big/', headers={'Accept-Encoding': 'gzip',
+                                             'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_small_response_not_compressed(client):
+    response = client.get('/small/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_policy_without_etag_and_compression(client):
+    response = client.get('/no_etag/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'ETag' not in response.headers
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+@pytest.mark.parametrize('method, path', [('GET', '/stream/'), ('POST', '/post/')])
+def test_skipped_responses(client, method, path):
+    response = client.open(path, method=method, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'ETag' not in response.headers
+    assert 'Content-Encoding' not in response.headers
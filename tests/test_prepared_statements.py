@@ -0,0 +1,136 @@
+"""Тесты app.prepared_statements без базы данных"""
+
+import types
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from app import prepared_statements
+
+
+class FakeCursor:
+    """Курсор, который запоминает запросы. На PREPARE отвечает типами параметров
+    соединения или ошибкой, если типы не заданы"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = []
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, data_for_query=None):
+        self.connection.executed.append((query, data_for_query))
+        if query.startswith('PREPARE'):
+            if self.connection.parameter_types is None:
+                raise psycopg2.ProgrammingError('syntax error')
+            self.result = (self.connection.parameter_types,)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConnection:
+
+    def __init__(self, parameter_types=()):
+        self.autocommit = True
+        self.info = types.SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+        self.parameter_types = parameter_types
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def _statements(connection, prefix):
+    return [query for query, _ in connection.executed if query.startswith(prefix)]
+
+
+def test_normalize_query():
+    assert prepared_statements.normalize_query("select *\n  from\tleagues ") == \
+        "select * from leagues"
+
+
+@pytest.mark.parametrize('query, converted', [
+    ("select 1", ("select 1", 0)),
+    ("select %s, %s", ("select $1, $2", 2)),
+    ("select %(a)s, %(b)s, %(a)s", ("select $1, $2, $1", ('a', 'b'))),
+    ("select '100%%', %s", ("select '100%', $1", 1)),
+    ("select %s, %(a)s", None),
+])
+def test_convert_placeholders(query, converted):
+    assert prepared_statements.convert_placeholders(query) == converted
+
+
+def test_prepares_once_per_connection():
+    connection = FakeConnection(['integer'])
+    cursor = connection.cursor()
+
+    assert prepared_statements.execute_prepared(cursor, "select * from t where id = %s", (1,))
+    assert prepared_statements.execute_prepared(cursor, "select * from t where id = %s", (2,))
+
+    assert len(_statements(connection, 'PREPARE')) == 1
+    assert [data for query, data in connection.executed
+            if query.startswith('EXECUTE')] == [[1], [2]]
+
+
+def test_named_params_in_prepare_order():
+    connection = FakeConnection(['integer', 'integer'])
+    cursor = connection.cursor()
+
+    assert prepared_statements.execute_prepared(
+        cursor, "select * from t where a = %(a)s and b = %(b)s", {'b': 2, 'a': 1})
+    assert connection.executed[-1][1] == [1, 2]
+
+
+@pytest.mark.parametrize('data_for_query', [([1, 2],), ((1, 2),)])
+def test_list_params_not_prepared(data_for_query):
+    connection = FakeConnection(['integer[]'])
+
+    assert not prepared_statements.execute_prepared(
+        connection.cursor(), "select * from t where id = any(%s)", data_for_query)
+    assert connection.executed == []
+
+
+def test_transaction_not_prepared():
+    connection = FakeConnection(['integer'])
+    connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+
+    assert not prepared_statements.execute_prepared(
+        connection.cursor(), "select * from t where id = %s", (1,))
+    assert connection.executed == []
+
+
+def test_failed_prepare_remembered():
+    connection = FakeConnection(None)
+    cursor = connection.cursor()
+
+    assert not prepared_statements.execute_prepared(cursor, "selec 1")
+    assert not prepared_statements.execute_prepared(cursor, "selec 1")
+    assert len(_statements(connection, 'PREPARE')) == 1
+
+
+def test_text_param_with_other_type_falls_back_per_call():
+    connection = FakeConnection(['text'])
+    cursor = connection.cursor()
+
+    assert not prepared_statements.execute_prepared(cursor, "select %s", (1,))
+    assert prepared_statements.execute_prepared(cursor, "select %s", ('a',))
+    assert prepared_statements.execute_prepared(cursor, "select %s", (None,))
+    assert not prepared_statements.execute_prepared(cursor, "select %s", (2,))
+    assert len(_statements(connection, 'PREPARE')) == 1
+
+
+def test_cache_size_deallocates_old_statements():
+    connection = FakeConnection()
+    cursor = connection.cursor()
+
+    for number in range(3):
+        prepared_statements.execute_prepared(cursor, f"select {number}", cache_size=2)
+
+    assert len(_statements(connection, 'DEALLOCATE')) == 1
+    prepared_statements.invalidate(connection)
+    assert prepared_statements._get_cache(connection) == {}
@@ -0,0 +1,59 @@
+"""Тесты отпечатков запросов app.query_profiler"""
+
+import pytest
+from app import query_profiler
+
+
+@pytest.mark.parametrize('query, text', [
+    ("select * from t where id = 1", "select * from t where id = ?"),
+    ("select *\n  from t\twhere name = 'it''s'", "select * from t where name = ?"),
+    ("select * from t where id = %s and x = %(x)s", "select * from t where id = ? and x = ?"),
+    ("EXECUTE bc_stmt_1 ($1, $2)", "EXECUTE bc_stmt_1 (?, ?)"),
+    ("select * from t where id in (1, 2, 3)", "select * from t where id in (...)"),
+    ("select * from t where id IN(%s,%s)", "select * from t where id IN(...)"),
+    ("select 1.5e3, t2.col1 from t2", "select ?, t2.col1 from t2"),
+])
+def test_fingerprint_text(query, text):
+    assert query_profiler.fingerprint(query)[0] == text
+
+
+def test_fingerprint_id_same_for_different_literals():
+    first = query_profiler.fingerprint("select * from t where id in (1, 2)")
+    second = query_profiler.fingerprint("select * from t  where id in (3, 4, 5)")
+    other = query_profiler.fingerprint("select * from t where name in (1, 2)")
+
+    assert first[1] == second[1]
+    assert first[1] != other[1]
+    assert len(first[1]) == 16
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    """Пустая статистика, медленные запросы не учитываются"""
+
+    monkeypatch.setattr(query_profiler, 'QUERIES', query_profiler.collections.OrderedDict())
+    monkeypatch.setitem(query_profiler._SETTINGS, 'slow_threshold', 3600)
+    monkeypatch.setitem(query_profiler._SETTINGS, 'max_queries', 2)
+    return query_profiler.QUERIES
+
+
+def test_record_keyed_by_database(profiler):
+    query_profiler.record('api', "select 1", None, 0.1, rows=1)
+    query_profiler.record('api', "select 2", None, 0.3, rows=1)
+    query_profiler.record('tennis', "select 1", None, 0.2)
+
+    report = query_profiler.get_report(sort='total')['queries']
+    # select 1 и select 2 - один отпечаток, но в разных базах данных - разные
+    assert [(stats['db'], stats['calls']) for stats in report] == [('api', 2), ('tennis', 1)]
+    assert report[0]['rows'] == 2
+    assert report[0]['mean'] == pytest.approx(0.2)
+
+
+def test_record_evicts_least_recently_called(profiler):
+    query_profiler.record('api', "select * from a", None, 0.1)
+    query_profiler.record('api', "select * from b", None, 0.1)
+    query_profiler.record('api', "select * from a", None, 0.1)
+    query_profiler.record('api', "select * from c", None, 0.1)
+
+    assert [stats.fingerprint for stats in profiler.values()] == \
+        ["select * from a", "select * from c"]
@@ -0,0 +1,107 @@
+"""Тесты app.result_cache"""
+
+import time
+import pytest
+from app import result_cache
+
+
+@pytest.mark.parametrize('query, tables', [
+    ("select * from leagues", {'leagues'}),
+    ("SELECT * FROM public.\"Leagues\" l JOIN matches m ON m.league_id = l.id",
+     {'leagues', 'matches'}),
+    ("select * from a, b where a.id = b.id", {'a', 'b'}),
+    ("select * from (select 1 from q) s, r", {'q', 'r'}),
+    ("select * from a join b on true, c", {'a', 'b', 'c'}),
+    ("select * from a, lateral (select * from b) x", {'a', 'b'}),
+    ("insert into matches (id) values (%s)", {'matches'}),
+    ("update only teams set name = %s", {'teams'}),
+    ("truncate table a, b", {'a', 'b'}),
+    ("select 'from x' as text from t", {'t'}),
+])
+def test_tables_in_query(query, tables):
+    assert result_cache.tables_in_query(query) == frozenset(tables)
+
+
+def test_no_backend_calls_loader(monkeypatch):
+    monkeypatch.setattr(result_cache, '_BACKEND', None)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return len(calls)
+
+    assert result_cache.get_or_load('api', 'select 1', None, 'dict', 60, None, loader) == 1
+    assert result_cache.get_or_load('api', 'select 1', None, 'dict', 60, None, loader) == 2
+
+
+def test_hit_until_table_invalidated(memory_cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [{'id': len(calls)}]
+
+    query = "select * from leagues"
+    first = result_cache.get_or_load('api', query, None, 'dict', 60, None, loader)
+    assert result_cache.get_or_load('api', query, None, 'dict', 60, None, loader) is first
+    assert len(calls) == 1
+
+    # Сброс таблицы другой базы данных запись не трогает
+    result_cache.invalidate('tennis', ['leagues'])
+    assert result_cache.get_or_load('api', query, None, 'dict', 60, None, loader) is first
+
+    result_cache.invalidate_query('api', "update leagues set name = %s")
+    assert result_cache.get_or_load('api', query, None, 'dict', 60, None, loader) == [{'id': 2}]
+    assert len(calls) == 2
+
+
+def test_key_depends_on_params_and_row_factory(memory_cache):
+    query = "select * from leagues where id = %s"
+    result_cache.get_or_load('api', query, (1,), 'dict', 60, None, lambda: 'one')
+
+    assert result_cache.get_or_load('api', query, (2,), 'dict', 60, None, lambda: 'two') == 'two'
+    assert result_cache.get_or_load('api', query, (1,), 'tuple', 60, None,
+                                    lambda: 'tuple') == 'tuple'
+    assert result_cache.get_or_load('api', query, (1,), 'dict', 60, None, lambda: None) == 'one'
+
+
+def test_explicit_tags(memory_cache):
+    query = "select * from leagues_view"
+    result_cache.get_or_load('api', query, None, 'dict', 60, ['leagues'], lambda: 'old')
+
+    result_cache.invalidate('api', ['leagues'])
+
+    assert result_cache.get_or_load('api', query, None, 'dict', 60, ['leagues'],
+                                    lambda: 'new') == 'new'
+
+
+def test_expired_entry_reloaded(memory_cache, monkeypatch):
+    result_cache.get_or_load('api', "select 1 from t", None, 'dict', 10, None, lambda: 'old')
+
+    now = time.time()
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now + 11)
+
+    assert result_cache.get_or_load('api', "select 1 from t", None, 'dict', 10, None,
+                                    lambda: 'new') == 'new'
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = result_cache.MemoryBackend(max_entries=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    assert backend.get('c') == 3
+
+
+def test_memory_backend_tags():
+    backend = result_cache.MemoryBackend()
+    backend.bump_tags(['api:a'], 5)
+
+    assert backend.tag_versions(['api:a', 'api:b']) == [5, 0]
+
+    backend.clear()
+    assert backend.tag_versions(['api:a']) == [0]
@@ -0,0 +1,73 @@
+"""Тесты app.row_factories"""
+
+import pickle
+import pytest
+from app import row_factories
+from app.row_factories import ROW_COLUMNS, ROW_DICT, ROW_RECORD, ROW_TUPLE
+
+DESCRIPTION = (('id', 23), ('name', 25), ('class', 25))
+RECORDS = [(1, 'a', 'x'), (2, 'b', 'y')]
+
+
+def test_row_access():
+    row = row_factories.row_class(('id', 'name', 'class'))((1, 'a', 'x'))
+
+    assert row == (1, 'a', 'x')
+    assert row[0] == row['id'] == row.id == 1
+    assert row[-1] == row['class'] == 'x'
+    assert row[1:] == ('a', 'x')
+    assert row.get('name') == 'a'
+    assert row.get('missing', 0) == 0
+    assert row.keys() == ('id', 'name', 'class')
+    assert row._asdict() == {'id': 1, 'name': 'a', 'class': 'x'}
+    assert repr(row) == "Row(id=1, name='a', class='x')"
+    # Ключевое слово не становится атрибутом
+    assert not hasattr(row, 'class')
+    with pytest.raises(KeyError):
+        row['missing']
+
+
+def test_row_class_cached():
+    assert row_factories.row_class(('id',)) is row_factories.row_class(('id',))
+
+
+def test_row_pickle():
+    row = row_factories.row_class(('id', 'name'))((1, 'a'))
+    restored = pickle.loads(pickle.dumps(row))
+
+    assert restored == row
+    assert restored.name == 'a'
+    assert type(restored) is type(row)
+
+
+def test_make_rows():
+    assert row_factories.make_rows(RECORDS, DESCRIPTION, ROW_TUPLE) is RECORDS
+
+    records = row_factories.make_rows(RECORDS, DESCRIPTION, ROW_RECORD)
+    assert records[1].name == 'b'
+
+    assert row_factories.make_rows(RECORDS, DESCRIPTION, ROW_COLUMNS) == \
+        {'id': [1, 2], 'name': ['a', 'b'], 'class': ['x', 'y']}
+    assert row_factories.make_rows([], DESCRIPTION, ROW_COLUMNS) == \
+        {'id': [], 'name': [], 'class': []}
+
+    with pytest.raises(ValueError):
+        row_factories.make_rows(RECORDS, DESCRIPTION, 'unknown')
+
+
+def test_make_row():
+    assert row_factories.make_row(None, DESCRIPTION, ROW_RECORD) is None
+    assert row_factories.make_row(RECORDS[0], DESCRIPTION, ROW_RECORD).id == 1
+    assert row_factories.make_row(RECORDS[0], DESCRIPTION, ROW_COLUMNS) == \
+        {'id': [1], 'name': ['a'], 'class': ['x']}
+
+
+@pytest.mark.parametrize('result, row_factory, count', [
+    (None, ROW_DICT, 0),
+    ([{'id': 1}], ROW_DICT, 1),
+    (RECORDS, ROW_TUPLE, 2),
+    ({'id': [1, 2], 'name': ['a', 'b']}, ROW_COLUMNS, 2),
+    ({}, ROW_COLUMNS, 0),
+])
+def test_rows_count(result, row_factory, count):
+    assert row_factories.rows_count(result, row_factory) == count
@@ -0,0 +1,67 @@
+"""Тесты app.serialization: orjson и стандартный json дают одинаковый JSON"""
+
+import datetime
+import decimal
+import json
+import uuid
+import pytest
+from app import row_factories, serialization
+
+DATA = {
+    'decimal': decimal.Decimal('1.5'),
+    'date': datetime.date(2021, 9, 1),
+    'datetime': datetime.datetime(2021, 9, 1, 12, 30),
+    'time': datetime.time(12, 30),
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'row': row_factories.row_class(('id', 'name'))((1, 'а')),
+    'tuple': (1, 2),
+    'big': 2 ** 70,
+    'text': 'матч',
+}
+
+EXPECTED = {
+    'decimal': 1.5,
+    'date': '2021-09-01',
+    'datetime': '2021-09-01T12:30:00',
+    'time': '12:30:00',
+    'uuid': '12345678-1234-5678-1234-567812345678',
+    'row': [1, 'а'],
+    'tuple': [1, 2],
+    'big': 2 ** 70,
+    'text': 'матч',
+}
+
+
+@pytest.fixture(params=[serialization.ENGINE_ORJSON, serialization.ENGINE_STDLIB])
+def engine(request, monkeypatch):
+    if request.param == serialization.ENGINE_ORJSON and serialization.orjson is None:
+        pytest.skip("orjson не установлен")
+    monkeypatch.setattr(serialization, '_ENGINE', request.param)
+    return request.param
+
+
+def test_encode(engine):
+    encoded = serialization.JsonEncoder(ensure_ascii=False).encode(DATA)
+    assert json.loads(encoded) == EXPECTED
+    assert 'матч' in encoded
+
+
+def test_dumps_bytes(engine):
+    encoded = serialization.dumps_bytes(DATA)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == EXPECTED
+
+
+def test_ensure_ascii(engine):
+    assert serialization.dumps_bytes({'text': 'я'}, ensure_ascii=True) == b'{"text":"\\u044f"}'
+
+
+def test_unknown_type(engine):
+    with pytest.raises(TypeError):
+        serialization.JsonEncoder().encode({'value': object()})
+
+
+def test_init_app(app):
+    app.config['JSON_ENGINE'] = 'unknown'
+    with pytest.raises(ValueError):
+        serialization.init_app(app)
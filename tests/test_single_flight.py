@@ -0,0 +1,107 @@
+"""Тесты app.single_flight"""
+
+import threading
+import time
+import pytest
+from app import single_flight
+
+
+def _run_concurrently(count, func):
+    results = [None] * count
+    threads = [threading.Thread(target=lambda number=number: results.__setitem__(number, func()))
+               for number in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def _wait_followers(key, count):
+    """Ждет, пока count вызовов начнут ждать результат ведущего вызова key"""
+
+    event = single_flight._CALLS[key].event
+    while len(event._cond._waiters) < count:
+        time.sleep(0.001)
+
+
+def test_single_call():
+    assert single_flight.do('api', 'single', lambda: 42) == (42, False)
+
+
+def test_concurrent_calls_share_result():
+    started = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return 'result'
+
+    leader, leader_result = _run_concurrently(1, lambda: single_flight.do('api', 'key', loader))
+    started.wait(5)
+    followers, results = _run_concurrently(
+        3, lambda: single_flight.do('api', 'key', loader, timeout=5))
+    _wait_followers('key', 3)
+    finish.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert calls == [1]
+    assert leader_result == [('result', False)]
+    assert results == [('result', True)] * 3
+
+
+def test_error_shared_and_key_released():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def failing():
+        started.set()
+        finish.wait(5)
+        raise ValueError('boom')
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do('api', 'error', failing, timeout=5)
+        except ValueError as err:
+            errors.append(err)
+
+    leader, _ = _run_concurrently(1, call)
+    started.wait(5)
+    followers, _ = _run_concurrently(2, call)
+    _wait_followers('error', 2)
+    finish.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert 'error' not in single_flight._CALLS
+    assert single_flight.do('api', 'error', lambda: 'ok') == ('ok', False)
+
+
+def test_follower_timeout_calls_loader():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow():
+        started.set()
+        finish.wait(5)
+        return 'slow'
+
+    leader, _ = _run_concurrently(1, lambda: single_flight.do('api', 'timeout', slow))
+    started.wait(5)
+    try:
+        assert single_flight.do('api', 'timeout', lambda: 'own', timeout=0.01) == ('own', False)
+    finally:
+        finish.set()
+        leader[0].join(5)
+
+    assert single_flight.STATS['api']['timeouts'] >= 1
+
+
+def test_leader_error_propagates():
+    with pytest.raises(KeyError):
+        single_flight.do('api', 'raise', lambda: {}['missing'])
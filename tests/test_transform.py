@@ -0,0 +1,122 @@
+"""Тесты app.views.commons.transform"""
+
+import operator
+import pytest
+from app import row_factories
+from app.views.commons import transform
+from app.views.commons.transform import Level
+
+COLUMNS = ('league_id', 'league', 'match_id', 'goals')
+TUPLES = [
+    (1, 'A', 10, 3),
+    (2, 'B', 20, None),
+    (1, 'A', 11, 1),
+]
+
+
+@pytest.fixture(params=['dict', 'record', 'tuple'])
+def rows(request):
+    """Одни и те же строки в разных форматах app.row_factories и columns для них"""
+
+    if request.param == 'dict':
+        return [dict(zip(COLUMNS, row)) for row in TUPLES], None
+    if request.param == 'record':
+        return list(map(row_factories.row_class(COLUMNS), TUPLES)), None
+    return TUPLES, COLUMNS
+
+
+def test_to_dicts(rows):
+    rows, columns = rows
+    assert transform.to_dicts(rows, columns)[0] == dict(zip(COLUMNS, TUPLES[0]))
+
+
+def test_index_by(rows):
+    rows, columns = rows
+    result = transform.index_by(rows, 'match_id', fields=('goals',), columns=columns)
+
+    assert result == {10: {'goals': 3}, 20: {'goals': None}, 11: {'goals': 1}}
+
+
+def test_index_by_composite_key_last_row_wins(rows):
+    rows, columns = rows
+    result = transform.index_by(rows, ('league_id', 'league'), fields=('match_id',),
+                                columns=columns)
+
+    assert result == {(1, 'A'): {'match_id': 11}, (2, 'B'): {'match_id': 20}}
+
+
+def test_group_by(rows):
+    rows, columns = rows
+    result = transform.group_by(rows, 'league_id', fields=('match_id',), columns=columns)
+
+    assert list(result) == [1, 2]
+    assert result[1] == [{'match_id': 10}, {'match_id': 11}]
+
+
+def test_group_by_keeps_rows():
+    rows = [dict(zip(COLUMNS, row)) for row in TUPLES]
+    result = transform.group_by(rows, ['league_id'])
+
+    assert result[(1,)][0] is rows[0]
+
+
+def test_pivot(rows):
+    rows, columns = rows
+    result = transform.pivot(rows, 'league', 'league_id', 'goals', columns=columns)
+    assert result == {'A': {1: 1}, 'B': {2: None}}
+
+
+def test_pivot_aggregate():
+    rows = [{'team': 'x', 'season': 1, 'goals': 2}, {'team': 'x', 'season': 1, 'goals': 3}]
+    assert transform.pivot(rows, 'team', 'season', 'goals', aggregate=operator.add) == \
+        {'x': {1: 5}}
+
+
+def test_nest(rows):
+    rows, columns = rows
+    result = transform.nest(rows, [Level('league_id', ('league_id', 'league'), 'matches')],
+                            leaf=('match_id',), columns=columns)
+
+    assert result == [
+        {'league_id': 1, 'league': 'A', 'matches': [{'match_id': 10}, {'match_id': 11}]},
+        {'league_id': 2, 'league': 'B', 'matches': [{'match_id': 20}]},
+    ]
+
+
+def test_nest_keyed_levels(rows):
+    rows, columns = rows
+    result = transform.nest(rows, [Level('league_id', children='matches'),
+                                   Level('match_id', children='goals')],
+                            leaf=('goals',), keyed=True, columns=columns)
+
+    assert result[1]['matches'][11] == {'match_id': 11, 'goals': [{'goals': 1}]}
+    assert list(result[1]['matches']) == [10, 11]
+
+
+def test_nest_without_leaf_rows():
+    rows = [{'league_id': 1, 'match_id': 10}]
+    assert transform.nest(rows, [('league_id', None, 'matches')], leaf=()) == \
+        [{'league_id': 1, 'matches': []}]
+
+
+def test_columns_of(rows):
+    rows, columns = rows
+    result = transform.columns_of(rows, ('match_id',), columns)
+    assert result == {'match_id': [10, 20, 11]}
+    assert transform.columns_of([], ('match_id',)) == {'match_id': []}
+
+
+@pytest.mark.parametrize('use_numpy', [False, pytest.param(True, marks=pytest.mark.skipif(
+    transform._numpy() is None, reason="numpy не установлен"))])
+def test_aggregate(rows, use_numpy):
+    rows, columns = rows
+    result = transform.aggregate(rows, 'league_id', ('goals',), columns, use_numpy=use_numpy)
+
+    assert result == {
+        1: {'count': 2, 'goals': {'sum': 4.0, 'min': 1.0, 'max': 3.0, 'mean': 2.0}},
+        2: {'count': 1, 'goals': {'sum': None, 'min': None, 'max': None, 'mean': None}},
+    }
+
+
+def test_aggregate_empty():
+    assert transform.aggregate([], 'league_id', ('goals',), use_numpy=False) == {}